@@ -0,0 +1,47 @@
+"""
+Time the Koi programs in this directory on every backend.
+
+    python benchmarks/run.py [--repeat N] [program.koi ...]
+
+Every program runs in its own process from the repository root, the best
+wall clock time of the repeats is reported.
+"""
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKENDS = ["tree", "closure", "vm"]
+
+
+def time_program(program: Path, backend: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "src", "--backend", backend, str(program)],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", nargs="*", type=Path)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    programs = args.programs or sorted(Path(__file__).parent.glob("*.koi"))
+    for program in programs:
+        for backend in BACKENDS:
+            seconds = time_program(program, backend, args.repeat)
+            print(f"{program.name:<16} {backend:<8} {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Check that FastScanner produces the same tokens and errors as Scanner.
+
+    python benchmarks/scanner_diff.py [--sources N] [--seed S]
+
+Compares the two on every .koi file in examples/ and benchmarks/ and on N
+random sources made of Koi fragments and stray characters. FastScanner
+scans each source both whole and line by line, like it reads a file.
+Prints the first source that differs and exits with 1 when any do.
+"""
+import argparse
+import io
+import random
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.koi.fast_scanner import FastScanner  # noqa: E402
+from src.koi.scanner import Scanner  # noqa: E402
+
+# Pieces random sources are made of, characters Koi doesn't know included
+FRAGMENTS = [
+    *Scanner.keywords,
+    *"(){},.-+;*%/!=<>",
+    *"!= == <= >= // x _y1 foo Bar9 0 7 12.5 3. .5 007".split(),
+    *"@#$&|~^?:'",
+    *["\n", " ", "\t", "\r", '"', '"str"', '"multi\nline"', "// comment\n"],
+]
+
+
+def scan(scanner_class, source):
+    """The tokens and errors `scanner_class` produces for `source`"""
+    errors = []
+    scanner = scanner_class(source, on_error=lambda *error: errors.append(error))
+    tokens = [
+        (token.tok_type, token.lexeme, token.literal, token.line)
+        for token in scanner.scan_tokens()
+    ]
+    return tokens, errors
+
+
+def random_source(rng: random.Random) -> str:
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 60)))
+
+
+def differs(source: str) -> bool:
+    expected = scan(Scanner, source)
+    # Lines end at "\n" only, like the lines of a file
+    streamed = list(io.StringIO(source, newline="\n"))
+    return (
+        scan(FastScanner, source) != expected or scan(FastScanner, streamed) != expected
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    files = sorted(ROOT.glob("examples/*.koi")) + sorted(ROOT.glob("benchmarks/*.koi"))
+    rng = random.Random(args.seed)
+    sources = [path.read_text() for path in files]
+    sources += [random_source(rng) for _ in range(args.sources)]
+    for source in sources:
+        if differs(source):
+            print(f"The scanners differ on:\n{source!r}")
+            sys.exit(1)
+    print(f"Same tokens and errors for {len(sources)} sources")
+
+
+if __name__ == "__main__":
+    main()
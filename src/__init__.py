@@ -1,4 +1,5 @@
 from .koi.scanner import Scanner
+from .koi.fast_scanner import FastScanner
 from .koi.token_type import TokenType
 from .koi.tokens import Token
 from .koi.parser import Parser
@@ -6,6 +6,7 @@ from .expr import (
     ExprVisitor,
     Get,
     Grouping,
+    Inline,
     Literal,
     Logical,
     Set,
@@ -32,6 +33,9 @@ class AstPrinter(ExprVisitor):
     def visit_grouping_expr(self, expr: Grouping):
         return self._parenthesize("group", expr.expression)
 
+    def visit_inline_expr(self, expr: Inline):
+        return expr.call.accept(self)
+
     def visit_literal_expr(self, expr: Literal):
         if expr.value is None:
             return "nil"
@@ -0,0 +1,52 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from .function_type import FunctionType
+from .tokens import Token
+
+
+class Chunk:
+    """
+    A sequence of bytecode along with its constant pool, and for every byte
+    the token of the code it was compiled from, which runtime errors report
+    """
+
+    def __init__(self) -> None:
+        self.code: List[int] = []
+        self.tokens: List[Optional[Token]] = []
+        self.constants: List[Any] = []
+        self._constant_index: Dict[Tuple[type, Any], int] = {}
+
+    def write(self, byte: int, token: Optional[Token]) -> int:
+        self.code.append(int(byte))
+        self.tokens.append(token)
+        return len(self.code) - 1
+
+    def add_constant(self, value: Any) -> int:
+        # Numbers and strings are shared by value, anything else (functions,
+        # tokens, global cells) by identity. The type is part of the key so
+        # 1.0 and True never collapse into the same constant.
+        if isinstance(value, (float, int, str)):
+            key = (type(value), value)
+        else:
+            key = (type(value), id(value))
+        index = self._constant_index.get(key)
+        if index is None:
+            index = self._constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+
+class CompiledFunction:
+    """The compiled form of a Koi function, the VM wraps it in a closure"""
+
+    def __init__(self, name: str, kind: FunctionType) -> None:
+        self.name = name
+        self.kind = kind
+        self.arity = 0
+        self.upvalue_count = 0
+        self.chunk = Chunk()
+
+    def __repr__(self) -> str:
+        if self.kind == FunctionType.NONE:
+            return "<script>"
+        return f"<function {self.name}>"
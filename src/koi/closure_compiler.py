@@ -0,0 +1,843 @@
+from typing import Any, Callable, Dict, List
+
+from .environment import UNDEFINED, Environment, GlobalEnvironment
+from .koi_callable import KoiCallable
+from .koi_class import KoiClass
+from .koi_instance import KoiInstance
+from .interpreter import FLOAT_OPERATORS
+from .completion import RETURN, TAIL_CALL
+from .koi_runtime_error import KoiRuntimeError
+from .tokens import Token
+from .token_type import TokenType
+from .types import TypeVisitor
+from .std import (
+    Clock,
+    Input,
+    ReadFile,
+    WriteFile,
+    StringDataType,
+    StringInstance,
+    Println,
+    Print,
+    ToInt,
+)
+from .expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    ExprVisitor,
+    Get,
+    Grouping,
+    Inline,
+    Literal,
+    Logical,
+    Set,
+    Super,
+    This,
+    Unary,
+    Variable,
+)
+from .stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Return,
+    Stmt,
+    StmtVisitor,
+    Var,
+    While,
+)
+
+# A compiled node, called with the environment it runs in
+Runner = Callable[[Environment], Any]
+
+
+class ClosureFunction(KoiCallable):
+    def __init__(
+        self,
+        name: str,
+        arity: int,
+        size: int,
+        body: Runner,
+        closure: Environment,
+        is_initializer: bool,
+        is_method: bool,
+        this=None,
+    ) -> None:
+        self.name = name
+        self._arity = arity
+        self.size = size
+        self.body = body
+        self.closure = closure
+        self.is_initializer = is_initializer
+        self.is_method = is_method
+        self.this = this
+
+    def call(self, interpreter, args: List):
+        # The same as invoke() with our own `this`, spelled out since going
+        # through invoke() costs an extra Python frame on every call
+        env = Environment(self.closure, self.size)
+        values = env.values
+        if self.is_method:
+            values[0] = self.this
+            values[1 : len(args) + 1] = args
+        else:
+            values[: len(args)] = args
+        completion = self.body(env)
+        if self.is_initializer:
+            return values[0]
+        if completion is not RETURN:
+            return None
+        value = interpreter.return_value
+        if value is TAIL_CALL:
+            fn, this, args = interpreter.tail_call
+            return fn.invoke(interpreter, this, args)
+        return value
+
+    def invoke(self, interpreter, this, args: List):
+        """Like KoiFunction.invoke, calls in tail position are made here"""
+        fn = self
+        while True:
+            env = Environment(fn.closure, fn.size)
+            values = env.values
+            if fn.is_method:
+                values[0] = this
+                values[1 : len(args) + 1] = args
+            else:
+                values[: len(args)] = args
+            completion = fn.body(env)
+            if fn.is_initializer:
+                return values[0]
+            if completion is not RETURN:
+                return None
+            value = interpreter.return_value
+            if value is not TAIL_CALL:
+                return value
+            fn, this, args = interpreter.tail_call
+
+    def arity(self) -> int:
+        return self._arity
+
+    def bind(self, instance):
+        return ClosureFunction(
+            self.name,
+            self._arity,
+            self.size,
+            self.body,
+            self.closure,
+            self.is_initializer,
+            self.is_method,
+            instance,
+        )
+
+    def __repr__(self) -> str:
+        return f"<function {self.name}>"
+
+
+def _is_equal(left, right) -> bool:
+    if left is None and right is None:
+        return True
+    elif left is None:
+        return False
+
+    return left == right
+
+
+def _check_number_operands(operator: Token, left, right):
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return
+    raise KoiRuntimeError(operator, "Operands must be numbers")
+
+
+def _scope(env: Environment, distance: int) -> List[Any]:
+    for _ in range(distance):
+        env = env.parent
+    return env.values
+
+
+class ClosureCompiler(ExprVisitor, StmtVisitor, TypeVisitor):
+    """
+    Compiles every node once into a nested Python closure and runs those.
+    Operators and variable distances are looked at during compilation, so
+    running a node is a plain function call with no visitor dispatch.
+    """
+
+    def __init__(self) -> None:
+        self.globals = GlobalEnvironment()
+        # The value of the last `return`, read by the function it ends, and
+        # the call a `return f(args)` left for it to make
+        self.return_value = None
+        self.tail_call = None
+        # The compiled body of every function, what an `Inline` checks the
+        # function it calls against
+        self.bodies: Dict[Function, Runner] = {}
+
+        self.globals.define("clock", Clock())
+        self.globals.define("input", Input())
+        self.globals.define("read_file", ReadFile())
+        self.globals.define("write_file", WriteFile())
+        self.globals.define("string", StringDataType())
+        self.globals.define("print", Print())
+        self.globals.define("println", Println())
+        self.globals.define("toInt", ToInt())
+
+    def interpret(self, statements: List[Stmt]):
+        program = [self._compile(stmt) for stmt in statements]
+        try:
+            for run in program:
+                run(self.globals)
+        except KoiRuntimeError as error:
+            print(error)
+            raise SystemExit
+
+    def _compile(self, node) -> Runner:
+        return node.accept(self)
+
+    def _compile_block(self, statements: List[Stmt]) -> Runner:
+        compiled = [self._compile(stmt) for stmt in statements]
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def run(env):
+            for stmt in compiled:
+                if stmt(env) is RETURN:
+                    return RETURN
+
+        return run
+
+    # Statements, a compiled statement gives back RETURN when it ran a
+    # `return`, anything else it gives back is ignored
+
+    def visit_expression_stmt(self, stmt: Expression):
+        return self._compile(stmt.expression)
+
+    def _store(self, slot, name: Token) -> Callable[[Environment, Any], None]:
+        """Returns a function that defines `name` in the scope it runs in"""
+        if slot is None:
+            cell = self.globals.cell(name.lexeme)
+
+            def store(env, value):
+                cell.value = value
+
+        else:
+
+            def store(env, value):
+                env.values[slot] = value
+
+        return store
+
+    def visit_var_stmt(self, stmt: Var):
+        store = self._store(stmt.slot, stmt.name)
+        if stmt.initializer is None:
+
+            def run(env):
+                store(env, None)
+
+            return run
+
+        initializer = self._compile(stmt.initializer)
+
+        def run(env):
+            store(env, initializer(env))
+
+        return run
+
+    def visit_block_stmt(self, stmt: Block):
+        body = self._compile_block(stmt.statements)
+        if not stmt.has_scope:
+            return body
+        size = stmt.size
+
+        def run(env):
+            return body(Environment(env, size))
+
+        return run
+
+    def visit_if_stmt(self, stmt: If):
+        condition = self._compile(stmt.condition)
+        then_branch = self._compile(stmt.then_branch)
+        if stmt.else_branch is None:
+
+            def run(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return then_branch(env)
+
+            return run
+
+        else_branch = self._compile(stmt.else_branch)
+
+        def run(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                return then_branch(env)
+            return else_branch(env)
+
+        return run
+
+    def visit_while_stmt(self, stmt: While):
+        condition = self._compile(stmt.condition)
+        body = self._compile(stmt.body)
+
+        def run(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                if body(env) is RETURN:
+                    return RETURN
+
+        return run
+
+    def visit_for_stmt(self, stmt: For):
+        initializer = None
+        if stmt.initializer is not None:
+            initializer = self._compile(stmt.initializer)
+        body = self._compile(stmt.body)
+        if stmt.counted:
+            loop = self._counted_loop(stmt, body)
+        else:
+            loop = self._loop(stmt, body)
+        size = stmt.size
+        has_scope = stmt.has_scope
+
+        def run(env):
+            if has_scope:
+                env = Environment(env, size)
+            if initializer is not None:
+                initializer(env)
+            return loop(env)
+
+        return run
+
+    def _loop(self, stmt: For, body: Runner) -> Runner:
+        condition = None
+        if stmt.condition is not None:
+            condition = self._compile(stmt.condition)
+        increment = None
+        if stmt.increment is not None:
+            increment = self._compile(stmt.increment)
+
+        def run(env):
+            while True:
+                if condition is not None:
+                    value = condition(env)
+                    if value is None or value is False:
+                        return None
+                if body(env) is RETURN:
+                    return RETURN
+                if increment is not None:
+                    increment(env)
+
+        return run
+
+    def _counted_loop(self, stmt: For, body: Runner) -> Runner:
+        """A counted loop, see Interpreter._counted_loop"""
+        loop = self._loop(stmt, body)
+        slot = stmt.initializer.slot
+        compare = FLOAT_OPERATORS[stmt.condition.operator.tok_type]
+        limit_of = self._compile(stmt.condition.right)
+        step = stmt.increment.value.right.value
+        if stmt.increment.value.operator.tok_type == TokenType.MINUS:
+            step = -step
+        observed = stmt.observed
+
+        def run(env):
+            values = env.values
+            counter = values[slot]
+            while type(counter) is float:
+                limit = limit_of(env)
+                if type(limit) is not float:
+                    break
+                if not compare(counter, limit):
+                    if observed:
+                        values[slot] = counter
+                    return None
+                if observed:
+                    values[slot] = counter
+                if body(env) is RETURN:
+                    return RETURN
+                counter += step
+            values[slot] = counter
+            return loop(env)
+
+        return run
+
+    def visit_return_stmt(self, stmt: Return):
+        if stmt.value is None:
+
+            def run(env):
+                self.return_value = None
+                return RETURN
+
+            return run
+
+        value = self._compile(stmt.value)
+
+        def run(env):
+            self.return_value = value(env)
+            return RETURN
+
+        return run
+
+    def _function(
+        self, stmt: Function, is_initializer: bool, is_method: bool
+    ) -> Callable:
+        """Compile the body once, return a factory for closures over it"""
+        name = stmt.name.lexeme
+        arity = len(stmt.params)
+        size = stmt.size
+        body = self.bodies[stmt] = self._compile_block(stmt.body)
+
+        def make(env):
+            return ClosureFunction(
+                name, arity, size, body, env, is_initializer, is_method
+            )
+
+        return make
+
+    def visit_function_stmt(self, stmt: Function):
+        store = self._store(stmt.slot, stmt.name)
+        make = self._function(stmt, False, False)
+
+        def run(env):
+            store(env, make(env))
+
+        return run
+
+    def visit_class_stmt(self, stmt: Class):
+        name = stmt.name.lexeme
+        store = self._store(stmt.slot, stmt.name)
+        methods = [
+            (
+                method.name.lexeme,
+                self._function(method, method.name.lexeme == "init", True),
+            )
+            for method in stmt.methods
+        ]
+        superclass_expr = stmt.superclass
+        superclass_runner = None
+        if superclass_expr is not None:
+            superclass_runner = self._compile(superclass_expr)
+
+        def run(env):
+            superclass = None
+            if superclass_runner is not None:
+                superclass = superclass_runner(env)
+                if not isinstance(superclass, KoiClass):
+                    raise KoiRuntimeError(
+                        superclass_expr.name, "Superclass must a class"
+                    )
+
+            store(env, None)
+            method_env = env
+            if superclass_runner is not None:
+                method_env = Environment(env, 1)
+                method_env.values[0] = superclass
+
+            table = {method_name: make(method_env) for method_name, make in methods}
+            store(env, KoiClass(name, superclass, table))
+
+        return run
+
+    # Expressions
+
+    def visit_literal_expr(self, expr: Literal):
+        value = expr.value
+        return lambda env: value
+
+    def visit_string_type(self, string: str):
+        return lambda env: StringInstance(string)
+
+    def visit_grouping_expr(self, expr: Grouping):
+        return self._compile(expr.expression)
+
+    def visit_unary_expr(self, expr: Unary):
+        right = self._compile(expr.right)
+        operator = expr.operator
+
+        if operator.tok_type == TokenType.MINUS:
+
+            def run(env):
+                value = right(env)
+                if not isinstance(value, (int, float)):
+                    raise KoiRuntimeError(operator, f"Operand {value} must be a number")
+                return -int(value)
+
+            return run
+        elif operator.tok_type == TokenType.BANG:
+
+            def run(env):
+                value = right(env)
+                return value is None or value is False
+
+            return run
+
+        def run(env):
+            right(env)
+            return None
+
+        return run
+
+    def visit_binary_expr(self, expr: Binary):
+        left = self._compile(expr.left)
+        right = self._compile(expr.right)
+        operator = expr.operator
+
+        match operator.tok_type:
+            case TokenType.PLUS:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    if isinstance(lhs, (int, float)) and isinstance(rhs, (int, float)):
+                        return float(lhs) + float(rhs)
+                    elif isinstance(lhs, str) or isinstance(lhs, StringInstance):
+                        return str(lhs) + str(rhs)
+                    raise KoiRuntimeError(
+                        operator, "Both operands must be either numbers or string"
+                    )
+
+            case TokenType.MINUS:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) - float(rhs)
+
+            case TokenType.STAR:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) * float(rhs)
+
+            case TokenType.SLASH:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    if rhs == 0:
+                        raise KoiRuntimeError(rhs, f"Cannot divide {lhs} by zero")
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) / float(rhs)
+
+            case TokenType.MOD:
+
+                def run(env):
+                    lhs = left(env)
+                    return float(lhs) % float(right(env))
+
+            case TokenType.GREATER:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) > float(rhs)
+
+            case TokenType.GREATER_EQUAL:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) >= float(rhs)
+
+            case TokenType.LESS:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) < float(rhs)
+
+            case TokenType.LESS_EQUAL:
+
+                def run(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    _check_number_operands(operator, lhs, rhs)
+                    return float(lhs) <= float(rhs)
+
+            case TokenType.BANG_EQUAL:
+
+                def run(env):
+                    lhs = left(env)
+                    return not _is_equal(lhs, right(env))
+
+            case TokenType.EQUAL_EQUAL:
+
+                def run(env):
+                    lhs = left(env)
+                    return _is_equal(lhs, right(env))
+
+            case _:
+
+                def run(env):
+                    left(env)
+                    right(env)
+                    return None
+
+        return run
+
+    def visit_logical_expr(self, expr: Logical):
+        left = self._compile(expr.left)
+        right = self._compile(expr.right)
+
+        if expr.operator.tok_type == TokenType.OR:
+
+            def run(env):
+                value = left(env)
+                if value is not None and value is not False:
+                    return value
+                return right(env)
+
+            return run
+
+        def run(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+
+        return run
+
+    def _lookup(self, expr: Expr, name: Token) -> Runner:
+        distance = expr.depth
+        slot = expr.slot
+        if distance is None:
+            cell = self.globals.cell(name.lexeme)
+
+            def run(env):
+                value = cell.value
+                if value is UNDEFINED:
+                    raise KoiRuntimeError(name, f"Undefined name {name.lexeme!r}")
+                return value
+
+        elif distance == 0:
+
+            def run(env):
+                return env.values[slot]
+
+        elif distance == 1:
+
+            def run(env):
+                return env.parent.values[slot]
+
+        else:
+
+            def run(env):
+                return _scope(env, distance)[slot]
+
+        return run
+
+    def visit_variable_expr(self, expr: Variable):
+        return self._lookup(expr, expr.name)
+
+    def visit_this_expr(self, expr: This):
+        return self._lookup(expr, expr.keyword)
+
+    def visit_assign_expr(self, expr: Assign):
+        value = self._compile(expr.value)
+        name = expr.name
+        lexeme = name.lexeme
+        distance = expr.depth
+        slot = expr.slot
+        if distance is None:
+            cell = self.globals.cell(lexeme)
+
+            def run(env):
+                result = value(env)
+                if cell.value is UNDEFINED:
+                    raise KoiRuntimeError(
+                        name,
+                        f"Cannot assign to variable {lexeme!r} before it was declared.",
+                    )
+                cell.value = result
+                return result
+
+        elif distance == 0:
+
+            def run(env):
+                result = env.values[slot] = value(env)
+                return result
+
+        else:
+
+            def run(env):
+                result = _scope(env, distance)[slot] = value(env)
+                return result
+
+        return run
+
+    def visit_super_expr(self, expr: Super):
+        distance = expr.depth
+        slot = expr.slot
+        method_name = expr.method
+
+        def run(env):
+            superclass: KoiClass = _scope(env, distance)[slot]
+            this: KoiInstance = _scope(env, distance - 1)[0]
+            method = superclass.find_method(method_name.lexeme)
+            if method is None:
+                raise KoiRuntimeError(
+                    method_name, f"Undefined property {method_name.lexeme!r}"
+                )
+            return method.bind(this)
+
+        return run
+
+    def visit_call_expr(self, expr: Call):
+        arguments = [self._compile(arg) for arg in expr.arguments]
+        paren = expr.paren
+        tail = expr.tail
+        if isinstance(expr.callee, Get):
+            return self._method_call(expr.callee, arguments, paren, tail)
+        callee = self._compile(expr.callee)
+
+        def run(env):
+            fn = callee(env)
+            args = [arg(env) for arg in arguments]
+            if not isinstance(fn, KoiCallable):
+                raise KoiRuntimeError(paren, "Can only call functions and classes")
+            if len(args) != fn.arity():
+                raise KoiRuntimeError(
+                    paren, f"Expected {fn.arity()} arguments but got {len(args)}"
+                )
+            if tail and type(fn) is ClosureFunction:
+                self.tail_call = (fn, fn.this, args)
+                return TAIL_CALL
+            return fn.call(self, args)
+
+        return run
+
+    def visit_inline_expr(self, expr: Inline):
+        callee = self._compile(expr.call.callee)
+        body = self._compile(expr.body)
+        call = self._compile(expr.call)
+        function = expr.function
+        bodies = self.bodies
+
+        def run(env):
+            fn = callee(env)
+            # The declaration may be compiled after the call
+            if type(fn) is ClosureFunction and fn.body is bodies.get(function):
+                return body(env)
+            return call(env)
+
+        return run
+
+    def _method_call(self, get: Get, arguments: List[Runner], paren: Token, tail: bool):
+        """`obj.method(args)`, invoking the method without binding it first"""
+        obj = self._compile(get.obj)
+        name = get.name
+        lexeme = name.lexeme
+
+        # The method found on the last receiver shape seen
+        cached_shape = None
+        cached_method = None
+
+        def run(env):
+            nonlocal cached_shape, cached_method
+            instance = obj(env)
+            if type(instance) is KoiInstance and instance.shape is cached_shape:
+                fn = cached_method
+            elif type(instance) is KoiInstance and lexeme not in instance.shape.slots:
+                fn = instance.klass.find_method(lexeme)
+                if fn is None:
+                    raise KoiRuntimeError(name, f"Undefined property {lexeme!r}")
+                cached_shape = instance.shape
+                cached_method = fn
+            elif isinstance(instance, KoiInstance):
+                fn = instance.get(name)
+                instance = None
+            else:
+                raise KoiRuntimeError(
+                    name, "Can only access properties from class instances"
+                )
+            args = [arg(env) for arg in arguments]
+            if not isinstance(fn, KoiCallable):
+                raise KoiRuntimeError(paren, "Can only call functions and classes")
+            if len(args) != fn.arity():
+                raise KoiRuntimeError(
+                    paren, f"Expected {fn.arity()} arguments but got {len(args)}"
+                )
+            if instance is None:
+                return fn.call(self, args)
+            if tail and type(fn) is ClosureFunction:
+                self.tail_call = (fn, instance, args)
+                return TAIL_CALL
+            return fn.invoke(self, instance, args)
+
+        return run
+
+    def visit_get_expr(self, expr: Get):
+        obj = self._compile(expr.obj)
+        name = expr.name
+        # The field index on the last receiver shape seen
+        cached_shape = None
+        cached_index = None
+
+        def run(env):
+            nonlocal cached_shape, cached_index
+            instance = obj(env)
+            if type(instance) is KoiInstance:
+                shape = instance.shape
+                if shape is cached_shape:
+                    return instance.values[cached_index]
+                index = shape.slots.get(name.lexeme)
+                if index is not None:
+                    cached_shape = shape
+                    cached_index = index
+                    return instance.values[index]
+                return instance.get(name)
+            if isinstance(instance, KoiInstance):
+                return instance.get(name)
+            raise KoiRuntimeError(
+                name, "Can only access properties from class instances"
+            )
+
+        return run
+
+    def visit_set_expr(self, expr: Set):
+        obj = self._compile(expr.obj)
+        value = self._compile(expr.value)
+        name = expr.name
+
+        # The field index on the last receiver shape seen, or the shape to
+        # move to when that shape doesn't have the field yet
+        cached_shape = None
+        cached_index = None
+        cached_transition = None
+
+        def run(env):
+            nonlocal cached_shape, cached_index, cached_transition
+            instance = obj(env)
+            if not isinstance(instance, KoiInstance):
+                raise KoiRuntimeError(name, "Must be an instance to have fields")
+            result = value(env)
+            if type(instance) is not KoiInstance:
+                instance.set(name, result)
+                return result
+            shape = instance.shape
+            if shape is not cached_shape:
+                cached_shape = shape
+                cached_index = shape.slots.get(name.lexeme)
+                cached_transition = (
+                    shape.add_field(name.lexeme) if cached_index is None else None
+                )
+            if cached_index is None:
+                instance.shape = cached_transition
+                instance.values.append(result)
+            else:
+                instance.values[cached_index] = result
+            return result
+
+        return run
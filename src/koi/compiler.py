@@ -0,0 +1,440 @@
+from typing import List, Optional
+
+from .chunk import Chunk, CompiledFunction
+from .environment import GlobalEnvironment
+from .function_type import FunctionType
+from .opcode import OpCode
+from .tokens import Token
+from .token_type import TokenType
+from .types import TypeVisitor
+from .expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    ExprVisitor,
+    Get,
+    Grouping,
+    Inline,
+    Literal,
+    Logical,
+    Set,
+    Super,
+    This,
+    Unary,
+    Variable,
+)
+from .stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Return,
+    Stmt,
+    StmtVisitor,
+    Var,
+    While,
+)
+
+
+BINARY_OPS = {
+    TokenType.PLUS: OpCode.ADD,
+    TokenType.MINUS: OpCode.SUBTRACT,
+    TokenType.STAR: OpCode.MULTIPLY,
+    TokenType.SLASH: OpCode.DIVIDE,
+    TokenType.MOD: OpCode.MODULO,
+    TokenType.GREATER: OpCode.GREATER,
+    TokenType.GREATER_EQUAL: OpCode.GREATER_EQUAL,
+    TokenType.LESS: OpCode.LESS,
+    TokenType.LESS_EQUAL: OpCode.LESS_EQUAL,
+    TokenType.EQUAL_EQUAL: OpCode.EQUAL,
+    TokenType.BANG_EQUAL: OpCode.NOT_EQUAL,
+}
+
+
+class Local:
+    def __init__(self, name: str, depth: int) -> None:
+        self.name = name
+        self.depth = depth
+        self.is_captured = False
+
+
+class FunctionState:
+    """Bookkeeping for the function that is currently being compiled"""
+
+    def __init__(self, enclosing, function: CompiledFunction) -> None:
+        self.enclosing: Optional[FunctionState] = enclosing
+        self.function = function
+        self.scope_depth = 0
+        self.upvalues: List[tuple] = []
+        # Slot zero holds the callee, or the receiver inside methods
+        receiver = ""
+        if function.kind in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            receiver = "this"
+        self.locals: List[Local] = [Local(receiver, 0)]
+
+
+class Compiler(ExprVisitor, StmtVisitor, TypeVisitor):
+    """
+    Lowers resolved statements into bytecode for the VM. Locals live in
+    stack slots and captured locals are reached through upvalues, so the
+    compiler tracks scopes itself rather than relying on resolver depths.
+    Globals are bound to their `GlobalCell` in `globals` at compile time.
+    """
+
+    def __init__(self, globals: GlobalEnvironment) -> None:
+        self.globals = globals
+        self.state: Optional[FunctionState] = None
+        # The token of the code being compiled, runtime errors report it
+        self.token: Optional[Token] = None
+
+    def compile(self, statements: List[Stmt]) -> CompiledFunction:
+        self.state = FunctionState(None, CompiledFunction("script", FunctionType.NONE))
+        for stmt in statements:
+            self._compile_stmt(stmt)
+        self._emit_return()
+        return self.state.function
+
+    @property
+    def _chunk(self) -> Chunk:
+        return self.state.function.chunk
+
+    def _compile_stmt(self, stmt: Stmt):
+        stmt.accept(self)
+
+    def _compile_expr(self, expr: Expr):
+        expr.accept(self)
+
+    def _emit(self, *codes: int) -> int:
+        for code in codes:
+            index = self._chunk.write(code, self.token)
+        return index
+
+    def _emit_constant(self, op: OpCode, value) -> None:
+        self._emit(op, self._chunk.add_constant(value))
+
+    def _emit_jump(self, op: OpCode) -> int:
+        return self._emit(op, 0)
+
+    def _patch_jump(self, operand: int) -> None:
+        self._chunk.code[operand] = len(self._chunk.code) - operand - 1
+
+    def _emit_loop(self, loop_start: int) -> None:
+        operand = self._emit(OpCode.LOOP, 0)
+        self._chunk.code[operand] = operand + 1 - loop_start
+
+    def _emit_return(self) -> None:
+        if self.state.function.kind == FunctionType.INITIALIZER:
+            self._emit(OpCode.GET_LOCAL, 0)
+        else:
+            self._emit(OpCode.NIL)
+        self._emit(OpCode.RETURN)
+
+    def _track(self, token: Token) -> None:
+        if token is not None:
+            self.token = token
+
+    # Scopes and variables
+
+    def _begin_scope(self) -> None:
+        self.state.scope_depth += 1
+
+    def _end_scope(self) -> None:
+        state = self.state
+        state.scope_depth -= 1
+        while state.locals and state.locals[-1].depth > state.scope_depth:
+            if state.locals[-1].is_captured:
+                self._emit(OpCode.CLOSE_UPVALUE)
+            else:
+                self._emit(OpCode.POP)
+            state.locals.pop()
+
+    def _add_local(self, name: str) -> None:
+        self.state.locals.append(Local(name, self.state.scope_depth))
+
+    def _define_variable(self, name: Token) -> None:
+        """Bind the value on top of the stack to `name`"""
+        if self.state.scope_depth > 0:
+            self._add_local(name.lexeme)
+        else:
+            self._emit_global(OpCode.DEFINE_GLOBAL, name.lexeme)
+
+    def _emit_global(self, op: OpCode, name: str) -> None:
+        self._emit_constant(op, self.globals.cell(name))
+
+    @staticmethod
+    def _resolve_local(state: FunctionState, name: str) -> int:
+        for slot in range(len(state.locals) - 1, -1, -1):
+            if state.locals[slot].name == name:
+                return slot
+        return -1
+
+    def _resolve_upvalue(self, state: FunctionState, name: str) -> int:
+        if state.enclosing is None:
+            return -1
+        local = self._resolve_local(state.enclosing, name)
+        if local != -1:
+            state.enclosing.locals[local].is_captured = True
+            return self._add_upvalue(state, True, local)
+        upvalue = self._resolve_upvalue(state.enclosing, name)
+        if upvalue != -1:
+            return self._add_upvalue(state, False, upvalue)
+        return -1
+
+    @staticmethod
+    def _add_upvalue(state: FunctionState, is_local: bool, index: int) -> int:
+        upvalue = (is_local, index)
+        if upvalue in state.upvalues:
+            return state.upvalues.index(upvalue)
+        state.upvalues.append(upvalue)
+        state.function.upvalue_count = len(state.upvalues)
+        return len(state.upvalues) - 1
+
+    def _named_variable(self, name: str, assign: bool) -> None:
+        slot = self._resolve_local(self.state, name)
+        if slot != -1:
+            self._emit(OpCode.SET_LOCAL if assign else OpCode.GET_LOCAL, slot)
+            return
+        index = self._resolve_upvalue(self.state, name)
+        if index != -1:
+            self._emit(OpCode.SET_UPVALUE if assign else OpCode.GET_UPVALUE, index)
+            return
+        op = OpCode.SET_GLOBAL if assign else OpCode.GET_GLOBAL
+        self._emit_global(op, name)
+
+    # Statements
+
+    def visit_expression_stmt(self, stmt: Expression):
+        self._compile_expr(stmt.expression)
+        self._emit(OpCode.POP)
+
+    def visit_var_stmt(self, stmt: Var):
+        self._track(stmt.name)
+        if stmt.initializer is not None:
+            self._compile_expr(stmt.initializer)
+        else:
+            self._emit(OpCode.NIL)
+        self._define_variable(stmt.name)
+
+    def visit_block_stmt(self, stmt: Block):
+        self._begin_scope()
+        for statement in stmt.statements:
+            self._compile_stmt(statement)
+        self._end_scope()
+
+    def visit_if_stmt(self, stmt: If):
+        self._compile_expr(stmt.condition)
+        else_jump = self._emit_jump(OpCode.POP_JUMP_IF_FALSE)
+        self._compile_stmt(stmt.then_branch)
+        if stmt.else_branch is None:
+            self._patch_jump(else_jump)
+            return
+        end_jump = self._emit_jump(OpCode.JUMP)
+        self._patch_jump(else_jump)
+        self._compile_stmt(stmt.else_branch)
+        self._patch_jump(end_jump)
+
+    def visit_for_stmt(self, stmt: For):
+        self._begin_scope()
+        if stmt.initializer is not None:
+            self._compile_stmt(stmt.initializer)
+        loop_start = len(self._chunk.code)
+        exit_jump = None
+        if stmt.condition is not None:
+            self._compile_expr(stmt.condition)
+            exit_jump = self._emit_jump(OpCode.POP_JUMP_IF_FALSE)
+        self._compile_stmt(stmt.body)
+        if stmt.increment is not None:
+            self._compile_expr(stmt.increment)
+            self._emit(OpCode.POP)
+        self._emit_loop(loop_start)
+        if exit_jump is not None:
+            self._patch_jump(exit_jump)
+        self._end_scope()
+
+    def visit_while_stmt(self, stmt: While):
+        loop_start = len(self._chunk.code)
+        self._compile_expr(stmt.condition)
+        exit_jump = self._emit_jump(OpCode.POP_JUMP_IF_FALSE)
+        self._compile_stmt(stmt.body)
+        self._emit_loop(loop_start)
+        self._patch_jump(exit_jump)
+
+    def visit_function_stmt(self, stmt: Function):
+        self._track(stmt.name)
+        if self.state.scope_depth > 0:
+            # Declare the local first so the body can refer to itself
+            self._add_local(stmt.name.lexeme)
+            self._function(stmt, FunctionType.FUNCTION)
+        else:
+            self._function(stmt, FunctionType.FUNCTION)
+            self._emit_global(OpCode.DEFINE_GLOBAL, stmt.name.lexeme)
+
+    def _function(self, stmt: Function, kind: FunctionType) -> None:
+        function = CompiledFunction(stmt.name.lexeme, kind)
+        function.arity = len(stmt.params)
+        self.state = FunctionState(self.state, function)
+        self._begin_scope()
+        for param in stmt.params:
+            self._add_local(param.lexeme)
+        for statement in stmt.body:
+            self._compile_stmt(statement)
+        self._emit_return()
+
+        state = self.state
+        self.state = state.enclosing
+        self._track(stmt.name)
+        self._emit(OpCode.CLOSURE, self._chunk.add_constant(function))
+        for is_local, index in state.upvalues:
+            self._emit(1 if is_local else 0, index)
+
+    def visit_return_stmt(self, stmt: Return):
+        self._track(stmt.keyword)
+        if stmt.value is None or self.state.function.kind == FunctionType.INITIALIZER:
+            self._emit_return()
+            return
+        self._compile_expr(stmt.value)
+        self._emit(OpCode.RETURN)
+
+    def visit_class_stmt(self, stmt: Class):
+        self._track(stmt.name)
+        is_local = self.state.scope_depth > 0
+        if is_local:
+            # Reserve the slot so methods can refer to the class by name
+            self._emit(OpCode.NIL)
+            self._add_local(stmt.name.lexeme)
+            slot = len(self.state.locals) - 1
+
+        has_superclass = stmt.superclass is not None
+        if has_superclass:
+            self._begin_scope()
+            self._compile_expr(stmt.superclass)
+            self._add_local("super")
+
+        for method in stmt.methods:
+            kind = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                kind = FunctionType.INITIALIZER
+            self._function(method, kind)
+
+        self._track(stmt.name)
+        self._emit(
+            OpCode.CLASS,
+            self._chunk.add_constant(stmt.name.lexeme),
+            len(stmt.methods),
+            1 if has_superclass else 0,
+        )
+        if is_local:
+            self._emit(OpCode.SET_LOCAL, slot)
+            self._emit(OpCode.POP)
+        else:
+            self._emit_global(OpCode.DEFINE_GLOBAL, stmt.name.lexeme)
+
+        if has_superclass:
+            self._end_scope()
+
+    # Expressions
+
+    def visit_literal_expr(self, expr: Literal):
+        if expr.value is None:
+            self._emit(OpCode.NIL)
+        elif expr.value is True:
+            self._emit(OpCode.TRUE)
+        elif expr.value is False:
+            self._emit(OpCode.FALSE)
+        else:
+            self._emit_constant(OpCode.CONSTANT, expr.value)
+
+    def visit_string_type(self, string: str):
+        self._emit_constant(OpCode.STRING, string)
+
+    def visit_grouping_expr(self, expr: Grouping):
+        self._compile_expr(expr.expression)
+
+    def visit_inline_expr(self, expr: Inline):
+        # The VM compiles the original call: it resolves names again by
+        # scope, so a global the inlined body reads could be captured by a
+        # local of the same name at the call site
+        self._compile_expr(expr.call)
+
+    def visit_unary_expr(self, expr: Unary):
+        self._compile_expr(expr.right)
+        self._track(expr.operator)
+        if expr.operator.tok_type == TokenType.MINUS:
+            self._emit(OpCode.NEGATE)
+        elif expr.operator.tok_type == TokenType.BANG:
+            self._emit(OpCode.NOT)
+        else:
+            self._emit(OpCode.POP)
+            self._emit(OpCode.NIL)
+
+    def visit_binary_expr(self, expr: Binary):
+        self._compile_expr(expr.left)
+        self._compile_expr(expr.right)
+        self._track(expr.operator)
+        op = BINARY_OPS.get(expr.operator.tok_type)
+        if op is not None:
+            self._emit(op)
+        else:
+            # Operators without a meaning evaluate both sides to nil
+            self._emit(OpCode.POP)
+            self._emit(OpCode.POP)
+            self._emit(OpCode.NIL)
+
+    def visit_logical_expr(self, expr: Logical):
+        self._compile_expr(expr.left)
+        if expr.operator.tok_type == TokenType.OR:
+            end_jump = self._emit_jump(OpCode.JUMP_IF_TRUE)
+        else:
+            end_jump = self._emit_jump(OpCode.JUMP_IF_FALSE)
+        self._emit(OpCode.POP)
+        self._compile_expr(expr.right)
+        self._patch_jump(end_jump)
+
+    def visit_variable_expr(self, expr: Variable):
+        self._track(expr.name)
+        self._named_variable(expr.name.lexeme, assign=False)
+
+    def visit_assign_expr(self, expr: Assign):
+        self._compile_expr(expr.value)
+        self._track(expr.name)
+        self._named_variable(expr.name.lexeme, assign=True)
+
+    def visit_this_expr(self, expr: This):
+        self._track(expr.keyword)
+        self._named_variable("this", assign=False)
+
+    def visit_super_expr(self, expr: Super):
+        self._track(expr.keyword)
+        self._named_variable("this", assign=False)
+        self._named_variable("super", assign=False)
+        self._emit_constant(OpCode.GET_SUPER, expr.method)
+
+    def visit_call_expr(self, expr: Call):
+        if isinstance(expr.callee, Get):
+            # Method calls skip creating a bound method
+            self._compile_expr(expr.callee.obj)
+            for arg in expr.arguments:
+                self._compile_expr(arg)
+            self._track(expr.paren)
+            name = self._chunk.add_constant(expr.callee.name)
+            self._emit(OpCode.INVOKE, name, len(expr.arguments))
+            return
+        self._compile_expr(expr.callee)
+        for arg in expr.arguments:
+            self._compile_expr(arg)
+        self._track(expr.paren)
+        self._emit(OpCode.CALL, len(expr.arguments))
+
+    def visit_get_expr(self, expr: Get):
+        self._compile_expr(expr.obj)
+        self._track(expr.name)
+        self._emit_constant(OpCode.GET_PROPERTY, expr.name)
+
+    def visit_set_expr(self, expr: Set):
+        self._compile_expr(expr.obj)
+        self._compile_expr(expr.value)
+        self._track(expr.name)
+        self._emit_constant(OpCode.SET_PROPERTY, expr.name)
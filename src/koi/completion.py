@@ -0,0 +1,20 @@
+class Completion:
+    """
+    How a statement finished when it did not just run to its end. Statements
+    normally give back None, a `return` leaves its value with the interpreter
+    and gives back RETURN, which blocks, ifs and loops hand straight up to
+    the function being called.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"<{self.name}>"
+
+
+RETURN = Completion("return")
+# The value a `return f(args)` leaves behind instead of calling `f`. The
+# interpreter keeps the function, receiver and arguments in `tail_call` and
+# the function being returned from makes the call in its own loop.
+TAIL_CALL = Completion("tail call")
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from typing_extensions import Self
 
@@ -6,34 +6,76 @@ from .tokens import Token
 from .koi_runtime_error import KoiRuntimeError
 
 
-class Environment:
-    def __init__(self, parent: Optional[Self] = None):
-        self.values: Dict[str, Any] = {}
-        self.parent = parent
+class Undefined:
+    """The value of a global that has been referenced but not yet defined"""
+
+    def __repr__(self) -> str:
+        return "<undefined>"
+
+
+UNDEFINED = Undefined()
+
+
+class GlobalCell:
+    """
+    Holds the value of a single global. Every reference to a global binds to
+    its cell once and reads `value` from then on, redefining the global only
+    replaces the value inside the cell.
+    """
+
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.value: Any = UNDEFINED
+
+    def __repr__(self) -> str:
+        return f"<global {self.name} = {self.value!r}>"
+
+
+class GlobalEnvironment:
+    """Top level names, each one kept in a `GlobalCell` that never moves"""
+
+    def __init__(self) -> None:
+        self.cells: Dict[str, GlobalCell] = {}
+
+    def cell(self, name: str) -> GlobalCell:
+        cell = self.cells.get(name)
+        if cell is None:
+            cell = self.cells[name] = GlobalCell(name)
+        return cell
 
     def define(self, name: str, value: Any) -> None:
-        self.values[name] = value
+        self.cell(name).value = value
 
     def get(self, name: Token) -> Any:
-        if name.lexeme in self.values:
-            return self.values[name.lexeme]
-        if self.parent is not None:
-            return self.parent.get(name)
-        raise KoiRuntimeError(name, f"Undefined name {name.lexeme!r}")
+        value = self.cell(name.lexeme).value
+        if value is UNDEFINED:
+            raise KoiRuntimeError(name, f"Undefined name {name.lexeme!r}")
+        return value
 
     def assign(self, name: Token, value: Any):
-        if name.lexeme in self.values:
-            self.values[name.lexeme] = value
-            return
-        if self.parent is not None:
-            self.parent.assign(name, value)
-            return
-        raise KoiRuntimeError(
-            name, f"Cannot assign to variable {name.lexeme!r} before it was declared."
-        )
-
-    def get_at(self, distance: int, name: str) -> Any:
-        return self._ancestor(distance).values.get(name)
+        cell = self.cell(name.lexeme)
+        if cell.value is UNDEFINED:
+            raise KoiRuntimeError(
+                name,
+                f"Cannot assign to variable {name.lexeme!r} before it was declared.",
+            )
+        cell.value = value
+
+
+class Environment:
+    """
+    A local scope. The resolver gives every local a slot, so the values
+    are kept in a list of `size` entries instead of a dict keyed by name.
+    """
+
+    def __init__(self, parent: Optional[Self] = None, size: int = 0):
+        self.values: List[Any] = [None] * size
+        self.parent = parent
+
+    def get_at(self, distance: int, slot: int) -> Any:
+        return self._ancestor(distance).values[slot]
 
     def _ancestor(self, distance: int) -> Self:
         env: Environment = self
@@ -43,5 +85,5 @@ class Environment:
 
         return env
 
-    def assign_at(self, distance: int, name: Token, value: Any) -> None:
-        self._ancestor(distance).values[name.lexeme] = value
+    def assign_at(self, distance: int, slot: int, value: Any) -> None:
+        self._ancestor(distance).values[slot] = value
@@ -4,10 +4,13 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Any, List
+from typing import TYPE_CHECKING, Any, List, Optional
 
 from .tokens import Token
 
+if TYPE_CHECKING:
+    from .stmt import Function, Var
+
 
 class ExprVisitor(ABC):
     """This class is used as a visitor for the Expr class"""
@@ -32,6 +35,10 @@ class ExprVisitor(ABC):
     def visit_grouping_expr(self, expr: Grouping):
         raise NotImplementedError
 
+    @abstractmethod
+    def visit_inline_expr(self, expr: Inline):
+        raise NotImplementedError
+
     @abstractmethod
     def visit_literal_expr(self, expr: Literal):
         raise NotImplementedError
@@ -71,6 +78,11 @@ class Assign(Expr):
     def __init__(self, name: Token, value: Expr):
         self.name = name
         self.value = value
+        # Set by the resolver, None when the name is a global
+        self.depth: Optional[int] = None
+        self.slot: Optional[int] = None
+        # The GlobalCell of a global, bound the first time it is assigned
+        self.cell = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -82,6 +94,10 @@ class Binary(Expr):
         self.left = left
         self.operator = operator
         self.right = right
+        # Quickening state, the interpreter counts how often the node saw two
+        # floats and then switches it to `float_op`, see visit_binary_expr
+        self.float_hits = 0
+        self.float_op = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -93,6 +109,13 @@ class Call(Expr):
         self.callee = callee
         self.paren = paren
         self.arguments = arguments
+        # Inline cache for `obj.method()` calls, the method found on the
+        # last receiver shape seen at this call site. Shapes belong to a
+        # single class, so a hit also means the receiver has no such field.
+        self.cached_shape = None
+        self.cached_method = None
+        # Set by the resolver when the call is the value of a return
+        self.tail = False
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -103,6 +126,11 @@ class Get(Expr):
     def __init__(self, obj: Expr, name: Token):
         self.obj = obj
         self.name = name
+        # Inline cache, the field index (or the method, when the field is
+        # missing) found on the last receiver shape seen
+        self.cached_shape = None
+        self.cached_index: Optional[int] = None
+        self.cached_method = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -118,6 +146,22 @@ class Grouping(Expr):
         return visitor.visit_grouping_expr(self)
 
 
+class Inline(Expr):
+    def __init__(self, call: Call, function: Function, body: Expr):
+        # Created by the optimizer from a call to a small top level function:
+        # `body` is the value it returns with the arguments put in for its
+        # parameters. It is used as long as the global called still holds
+        # `function`, the declaration, which isn't a child of this node.
+        # Otherwise `call` is made as it was written.
+        self.call = call
+        self.function = function
+        self.body = body
+
+    def accept(self, visitor: ExprVisitor):
+        """Create an accept method that calls the visitor"""
+        return visitor.visit_inline_expr(self)
+
+
 class Literal(Expr):
     def __init__(self, value: Any):
         self.value = value
@@ -143,6 +187,11 @@ class Set(Expr):
         self.obj = obj
         self.name = name
         self.value = value
+        # Inline cache, the field index on the last receiver shape seen, or
+        # the shape to move to when that shape doesn't have the field yet
+        self.cached_shape = None
+        self.cached_index: Optional[int] = None
+        self.cached_transition = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -153,6 +202,9 @@ class Super(Expr):
     def __init__(self, keyword: Token, method: Token):
         self.keyword = keyword
         self.method = method
+        # Set by the resolver
+        self.depth: Optional[int] = None
+        self.slot: Optional[int] = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -162,6 +214,9 @@ class Super(Expr):
 class This(Expr):
     def __init__(self, keyword: Token):
         self.keyword = keyword
+        # Set by the resolver
+        self.depth: Optional[int] = None
+        self.slot: Optional[int] = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -181,6 +236,14 @@ class Unary(Expr):
 class Variable(Expr):
     def __init__(self, name: Token):
         self.name = name
+        # Set by the resolver, None when the name is a global
+        self.depth: Optional[int] = None
+        self.slot: Optional[int] = None
+        # The GlobalCell of a global, bound the first time it is read
+        self.cell = None
+        # Set by the resolver when the name is a constant that is always
+        # defined by the time it is read, its declaration
+        self.constant: Optional[Var] = None
 
     def accept(self, visitor: ExprVisitor):
         """Create an accept method that calls the visitor"""
@@ -0,0 +1,115 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .expr import Binary, Call, Get, Set
+from .interpreter import FLOAT_OPERATORS, MAX_DEOPTS
+from .program_cache import (
+    CACHE_DIR,
+    Node,
+    ProgramCache,
+    entry_name,
+    walk,
+    write_atomically,
+)
+from .stmt import Class, For, Function, If, Stmt, While
+
+# How many times a branch has to be decided before the side never taken
+# counts as cold
+COLD_SAMPLES = 100
+
+
+class Feedback:
+    """
+    What a `ProfilingInterpreter` saw while running a script, kept in
+    `__koicache__` next to it as JSON, by the index of every node in
+    `walk` order. Like a `ProgramCache` entry it is keyed by the source,
+    the Koi version and the flags, feedback about any other program is
+    ignored.
+
+    Loaded into a later run of the tree walking interpreter it starts the
+    program the way the profiled run left it: operators that only saw
+    floats are quickened, property and method caches are filled as soon
+    as the class of their receivers exists, and functions and loops that
+    got hot are compiled to Python on their first call or iteration, when
+    the run has a tier threshold.
+    Branches the profile never took stay in the interpreter when the code
+    around them is compiled.
+    """
+
+    def __init__(self, script: str, flags: str = "") -> None:
+        path = Path(script)
+        self.path = path.parent / CACHE_DIR / f"{entry_name(path, flags)}.profile"
+        self.cache = ProgramCache(script, flags)
+
+    def load(self, source: str, statements: List[Stmt], interpreter) -> bool:
+        """Apply the feedback about `source` to its nodes, False if there is none"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data["key"] != self.cache.key(source).decode():
+                return False
+            records: Dict[str, Dict[str, Any]] = data["nodes"]
+        except Exception:
+            return False
+
+        nodes = list(walk(statements))
+        # Receivers are recorded by the name of their class, a name that is
+        # declared twice can't tell its classes apart
+        classes: Dict[str, Optional[Class]] = {}
+        for node in nodes:
+            if isinstance(node, Class):
+                name = node.name.lexeme
+                classes[name] = None if name in classes else node
+        for index, node in enumerate(nodes):
+            record = records.get(str(index))
+            if record:
+                self._apply(node, record, interpreter, classes)
+        return True
+
+    def _apply(self, node: Node, record, interpreter, classes) -> None:
+        types = record.get("types")
+        if types and isinstance(node, Binary) and set(types) == {"float float"}:
+            node.float_op = FLOAT_OPERATORS.get(node.operator.tok_type)
+
+        receivers = record.get("receivers")
+        if receivers and isinstance(node, (Get, Set, Call)):
+            receiver = max(receivers, key=receivers.get)
+            name, fields = receiver.split(" ")
+            klass = classes.get(name)
+            if klass is not None:
+                klass.receivers.append(
+                    (node, tuple(fields.split(",")) if fields else ())
+                )
+
+        branches = record.get("branches")
+        if branches and sum(branches.values()) >= COLD_SAMPLES:
+            taken = branches.get("taken", 0)
+            skipped = branches.get("skipped", 0)
+            if isinstance(node, If):
+                node.then_cold = taken == 0
+                node.else_cold = skipped == 0 and node.else_branch is not None
+            elif isinstance(node, While):
+                node.body_cold = taken == 0
+
+        threshold = interpreter.tier_threshold
+        if (
+            record.get("tiered")
+            and record.get("deopts", 0) < MAX_DEOPTS
+            and threshold is not None
+        ):
+            # The next call or iteration reaches the threshold
+            if isinstance(node, Function):
+                node.calls = threshold - 1
+            elif isinstance(node, (While, For)):
+                node.back_edges = threshold - 1
+
+    def store(self, source: str, statements: List[Stmt], records: Dict[int, Any]):
+        """Keep `records`, the feedback of a run by the id of its node"""
+        nodes = {}
+        for index, node in enumerate(walk(statements)):
+            record = records.get(id(node))
+            if record:
+                nodes[str(index)] = record
+        data = {"key": self.cache.key(source).decode(), "nodes": nodes}
+        write_atomically(self.path, json.dumps(data).encode())
@@ -12,16 +12,17 @@ from .std import (
     Print,
     ToInt,
 )
-from .environment import Environment
+from .environment import UNDEFINED, Environment, GlobalEnvironment
 from .koi_callable import KoiCallable
 from .koi_class import KoiClass
 from .koi_function import KoiFunction
-from .koi_return_exception import KoiReturnException
+from .completion import RETURN, TAIL_CALL
 from .expr import (
     Assign,
     ExprVisitor,
     Get,
     Grouping,
+    Inline,
     Literal,
     Expr,
     Call,
@@ -36,6 +37,7 @@ from .expr import (
 from .stmt import (
     Class,
     Expression,
+    For,
     Function,
     If,
     Return,
@@ -47,15 +49,54 @@ from .stmt import (
 )
 from .token_type import TokenType
 from .koi_runtime_error import KoiRuntimeError
-
-from typing import List, Dict, Any
+from .parser import Parser
+from .python_translator import PythonTranslator
+from .resolver import Resolver
+
+import operator
+from typing import List, Optional, Union
+
+
+def _divide(left: float, right: float) -> float:
+    if right == 0:
+        raise KoiRuntimeError(right, f"Cannot divide {left} by zero")
+    return left / right
+
+
+# What a Binary node runs once it is quickened, valid for two floats only
+FLOAT_OPERATORS = {
+    TokenType.PLUS: operator.add,
+    TokenType.MINUS: operator.sub,
+    TokenType.STAR: operator.mul,
+    TokenType.SLASH: _divide,
+    TokenType.MOD: operator.mod,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+    TokenType.EQUAL_EQUAL: operator.eq,
+    TokenType.BANG_EQUAL: operator.ne,
+}
+# How many times in a row a Binary node sees two floats before it is quickened
+QUICKEN_THRESHOLD = 8
+# How many times a function or loop compiled to Python can be deoptimized
+# before it stays here
+MAX_DEOPTS = 3
 
 
 class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
     def __init__(self) -> None:
-        self.globals = Environment()
+        self.globals = GlobalEnvironment()
         self.env = self.globals
-        self.locals: Dict[str, Any] = dict()
+        # The value of the last `return`, read by the function it ends, and
+        # the call a `return f(args)` left for it to make
+        self.return_value = None
+        self.tail_call = None
+        # Reports the syntax errors of bodies parsed on their first call
+        self.on_error = None
+        # How many calls, or loop iterations, before a function or loop is
+        # compiled to Python, None keeps everything in the interpreter
+        self.tier_threshold: Optional[int] = None
 
         self.globals.define("clock", Clock())
         self.globals.define("input", Input())
@@ -74,6 +115,46 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
             print(error)
             raise SystemExit
 
+    def compile_body(self, function: Function):
+        """
+        Parse and resolve the body of a function the parser stepped over.
+        Errors in it are reported like any other syntax error and stop the
+        program.
+        """
+        had_error = False
+
+        def on_error(token: Token, message: str):
+            nonlocal had_error
+            had_error = True
+            self.on_error(token, message)
+
+        lazy = function.lazy
+        function.body = Parser(lazy.tokens, on_error=on_error).parse_body(lazy)
+        if not had_error:
+            Resolver(on_error=on_error).resolve_body(function)
+        if had_error:
+            raise SystemExit(65)
+        function.lazy = None
+
+    def tier_up(self, unit: Union[Function, While, For]):
+        """
+        Compile a hot function or loop to Python, None once it has been
+        deoptimized too often
+        """
+        if unit.deopts >= MAX_DEOPTS:
+            return None
+        unit.compiled = PythonTranslator(self).translate(unit)
+        return unit.compiled
+
+    def deoptimize(self, unit: Union[Function, While, For]):
+        """Run `unit` here again, until it is hot again"""
+        unit.compiled = None
+        unit.deopts += 1
+        if isinstance(unit, Function):
+            unit.calls = 0
+        else:
+            unit.back_edges = 0
+
     def _execute(self, statement: Stmt):
         # try:
         return statement.accept(self)
@@ -121,9 +202,28 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
         left = self._evaluate(expr.left)
         right = self._evaluate(expr.right)
 
-        match expr.operator.tok_type:
+        # Quickening: a node that keeps seeing floats switches to a float
+        # only operator, guarded by the operand types. When the guard fails
+        # the node goes back to the generic path and starts counting again.
+        float_op = expr.float_op
+        if float_op is not None:
+            if type(left) is float and type(right) is float:
+                return float_op(left, right)
+            expr.float_op = None
+            expr.float_hits = 0
+        elif type(left) is float and type(right) is float:
+            expr.float_hits += 1
+            if expr.float_hits >= QUICKEN_THRESHOLD:
+                expr.float_op = FLOAT_OPERATORS.get(expr.operator.tok_type)
+        else:
+            expr.float_hits = 0
+        return self.binary(expr.operator, left, right)
+
+    def binary(self, operator: Token, left, right):
+        """Apply a binary operator to its evaluated operands"""
+        match operator.tok_type:
             case TokenType.MINUS:
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) - float(right)
             case TokenType.MOD:
                 return float(left) % float(right)
@@ -134,27 +234,27 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
                     return str(left) + str(right)
                 else:
                     raise KoiRuntimeError(
-                        expr.operator, "Both operands must be either numbers or string"
+                        operator, "Both operands must be either numbers or string"
                     )
             case TokenType.SLASH:
                 if right == 0:
                     raise KoiRuntimeError(right, f"Cannot divide {left} by zero")
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) / float(right)
             case TokenType.STAR:
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) * float(right)
             case TokenType.GREATER:
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) > float(right)
             case TokenType.GREATER_EQUAL:
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) >= float(right)
             case TokenType.LESS:
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) < float(right)
             case TokenType.LESS_EQUAL:
-                self._check_number_operands(expr.operator, left, right)
+                self._check_number_operands(operator, left, right)
                 return float(left) <= float(right)
             case TokenType.BANG_EQUAL:
                 return not self._is_equal(left, right)
@@ -198,15 +298,27 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
     def visit_assign_expr(self, expr: Assign):
         value = self._evaluate(expr.value)
 
-        distance = self.locals.get(expr)
-        if distance is not None:
-            self.env.assign_at(distance, expr.name, value)
-        else:
-            self.globals.assign(expr.name, value)
+        if expr.depth is not None:
+            self.env.assign_at(expr.depth, expr.slot, value)
+            return value
+
+        cell = expr.cell
+        if cell is None:
+            cell = expr.cell = self.globals.cell(expr.name.lexeme)
+        if cell.value is UNDEFINED:
+            raise KoiRuntimeError(
+                expr.name,
+                f"Cannot assign to variable {expr.name.lexeme!r} before it was declared.",
+            )
+        cell.value = value
         return value
 
     def visit_block_stmt(self, stmt: Block):
-        self._exec_block(stmt.statements, Environment(self.env))
+        if stmt.has_scope:
+            return self._exec_block(stmt.statements, Environment(self.env, stmt.size))
+        for statement in stmt.statements:
+            if statement.accept(self) is RETURN:
+                return RETURN
         return None
 
     def _exec_block(self, statements: List[Stmt], env: Environment):
@@ -214,12 +326,27 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
         try:
             self.env = env
             for stmt in statements:
-                self._execute(stmt)
+                if stmt.accept(self) is RETURN:
+                    return RETURN
         finally:
             self.env = previous
+        return None
 
     def visit_call_expr(self, expr: Call):
-        fn = self._evaluate(expr.callee)
+        callee = expr.callee
+        if type(callee) is Get:
+            obj = self._evaluate(callee.obj)
+            if type(obj) is KoiInstance:
+                if expr.cached_shape is obj.shape:
+                    return self._invoke_method(expr, expr.cached_method, obj)
+                if callee.name.lexeme not in obj.shape.slots:
+                    return self._invoke(expr, obj)
+            fn = self._get_property(callee, obj)
+        elif type(callee) is Super:
+            method, this = self._super_method(callee)
+            return self._invoke_method(expr, method, this)
+        else:
+            fn = self._evaluate(callee)
         args = [self._evaluate(arg) for arg in expr.arguments]
         if not isinstance(fn, KoiCallable):
             raise KoiRuntimeError(expr.paren, "Can only call functions and classes")
@@ -228,15 +355,55 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
             raise KoiRuntimeError(
                 expr.paren, f"Expected {fn.arity()} arguments but got {len(args)}"
             )
+        if expr.tail and type(fn) is KoiFunction:
+            self.tail_call = (fn, fn.this, args)
+            return TAIL_CALL
         return fn.call(self, args)
 
+    def _invoke(self, expr: Call, obj: KoiInstance):
+        """
+        Call a method on `obj` directly with the receiver, instead of creating
+        a bound method only to call it once.
+        """
+        name: Token = expr.callee.name
+        method = obj.klass.find_method(name.lexeme)
+        if method is None:
+            raise KoiRuntimeError(name, f"Undefined property {name.lexeme!r}")
+        expr.cached_shape = obj.shape
+        expr.cached_method = method
+        return self._invoke_method(expr, method, obj)
+
+    def _invoke_method(self, expr: Call, method: KoiFunction, this):
+        args = [self._evaluate(arg) for arg in expr.arguments]
+        if len(args) != method.arity():
+            raise KoiRuntimeError(
+                expr.paren, f"Expected {method.arity()} arguments but got {len(args)}"
+            )
+        if expr.tail and type(method) is KoiFunction:
+            self.tail_call = (method, this, args)
+            return TAIL_CALL
+        return method.invoke(self, this, args)
+
+    def visit_inline_expr(self, expr: Inline):
+        fn = self._evaluate(expr.call.callee)
+        if type(fn) is KoiFunction and fn.decl is expr.function:
+            return self._evaluate(expr.body)
+        # The global was assigned another value, the call is made instead
+        return self._evaluate(expr.call)
+
     def visit_var_stmt(self, stmt: Var):
         value = None
         if stmt.initializer is not None:
             value = self._evaluate(stmt.initializer)
-        self.env.define(stmt.name.lexeme, value)
+        self._define(stmt.slot, stmt.name, value)
         return None
 
+    def _define(self, slot, name: Token, value):
+        if slot is None:
+            self.globals.define(name.lexeme, value)
+        else:
+            self.env.values[slot] = value
+
     def visit_class_stmt(self, stmt: Class):
         superclass = None
         if stmt.superclass is not None:
@@ -244,31 +411,71 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
             if not isinstance(superclass, KoiClass):
                 raise KoiRuntimeError(stmt.superclass.name, "Superclass must a class")
 
-        self.env.define(stmt.name.lexeme, None)
+        self._define(stmt.slot, stmt.name, None)
         if stmt.superclass is not None:
-            self.env = Environment(self.env)
-            self.env.define("super", superclass)
+            self.env = Environment(self.env, 1)
+            self.env.values[0] = superclass
 
         methods = {}
         for method in stmt.methods:
-            fn = KoiFunction(method, self.env, method.name.lexeme == "init")
+            fn = KoiFunction(
+                method, self.env, method.name.lexeme == "init", is_method=True
+            )
             methods[method.name.lexeme] = fn
 
         klass: KoiClass = KoiClass(stmt.name.lexeme, superclass, methods)
         if superclass is not None:
             self.env = self.env.parent
-        self.env.assign(stmt.name, klass)
+        if stmt.receivers:
+            self._warm_caches(stmt, klass)
+        self._define(stmt.slot, stmt.name, klass)
+
+    def _warm_caches(self, stmt: Class, klass: KoiClass):
+        """
+        Fill the caches of the sites a profile saw instances of `stmt` at,
+        for the shape those instances had, before any instance exists
+        """
+        for site, fields in stmt.receivers:
+            shape = klass.shape
+            for field in fields:
+                shape = shape.add_field(field)
+            if type(site) is Set:
+                index = shape.slots.get(site.name.lexeme)
+                site.cached_shape = shape
+                site.cached_index = index
+                site.cached_transition = (
+                    shape.add_field(site.name.lexeme) if index is None else None
+                )
+            elif type(site) is Get:
+                index = shape.slots.get(site.name.lexeme)
+                method = None
+                if index is None:
+                    method = klass.find_method(site.name.lexeme)
+                if index is not None or method is not None:
+                    site.cached_shape = shape
+                    site.cached_index = index
+                    site.cached_method = method
+            elif type(site) is Call and type(site.callee) is Get:
+                name = site.callee.name.lexeme
+                method = klass.find_method(name)
+                if name not in shape.slots and method is not None:
+                    site.cached_shape = shape
+                    site.cached_method = method
 
     def visit_super_expr(self, expr: Super):
-        dist = self.locals.get(expr)
-        superclass: KoiClass = self.env.get_at(dist, "super")
-        this: KoiInstance = self.env.get_at(dist - 1, "this")
+        method, this = self._super_method(expr)
+        return method.bind(this)
+
+    def _super_method(self, expr: Super):
+        dist = expr.depth
+        superclass: KoiClass = self.env.get_at(dist, expr.slot)
+        this: KoiInstance = self.env.get_at(dist - 1, 0)
         method: KoiFunction = superclass.find_method(expr.method.lexeme)
         if method is None:
             raise KoiRuntimeError(
                 expr.method, f"Undefined property {expr.method.lexeme!r}"
             )
-        return method.bind(this)
+        return method, this
 
     def visit_this_expr(self, expr: This):
         return self._lookup_variable(expr.keyword, expr)
@@ -278,33 +485,65 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
 
     def visit_function_stmt(self, stmt: Function):
         fn = KoiFunction(stmt, self.env, False)
-        self.env.define(stmt.name.lexeme, fn)
+        self._define(stmt.slot, stmt.name, fn)
         return None
 
     def visit_get_expr(self, expr: Get):
         # Evaluate the expression whose property is being accessed
         obj = self._evaluate(expr.obj)
-        # If it's a KoiInstance
+        return self._get_property(expr, obj)
+
+    def _get_property(self, expr: Get, obj):
+        """
+        Find the property `expr` names on `obj`. The field index, or the
+        method when there is no such field, is cached on the node, keyed by
+        the receiver's shape.
+        """
+        if type(obj) is KoiInstance:
+            shape = obj.shape
+            if expr.cached_shape is not shape:
+                name = expr.name.lexeme
+                index = shape.slots.get(name)
+                method = None
+                if index is None:
+                    method = obj.klass.find_method(name)
+                    if method is None:
+                        raise KoiRuntimeError(expr.name, f"Undefined property {name!r}")
+                expr.cached_shape = shape
+                expr.cached_index = index
+                expr.cached_method = method
+            index = expr.cached_index
+            if index is not None:
+                return obj.values[index]
+            return expr.cached_method.bind(obj)
+        # Instances with their own lookup, like strings
         if isinstance(obj, KoiInstance):
-            # Find the property
             return obj.get(expr.name)
 
         raise KoiRuntimeError(
             expr.name, "Can only access properties from class instances"
         )
 
+    def _decide(self, stmt: Union[If, While]) -> bool:
+        """
+        Whether the condition of `stmt` holds, evaluated every time the
+        `If` or the `While` decides where to go
+        """
+        return self._is_truthy(self._evaluate(stmt.condition))
+
     def visit_if_stmt(self, stmt: If):
-        if self._is_truthy(self._evaluate(stmt.condition)):
-            self._execute(stmt.then_branch)
+        if self._decide(stmt):
+            return self._execute(stmt.then_branch)
         elif stmt.else_branch is not None:
-            self._execute(stmt.else_branch)
+            return self._execute(stmt.else_branch)
         return None
 
     def visit_return_stmt(self, stmt: Return):
         value = None
         if stmt.value:
             value = self._evaluate(stmt.value)
-        raise KoiReturnException(value=value)
+        self.return_value = value
+        return RETURN
 
     def visit_set_expr(self, expr: Set):
         obj = self._evaluate(expr.obj)
@@ -313,9 +552,32 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
             raise KoiRuntimeError(expr.name, "Must be an instance to have fields")
 
         value = self._evaluate(expr.value)
-        obj.set(expr.name, value)
+        if type(obj) is KoiInstance:
+            self._set_field(expr, obj, value)
+        else:
+            obj.set(expr.name, value)
         return value
 
+    def _set_field(self, expr: Set, obj: KoiInstance, value):
+        """
+        Store a field through the cache on `expr`, a miss looks the field up
+        on the shape, or finds the transition that adds it
+        """
+        shape = obj.shape
+        if expr.cached_shape is not shape:
+            index = shape.slots.get(expr.name.lexeme)
+            expr.cached_shape = shape
+            expr.cached_index = index
+            expr.cached_transition = (
+                shape.add_field(expr.name.lexeme) if index is None else None
+            )
+        index = expr.cached_index
+        if index is None:
+            obj.shape = expr.cached_transition
+            obj.values.append(value)
+        else:
+            obj.values[index] = value
+
     def visit_logical_expr(self, expr: Logical):
         left = self._evaluate(expr.left)
         if expr.operator.tok_type == TokenType.OR:
@@ -327,16 +589,100 @@ class Interpreter(ExprVisitor, StmtVisitor, TypeVisitor):
         return self._evaluate(expr.right)
 
     def visit_while_stmt(self, stmt: While):
-        while self._is_truthy(self._evaluate(stmt.condition)):
-            self._execute(stmt.body)
+        if stmt.compiled is not None:
+            return stmt.compiled(self.env, False)
+        threshold = self.tier_threshold
+        while self._decide(stmt):
+            if self._execute(stmt.body) is RETURN:
+                return RETURN
+            if threshold is not None:
+                stmt.back_edges += 1
+                if stmt.back_edges == threshold and self.tier_up(stmt) is not None:
+                    return stmt.compiled(self.env, True)
         return None
 
-    def resolve(self, expr: Expr, depth: int):
-        self.locals[expr] = depth
+    def visit_for_stmt(self, stmt: For):
+        if not stmt.has_scope:
+            return self._for_loop(stmt)
+        previous: Environment = self.env
+        try:
+            self.env = Environment(previous, stmt.size)
+            return self._for_loop(stmt)
+        finally:
+            self.env = previous
+
+    def _for_loop(self, stmt: For):
+        if stmt.initializer is not None:
+            self._execute(stmt.initializer)
+        if stmt.compiled is not None:
+            return stmt.compiled(self.env, False)
+        if stmt.counted:
+            return self._counted_loop(stmt)
+        return self._loop(stmt)
+
+    def _loop(self, stmt: For):
+        condition = stmt.condition
+        increment = stmt.increment
+        threshold = self.tier_threshold
+        while condition is None or self._is_truthy(self._evaluate(condition)):
+            if self._execute(stmt.body) is RETURN:
+                return RETURN
+            if threshold is not None:
+                stmt.back_edges += 1
+                if stmt.back_edges == threshold and self.tier_up(stmt) is not None:
+                    return stmt.compiled(self.env, True)
+            if increment is not None:
+                self._evaluate(increment)
+        return None
+
+    def _counted_loop(self, stmt: For):
+        """
+        Run a loop the resolver found to be counted with the counter in a
+        Python local. The counter is only stored back for a body that uses
+        it, and the loop goes on as a plain one once the counter or the
+        limit is not a float.
+        """
+        values = self.env.values
+        slot = stmt.initializer.slot
+        compare = FLOAT_OPERATORS[stmt.condition.operator.tok_type]
+        limit_expr = stmt.condition.right
+        step = stmt.increment.value.right.value
+        if stmt.increment.value.operator.tok_type == TokenType.MINUS:
+            step = -step
+        body = stmt.body
+        observed = stmt.observed
+        threshold = self.tier_threshold
+
+        counter = values[slot]
+        while type(counter) is float:
+            limit = self._evaluate(limit_expr)
+            if type(limit) is not float:
+                break
+            if not compare(counter, limit):
+                if observed:
+                    values[slot] = counter
+                return None
+            if observed:
+                values[slot] = counter
+            if self._execute(body) is RETURN:
+                return RETURN
+            if threshold is not None:
+                stmt.back_edges += 1
+                if stmt.back_edges == threshold and self.tier_up(stmt) is not None:
+                    values[slot] = counter
+                    return stmt.compiled(self.env, True)
+            counter += step
+        values[slot] = counter
+        return self._loop(stmt)
 
     def _lookup_variable(self, name: Token, expr: Variable):
-        distance = self.locals.get(expr)
-        if distance is not None:
-            return self.env.get_at(distance, name.lexeme)
-        else:
-            return self.globals.get(name)
+        if expr.depth is not None:
+            return self.env.get_at(expr.depth, expr.slot)
+
+        cell = expr.cell
+        if cell is None:
+            cell = expr.cell = self.globals.cell(name.lexeme)
+        value = cell.value
+        if value is UNDEFINED:
+            raise KoiRuntimeError(name, f"Undefined name {name.lexeme!r}")
+        return value
@@ -1,36 +1,132 @@
+import argparse
+import contextlib
+import difflib
+import io
 import sys
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Union
 
 from .tokens import Token
 from .token_type import TokenType
-from .scanner import Scanner
+from .fast_scanner import FastScanner
 from .parser import Parser  # type: ignore
 from .koi_runtime_error import KoiRuntimeError
 from .interpreter import Interpreter
 from .resolver import Resolver
+from .optimizer import Optimizer
+from .program_cache import ProgramCache
+from .feedback import Feedback
+from .profiling_interpreter import ProfilingInterpreter
+from .module_translator import ModuleTranslator
+from .stmt import Stmt
+from .version import VERSION
+from .closure_compiler import ClosureCompiler
+from .vm import VM
+
+BACKENDS = {
+    "tree": Interpreter,
+    "closure": ClosureCompiler,
+    "vm": VM,
+}
 
 
 class Koi:
-    def __init__(self):
+    def __init__(
+        self,
+        backend: str = "tree",
+        optimize: bool = False,
+        max_depth: Optional[int] = None,
+        cache: bool = True,
+        lazy: bool = False,
+        tier_threshold: Optional[int] = None,
+        profile: bool = False,
+    ):
+        """
+        `backend` picks what runs the resolved program, see `BACKENDS`.
+        With `optimize` the program goes through the `Optimizer` first.
+        `max_depth` limits how deep calls nest on the vm, which keeps its
+        call stack off the Python stack.
+        With `cache`, `run_file` keeps the compiled program in a
+        `ProgramCache` and skips compiling it when the script is unchanged.
+        With `lazy` the bodies of top level functions and methods are parsed
+        on their first call, on the tree walking interpreter only, unless
+        the program has constants.
+        `tier_threshold` is how many calls or loop iterations it takes the
+        tree walking interpreter to compile a function or loop to Python,
+        None or 0 never does.
+        With `profile`, `run_file` records what the program does on the tree
+        walking interpreter as `Feedback` next to the script. Later runs of
+        the script on it start from that feedback, unless `cache` is off.
+        """
         self.had_error = False
         self.had_runtime_error = False
-        self.interpreter: Interpreter = Interpreter()
+        self.backend = backend
+        self.optimize = optimize
+        self.cache = cache
+        self.lazy = lazy
+        self.profile = profile
+        # The global constants of every program run so far, for the repl
+        self.constants: Set[str] = set()
+        if profile:
+            if backend != "tree":
+                raise ValueError("profile is only supported by the tree backend")
+            if lazy:
+                raise ValueError("profile is not supported with lazy")
+            self.interpreter = ProfilingInterpreter()
+        else:
+            self.interpreter = BACKENDS[backend]()
+        if max_depth is not None:
+            if not isinstance(self.interpreter, VM):
+                raise ValueError("max_depth is only supported by the vm backend")
+            self.interpreter.max_depth = max_depth
+        if tier_threshold is not None:
+            if not isinstance(self.interpreter, Interpreter):
+                raise ValueError("tier_threshold is only supported by the tree backend")
+            self.interpreter.tier_threshold = tier_threshold or None
+        if lazy:
+            if not isinstance(self.interpreter, Interpreter):
+                raise ValueError("lazy is only supported by the tree backend")
+            self.interpreter.on_error = self.token_error
 
-    def run(self, source: str):
-        scanner = Scanner(source, on_error=self.error)
-        tokens = scanner.scan_tokens()
+    def run(self, source: Union[str, Iterable[str]]):
+        statements = self.compile(source)
+        if statements is not None:
+            self.execute(statements)
 
-        parser = Parser(tokens, on_error=self.token_error)
+    def compile(self, source: Union[str, Iterable[str]]) -> Optional[List[Stmt]]:
+        """Scan, parse and resolve `source`, None when it has errors"""
+        scanner = FastScanner(source, on_error=self.error)
+        parser = Parser(
+            scanner.token_buffer(), on_error=self.token_error, lazy=self.lazy
+        )
         statements = parser.parse()
+        # Assigning to a constant is an error whether or not the function
+        # doing it is ever called, so a program with constants isn't lazy
+        if self.lazy and (self.constants or parser.declares_constants()):
+            parser.parse_skipped(statements)
 
         if self.had_error:
             print("Had error")
-            return
+            return None
 
-        resolver = Resolver(self.interpreter, on_error=self.token_error)
+        resolver = Resolver(on_error=self.token_error, constants=self.constants)
         resolver.resolve(statements)
         if self.had_error:
             print("Had error")
-            return
+            return None
+        if self.optimize:
+            statements = Optimizer().optimize(statements)
+        return statements
+
+    def translate(self, source: str, name: str = "<koi>") -> Optional[str]:
+        """The Python module `koi compile` writes for `source`, None when
+        it has errors"""
+        statements = self.compile(source)
+        if statements is None:
+            return None
+        return ModuleTranslator().translate(statements, name)
+
+    def execute(self, statements: List[Stmt]):
         value = self.interpreter.interpret(statements)
         if value:
             print(value)
@@ -55,21 +151,44 @@ class Koi:
         self.had_error = True
 
     @staticmethod
-    def _load_file(file: str) -> str:
+    def _load_file(file: str) -> Iterator[str]:
         with open(file) as f:
-            contents = f.readlines()
-            lines = "".join(contents)
-            return lines
+            yield from f
 
     def run_file(self, file: str):
-        lines = self._load_file(file)
-        self.run(lines)
+        if self.cache or self.profile:
+            self._run_cached(file)
+        else:
+            self.run(self._load_file(file))
 
         if self.had_error:
             sys.exit(65)
         elif self.had_runtime_error:
             sys.exit(70)
 
+    def _run_cached(self, file: str):
+        with open(file) as f:
+            source = f.read()
+        flags = ("O" if self.optimize else "") + ("L" if self.lazy else "")
+        cache = ProgramCache(file, flags=flags)
+        statements = cache.load(source) if self.cache else None
+        if statements is None:
+            statements = self.compile(source)
+            if statements is None:
+                return
+            if self.cache:
+                cache.store(source, statements)
+        feedback = Feedback(file, flags=flags)
+        if self.profile:
+            try:
+                self.execute(statements)
+            finally:
+                feedback.store(source, statements, self.interpreter.records)
+            return
+        if isinstance(self.interpreter, Interpreter) and not self.lazy:
+            feedback.load(source, statements, self.interpreter)
+        self.execute(statements)
+
     def run_prompt(self):
         print("Koi v1.0")
         print("Press Ctrl+C or Ctrl+D to exit")
@@ -88,14 +207,174 @@ class Koi:
         print("So long and thanks for all the fish")
         sys.exit(0)
 
+    @staticmethod
+    def _capture(run, stdin: str) -> str:
+        """What `run` prints reading `stdin`, errors included"""
+        output = io.StringIO()
+        saved = sys.stdin
+        sys.stdin = io.StringIO(stdin)
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                try:
+                    run()
+                except SystemExit:
+                    pass
+                except Exception as error:
+                    print(f"{type(error).__name__}: {error}")
+        finally:
+            sys.stdin = saved
+        return output.getvalue()
+
+    @staticmethod
+    def conformance(directory: str, stdin: str = "") -> bool:
+        """
+        Run every script in `directory` on the interpreter and as the module
+        `koi compile` writes for it, both reading `stdin`, and print how
+        their outputs differ. True when none do.
+        """
+        passed = True
+        for script in sorted(Path(directory).glob("*.koi")):
+            source = script.read_text()
+            expected = Koi._capture(lambda: Koi(cache=False).run(source), stdin)
+
+            def run_module():
+                module = Koi(cache=False).translate(source, str(script))
+                if module is not None:
+                    code = compile(module, f"{script.stem}.py", "exec")
+                    exec(code, {"__name__": "__main__"})
+
+            actual = Koi._capture(run_module, stdin)
+            if actual == expected:
+                print(f"ok   {script}")
+                continue
+            passed = False
+            print(f"FAIL {script}")
+            sys.stdout.writelines(
+                difflib.unified_diff(
+                    expected.splitlines(keepends=True),
+                    actual.splitlines(keepends=True),
+                    "interpreter",
+                    "python",
+                )
+            )
+        return passed
+
+    @staticmethod
+    def compile_main(argv: List[str]):
+        """`koi compile`, translate a script to a Python module"""
+        parser = argparse.ArgumentParser(prog="koi compile")
+        parser.add_argument("script", nargs="?", help="file to compile")
+        parser.add_argument(
+            "--target",
+            choices=["python"],
+            default="python",
+            help="what to compile to",
+        )
+        parser.add_argument(
+            "-o",
+            dest="output",
+            help="file to write, the script with a .py suffix by default",
+        )
+        parser.add_argument(
+            "-O",
+            dest="optimize",
+            action="store_true",
+            help="fold constants and drop dead code before compiling",
+        )
+        parser.add_argument(
+            "--conformance",
+            metavar="DIR",
+            nargs="?",
+            const="examples",
+            help="compare the compiled scripts in DIR, examples/ by default, "
+            "with the interpreter instead, both read what is piped in",
+        )
+        args = parser.parse_args(argv)
+        if args.conformance is not None:
+            stdin = "" if sys.stdin.isatty() else sys.stdin.read()
+            sys.exit(0 if Koi.conformance(args.conformance, stdin) else 1)
+        if args.script is None:
+            parser.error("the script to compile is required")
+
+        koi = Koi(optimize=args.optimize, cache=False)
+        module = koi.translate(Path(args.script).read_text(), args.script)
+        if module is None:
+            sys.exit(65)
+        output = args.output or str(Path(args.script).with_suffix(".py"))
+        Path(output).write_text(module)
+
     @staticmethod
     def main():
         """Run Koi from the console. Accepts one argument as a file that
-        will be executed, or no arguments that will run the repl."""
-        if len(sys.argv) > 2:
-            print(f"Usage: {sys.argv[0]} [script]")
-            sys.exit(64)
-        elif len(sys.argv) == 2:
-            Koi().run_file(sys.argv[1])
+        will be executed, or no arguments that will run the repl.
+        `koi compile` translates a file to Python instead."""
+        if sys.argv[1:2] == ["compile"]:
+            Koi.compile_main(sys.argv[2:])
+            return
+        parser = argparse.ArgumentParser(prog="koi")
+        parser.add_argument("script", nargs="?", help="file to run")
+        parser.add_argument(
+            "--backend",
+            choices=sorted(BACKENDS),
+            default="tree",
+            help="execute with the tree walking interpreter, closure compiler or vm",
+        )
+        parser.add_argument(
+            "-O",
+            dest="optimize",
+            action="store_true",
+            help="fold constants and drop dead code before running",
+        )
+        parser.add_argument(
+            "--max-depth",
+            type=int,
+            help="how deep calls can nest on the vm backend",
+        )
+        parser.add_argument(
+            "--lazy",
+            action="store_true",
+            help="parse function bodies when they are first called",
+        )
+        parser.add_argument(
+            "--tier-threshold",
+            type=int,
+            help="calls or loop iterations before the tree backend compiles "
+            "a function or loop to Python, never by default or with 0",
+        )
+        parser.add_argument(
+            "--no-cache",
+            dest="cache",
+            action="store_false",
+            help="compile the script even if __koicache__ has it, and "
+            "ignore the feedback kept there",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="record runtime feedback in __koicache__ for later runs "
+            "of the script on the tree backend",
+        )
+        args = parser.parse_args()
+        if args.max_depth is not None and args.backend != "vm":
+            parser.error("--max-depth requires --backend vm")
+        if args.lazy and args.backend != "tree":
+            parser.error("--lazy requires --backend tree")
+        if args.tier_threshold is not None and args.backend != "tree":
+            parser.error("--tier-threshold requires --backend tree")
+        if args.profile and (args.backend != "tree" or args.lazy):
+            parser.error("--profile requires --backend tree, without --lazy")
+        if args.profile and args.script is None:
+            parser.error("--profile requires a script")
+        koi = Koi(
+            backend=args.backend,
+            optimize=args.optimize,
+            max_depth=args.max_depth,
+            cache=args.cache,
+            lazy=args.lazy,
+            tier_threshold=args.tier_threshold,
+            profile=args.profile,
+        )
+        if args.script is not None:
+            koi.run_file(args.script)
         else:
-            Koi().run_prompt()
+            koi.run_prompt()
@@ -1,8 +1,9 @@
 from .koi_callable import KoiCallable
 from .koi_instance import KoiInstance
 from .koi_function import KoiFunction
+from .shape import Shape
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from typing_extensions import Self
 
 
@@ -11,27 +12,30 @@ class KoiClass(KoiCallable):
         self.name = name
         self.methods = methods
         self.superclass = superclass
+        # Inherited methods are copied down once, so finding a method is a
+        # single lookup no matter how deep the hierarchy is
+        self.method_table: Dict[str, Any] = {}
+        if superclass is not None:
+            self.method_table.update(superclass.method_table)
+        self.method_table.update(methods)
+        self.initializer: Optional[KoiFunction] = self.method_table.get("init")
+        # The empty shape new instances start from, so instances of this
+        # class share their layouts with each other only
+        self.shape = Shape()
 
     def find_method(self, name: str):
-        try:
-            return self.methods[name]
-        except KeyError:
-            if self.superclass:
-                return self.superclass.find_method(name)
-            return None
+        return self.method_table.get(name)
 
     def __repr__(self) -> str:
         return f"<class {self.name!r}>"
 
     def call(self, interpreter, args: List):
         instance = KoiInstance(self)
-        initializer: KoiFunction = self.find_method("init")
-        if initializer is not None:
-            initializer.bind(instance).call(interpreter, args)
+        if self.initializer is not None:
+            self.initializer.invoke(interpreter, instance, args)
         return instance
 
     def arity(self) -> int:
-        initializer: KoiFunction = self.find_method("init")
-        if initializer:
-            return initializer.arity()
+        if self.initializer:
+            return self.initializer.arity()
         return 0
@@ -1,39 +1,78 @@
 from .environment import Environment
 from .koi_callable import KoiCallable
-from .koi_return_exception import KoiReturnException
+from .completion import RETURN, TAIL_CALL
 from .stmt import Function
 from typing import List
 
 
 class KoiFunction(KoiCallable):
     def __init__(
-        self, declaration: Function, closure: Environment, is_initializer: bool
+        self,
+        declaration: Function,
+        closure: Environment,
+        is_initializer: bool,
+        is_method: bool = False,
+        this=None,
     ) -> None:
         self.decl = declaration
         self.closure = closure
         self.is_initializer = is_initializer
+        # Methods keep `this` in the first slot of their own scope, a bound
+        # method is the same function with `this` filled in
+        self.is_method = is_method
+        self.this = this
 
     def call(self, interpreter, args: List):
-        env = Environment(self.closure)
-        for decl_token, arg in zip(self.decl.params, args):
-            env.define(decl_token.lexeme, arg)
-        try:
-            interpreter._exec_block(self.decl.body, env)
-        except KoiReturnException as return_value:
-            if self.is_initializer:
-                return self.closure.get_at(0, "this")
-            return return_value.value
-        if self.is_initializer:
-            return self.closure.get_at(0, "this")
-        return None
+        return self.invoke(interpreter, self.this, args)
+
+    def invoke(self, interpreter, this, args: List):
+        """
+        Call the function with `this` as the receiver, no binding needed.
+        Calls in tail position come back here as TAIL_CALL and are made by
+        this loop, so tail recursion runs in constant Python stack.
+        """
+        fn = self
+        while True:
+            decl = fn.decl
+            if decl.body is None:
+                interpreter.compile_body(decl)
+            env = Environment(fn.closure, decl.size)
+            values = env.values
+            # Parameters take the first slots of the call's scope, after `this`
+            if fn.is_method:
+                values[0] = this
+                values[1 : len(args) + 1] = args
+            else:
+                values[: len(args)] = args
+
+            compiled = decl.compiled
+            if compiled is None:
+                # Hot functions are compiled to Python
+                decl.calls += 1
+                if decl.calls == interpreter.tier_threshold:
+                    compiled = interpreter.tier_up(decl)
+            if compiled is not None:
+                value = compiled(env)
+                if fn.is_initializer:
+                    return values[0]
+            else:
+                completion = interpreter._exec_block(decl.body, env)
+                if fn.is_initializer:
+                    return values[0]
+                if completion is not RETURN:
+                    return None
+                value = interpreter.return_value
+            if value is not TAIL_CALL:
+                return value
+            fn, this, args = interpreter.tail_call
 
     def arity(self) -> int:
         return len(self.decl.params)
 
     def bind(self, instance):
-        env = Environment(self.closure)
-        env.define("this", instance)
-        return KoiFunction(self.decl, env, self.is_initializer)
+        return KoiFunction(
+            self.decl, self.closure, self.is_initializer, self.is_method, instance
+        )
 
     def __repr__(self) -> str:
         return f"<function {self.decl.name.lexeme}>"
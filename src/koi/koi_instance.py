@@ -1,19 +1,26 @@
-from typing import Any
+from typing import Any, List
 from .tokens import Token
 from .koi_runtime_error import KoiRuntimeError
+from .shape import Shape
 
 
 class KoiInstance:
+    # Fields live in `values`, laid out by `shape`, instead of a dict per
+    # instance. Every instance starts at the empty shape of its class.
+    __slots__ = ("klass", "shape", "values")
+
     def __init__(self, klass) -> None:
         self.klass = klass
-        self.fields = {}
+        self.shape: Shape = klass.shape
+        self.values: List[Any] = []
 
     def __repr__(self) -> str:
         return f"<instance of class {self.klass.name!r}>"
 
     def get(self, name: Token):
-        if name.lexeme in self.fields:
-            return self.fields[name.lexeme]
+        index = self.shape.slots.get(name.lexeme)
+        if index is not None:
+            return self.values[index]
 
         method = self.klass.find_method(name.lexeme)
         if method is not None:
@@ -22,4 +29,9 @@ class KoiInstance:
         raise KoiRuntimeError(name, f"Undefined property {name.lexeme!r}")
 
     def set(self, name: Token, value: Any):
-        self.fields[name.lexeme] = value
+        index = self.shape.slots.get(name.lexeme)
+        if index is None:
+            self.shape = self.shape.add_field(name.lexeme)
+            self.values.append(value)
+        else:
+            self.values[index] = value
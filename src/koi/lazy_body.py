@@ -0,0 +1,23 @@
+from typing import Optional, Set
+
+from .class_type import ClassType
+from .function_type import FunctionType
+from .token_buffer import TokenBuffer
+
+
+class LazyBody:
+    """
+    A function body the parser stepped over: its tokens run from `start`
+    up to the closing brace at `end` in `tokens`. The resolver fills in the
+    kind of function and class it was declared in, and the constants of
+    the program, which is all it needs to resolve the body on its own once
+    it's parsed.
+    """
+
+    def __init__(self, tokens: TokenBuffer, start: int, end: int) -> None:
+        self.tokens = tokens
+        self.start = start
+        self.end = end
+        self.function_type: Optional[FunctionType] = None
+        self.class_type = ClassType.NONE
+        self.constants: Set[str] = set()
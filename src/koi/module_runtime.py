@@ -0,0 +1,260 @@
+"""
+What Python modules written by `koi compile --target python` import. Koi
+classes are Python classes deriving from `Instance`, Koi functions are
+Python functions, and these helpers do what the `Interpreter` does for the
+values a translated operation doesn't handle inline, errors included.
+"""
+
+import operator
+import sys
+from types import FunctionType, MethodType
+from typing import Callable, List
+
+from .koi_callable import KoiCallable
+from .koi_instance import KoiInstance
+from .koi_runtime_error import KoiRuntimeError
+from .std import (
+    Clock,
+    Input,
+    Print,
+    Println,
+    ReadFile,
+    StringDataType,
+    StringInstance,
+    ToInt,
+    WriteFile,
+)
+from .token_type import TokenType
+from .tokens import Token
+
+
+class KoiType(type):
+    """The type of classes compiled from Koi, so they print like Koi classes"""
+
+    def __repr__(cls) -> str:
+        return f"<class {cls.koi_name!r}>"
+
+
+class Instance(metaclass=KoiType):
+    """The base of every class compiled from Koi. Fields are attributes."""
+
+    koi_name = "Instance"
+
+    def __init__(self) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"<instance of class {type(self).koi_name!r}>"
+
+
+class Native:
+    """
+    A native function of the interpreter, callable from Python. Functions
+    are passed to it as Koi text, since Python functions don't print the
+    way Koi functions do.
+    """
+
+    def __init__(self, native: KoiCallable) -> None:
+        self.native = native
+
+    def __call__(self, *args):
+        arity = self.native.arity()
+        if len(args) != arity:
+            raise KoiRuntimeError(
+                None, f"Expected {arity} arguments but got {len(args)}"
+            )
+        args = [
+            text(arg) if isinstance(arg, (FunctionType, MethodType)) else arg
+            for arg in args
+        ]
+        return self.native.call(None, args)
+
+    def __repr__(self) -> str:
+        return repr(self.native)
+
+
+def text(value) -> str:
+    """`str` of a value, with functions printed the way Koi prints them"""
+    if type(value) is FunctionType:
+        return f"<function {value.__name__}>"
+    if type(value) is MethodType:
+        return f"<function {value.__func__.__name__}>"
+    return str(value)
+
+
+def function(name: str) -> Callable[[FunctionType], FunctionType]:
+    """Give a translated function the name it has in Koi"""
+
+    def named(fn: FunctionType) -> FunctionType:
+        fn.__name__ = name
+        return fn
+
+    return named
+
+
+# The globals every program starts with, by their Koi names
+BUILTINS = {
+    "clock": Native(Clock()),
+    "input": Native(Input()),
+    "read_file": Native(ReadFile()),
+    "write_file": Native(WriteFile()),
+    "string": Native(StringDataType()),
+    "print": Native(Print()),
+    "println": Native(Println()),
+    "toInt": Native(ToInt()),
+}
+
+# How deep calls can nest, like `VM.max_depth`
+MAX_DEPTH = 100000
+
+COMPARISONS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float))
+
+
+def negate(value):
+    if _is_number(value):
+        return -int(value)
+    raise KoiRuntimeError(None, f"Operand {value} must be a number")
+
+
+def add(left, right):
+    if _is_number(left) and _is_number(right):
+        return float(left) + float(right)
+    elif isinstance(left, (str, StringInstance)):
+        return text(left) + text(right)
+    raise KoiRuntimeError(None, "Both operands must be either numbers or string")
+
+
+def subtract(left, right):
+    _check_numbers(left, right)
+    return float(left) - float(right)
+
+
+def multiply(left, right):
+    _check_numbers(left, right)
+    return float(left) * float(right)
+
+
+def divide(left, right):
+    if right == 0:
+        raise KoiRuntimeError(None, f"Cannot divide {left} by zero")
+    _check_numbers(left, right)
+    return float(left) / float(right)
+
+
+def compare(symbol: str, left, right) -> bool:
+    _check_numbers(left, right)
+    return COMPARISONS[symbol](float(left), float(right))
+
+
+def _check_numbers(left, right) -> None:
+    if not (_is_number(left) and _is_number(right)):
+        raise KoiRuntimeError(None, "Operands must be numbers")
+
+
+def undeclared(name: str):
+    raise KoiRuntimeError(
+        None, f"Cannot assign to variable {name!r} before it was declared."
+    )
+
+
+def _token(name: str) -> Token:
+    return Token(TokenType.IDENTIFIER, name, None, 0)
+
+
+def get_property(obj, name: str):
+    """`obj.name` when `obj` has no such attribute"""
+    if isinstance(obj, Instance):
+        raise KoiRuntimeError(None, f"Undefined property {name!r}")
+    # Instances with their own lookup, like strings
+    if isinstance(obj, KoiInstance):
+        return obj.get(_token(name))
+    raise KoiRuntimeError(None, "Can only access properties from class instances")
+
+
+def fields(obj) -> None:
+    """Check `obj` can have fields set, before the value is evaluated"""
+    if not isinstance(obj, KoiInstance):
+        raise KoiRuntimeError(None, "Must be an instance to have fields")
+
+
+def set_property(obj, name: str, value) -> None:
+    """`obj.name = value` on an instance of the interpreter, like a string"""
+    obj.set(_token(name), value)
+
+
+def superclass(value):
+    if not isinstance(value, KoiType):
+        raise KoiRuntimeError(None, "Superclass must a class")
+    return value
+
+
+def super_method(klass, name: str):
+    method = getattr(klass, f"k_{name}", None)
+    if method is None:
+        raise KoiRuntimeError(None, f"Undefined property {name!r}")
+    return method
+
+
+def bind(method, this):
+    return MethodType(method, this)
+
+
+def _arity(fn):
+    """The number of arguments `fn` takes, None when it can't be called"""
+    if type(fn) is FunctionType:
+        return fn.__code__.co_argcount
+    if type(fn) is MethodType:
+        return fn.__func__.__code__.co_argcount - 1
+    if isinstance(fn, KoiType):
+        return fn.__init__.__code__.co_argcount - 1
+    if isinstance(fn, Native):
+        return fn.native.arity()
+    if isinstance(fn, KoiCallable):
+        return fn.arity()
+    return None
+
+
+def call(fn, args: List, error: TypeError):
+    """
+    `fn(*args)` raised `error`. Either `fn` is a native method of the
+    interpreter, which is called here, or the call was wrong the way Koi
+    reports it, or the error came from inside the call and goes on.
+    """
+    arity = _arity(fn)
+    if arity is None:
+        raise KoiRuntimeError(None, "Can only call functions and classes")
+    if len(args) != arity:
+        raise KoiRuntimeError(None, f"Expected {arity} arguments but got {len(args)}")
+    if isinstance(fn, KoiCallable):
+        return fn.call(None, args)
+    raise error
+
+
+def run(main: Callable[[], None]) -> None:
+    """
+    Run a translated program, reporting errors like the interpreter. Koi
+    calls are Python calls, tail calls included, so they can nest as deep
+    as calls on the vm.
+    """
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), MAX_DEPTH))
+    try:
+        main()
+    except KoiRuntimeError as error:
+        print(error)
+        raise SystemExit
+    except NameError as error:
+        # Globals are `k_` and their Koi name, nothing else goes undefined
+        name = getattr(error, "name", None) or ""
+        if not name.startswith("k_"):
+            raise
+        print(f"Undefined name {name[2:]!r}")
+        raise SystemExit
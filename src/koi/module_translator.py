@@ -0,0 +1,605 @@
+import math
+from typing import Dict, List, Optional, Set, Tuple
+
+from .module_runtime import BUILTINS
+from .token_type import TokenType
+from .types import TypeVisitor
+from .version import VERSION
+from .expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    ExprVisitor,
+    Get,
+    Grouping,
+    Inline,
+    Literal,
+    Logical,
+    Set as SetExpr,
+    Super,
+    This,
+    Unary,
+    Variable,
+)
+from .stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Return,
+    Stmt,
+    StmtVisitor,
+    Var,
+    While,
+)
+
+# What a translated module imports from `module_runtime`
+IMPORTS = (
+    "BUILTINS",
+    "Instance",
+    "StringInstance",
+    "add",
+    "bind",
+    "call",
+    "compare",
+    "divide",
+    "fields",
+    "function",
+    "get_property",
+    "multiply",
+    "negate",
+    "run",
+    "set_property",
+    "subtract",
+    "super_method",
+    "superclass",
+    "undeclared",
+)
+
+# The Python operator for each operator a translation runs on two floats,
+# and the helper that runs it on anything else
+ARITHMETIC = {
+    TokenType.PLUS: ("+", "add"),
+    TokenType.MINUS: ("-", "subtract"),
+    TokenType.STAR: ("*", "multiply"),
+    TokenType.SLASH: ("/", "divide"),
+}
+
+COMPARISONS = {
+    TokenType.GREATER: ">",
+    TokenType.GREATER_EQUAL: ">=",
+    TokenType.LESS: "<",
+    TokenType.LESS_EQUAL: "<=",
+}
+
+
+class Code:
+    """A Python function being written, `main` or a Koi function"""
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        # The cell lists of enclosing functions the function uses, it gets
+        # them as keyword only parameters when it is defined
+        self.free: Dict[str, "Frame"] = {}
+        # The globals the function assigns
+        self.globals: Dict[str, None] = {}
+
+
+class Frame:
+    """
+    A frame of the resolved program, in the Python function that runs it.
+    Locals a nested function uses are kept in a list, `cells`, made every
+    time the frame is entered, so closures see them the way they see an
+    `Environment`. All the other locals are Python locals.
+    """
+
+    def __init__(self, number: int, code: Code, captured: List[int]) -> None:
+        self.number = number
+        self.code = code
+        self.cells_name = f"s{number}"
+        # The index in the cell list of every captured slot
+        self.cells = {slot: index for index, slot in enumerate(sorted(captured))}
+        self.names: Dict[int, str] = {}
+
+
+class ModuleTranslator(ExprVisitor, StmtVisitor, TypeVisitor):
+    """
+    Translates a resolved program to the source of a standalone Python
+    module, for `koi compile --target python`. Koi functions become Python
+    functions, classes become classes deriving from `Instance`, globals are
+    module globals named `k_` and their Koi name. The top level statements
+    run in `main`.
+
+    A local is only kept in a cell list when a nested function uses it,
+    which the first of two passes over the program finds out.
+
+    Like `PythonTranslator`, expression visitors emit the statements that
+    compute the value and return a name or a constant that holds it.
+    """
+
+    def translate(self, statements: List[Stmt], source: str = "<koi>") -> str:
+        self.captured: Set[Tuple[int, int]] = set()
+        self._translate(statements)
+        main = self._translate(statements)
+
+        lines = [
+            f"# Translated from {source} by koi {VERSION}",
+            "from src.koi.module_runtime import (",
+            *(f"    {name}," for name in IMPORTS),
+            ")",
+            "",
+            "GLOBALS = globals()",
+            *(f"k_{name} = BUILTINS[{name!r}]" for name in BUILTINS),
+            "",
+            "",
+            "def main():",
+        ]
+        if main.globals:
+            lines.append(f"    global {', '.join(main.globals)}")
+        lines.extend(f"    {line}" for line in main.lines)
+        if not main.lines:
+            lines.append("    pass")
+        lines.extend(["", "", 'if __name__ == "__main__":', "    run(main)", ""])
+        return "\n".join(lines)
+
+    def _translate(self, statements: List[Stmt]) -> Code:
+        self.code = Code()
+        self.indent = 0
+        self.temps = 0
+        self.frames: List[Frame] = []
+        self.frame_count = 0
+        self.initializer = False
+        self._statements(statements)
+        return self.code
+
+    # Emitting code
+
+    def _emit(self, line: str) -> None:
+        self.code.lines.append("    " * self.indent + line)
+
+    def _temp(self) -> str:
+        self.temps += 1
+        return f"t{self.temps}"
+
+    def _block(self, emit) -> None:
+        """Emit an indented block, `pass` when nothing was emitted"""
+        self.indent += 1
+        start = len(self.code.lines)
+        emit()
+        if len(self.code.lines) == start:
+            self._emit("pass")
+        self.indent -= 1
+
+    def _open_frame(self) -> Frame:
+        self.frame_count += 1
+        number = self.frame_count
+        captured = [slot for frame, slot in self.captured if frame == number]
+        frame = Frame(number, self.code, captured)
+        self.frames.append(frame)
+        return frame
+
+    def _open_block_frame(self) -> None:
+        frame = self._open_frame()
+        if frame.cells:
+            self._emit(f"{frame.cells_name} = [None] * {len(frame.cells)}")
+
+    def _local(self, depth: int, slot: int) -> str:
+        """Where the local `slot` of the frame `depth` frames out is"""
+        frame = self.frames[-1 - depth]
+        outside = frame.code is not self.code
+        if outside:
+            self.captured.add((frame.number, slot))
+        index = frame.cells.get(slot)
+        if index is None:
+            return frame.names.get(slot, "None")
+        if outside:
+            self.code.free[frame.cells_name] = frame
+        return f"{frame.cells_name}[{index}]"
+
+    def _declare(self, slot: Optional[int], name: str) -> str:
+        """Where a new variable is kept, a global when `slot` is None"""
+        if slot is None:
+            self.code.globals[f"k_{name}"] = None
+            return f"k_{name}"
+        frame = self.frames[-1]
+        frame.names[slot] = f"l_{name}_{frame.number}_{slot}"
+        return self._local(0, slot)
+
+    def _named(self, value: str) -> str:
+        """`value`, in a temporary when it is a number or a string"""
+        if value.isidentifier() or value in ("None", "True", "False"):
+            return value
+        temp = self._temp()
+        self._emit(f"{temp} = {value}")
+        return temp
+
+    @staticmethod
+    def _truthy(value: str) -> str:
+        return f"{value} is not None and {value} is not False"
+
+    @staticmethod
+    def _falsy(value: str) -> str:
+        return f"{value} is None or {value} is False"
+
+    # Statements
+
+    def _statements(self, statements: List[Stmt]) -> None:
+        for stmt in statements:
+            stmt.accept(self)
+
+    def visit_block_stmt(self, stmt: Block):
+        if not stmt.has_scope:
+            self._statements(stmt.statements)
+            return
+        self._open_block_frame()
+        self._statements(stmt.statements)
+        self.frames.pop()
+
+    def visit_class_stmt(self, stmt: Class):
+        base = "Instance"
+        if stmt.superclass is not None:
+            value = self._expression(stmt.superclass)
+            base = self._temp()
+            self._emit(f"{base} = superclass({value})")
+        target = self._declare(stmt.slot, stmt.name.lexeme)
+        name = target if target.isidentifier() else self._temp()
+        if stmt.superclass is not None:
+            # The methods find the superclass in a frame of its own
+            frame = self._open_frame()
+            frame.names[0] = base
+            if frame.cells:
+                self._emit(f"{frame.cells_name} = [{base}]")
+
+        self._emit(f"class {name}({base}):")
+        self.indent += 1
+        self._emit(f"koi_name = {stmt.name.lexeme!r}")
+        for method in stmt.methods:
+            method_name = method.name.lexeme
+            if method_name != "init":
+                self._function(method, f"k_{method_name}", method=True)
+                continue
+            # `init` runs when the class is called, and returns the
+            # instance when it is called as a method
+            self._function(method, "__init__", method=True, initializer=True)
+            params = ["this", *(f"p{i}" for i in range(len(method.params)))]
+            self._emit('@function("init")')
+            self._emit(f"def k_init({', '.join(params)}):")
+            self._block(lambda: self._emit(f"__class__.__init__({', '.join(params)})"))
+            self.indent += 1
+            self._emit("return this")
+            self.indent -= 1
+        self.indent -= 1
+
+        if stmt.superclass is not None:
+            self.frames.pop()
+        if name != target:
+            self._emit(f"{target} = {name}")
+
+    def visit_expression_stmt(self, stmt: Expression):
+        self._expression(stmt.expression)
+
+    def visit_for_stmt(self, stmt: For):
+        if stmt.has_scope:
+            self._open_block_frame()
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        self._emit("while True:")
+
+        def emit():
+            if stmt.condition is not None:
+                condition = self._condition(stmt.condition)
+                self._emit(f"if {self._falsy(condition)}:")
+                self._block(lambda: self._emit("break"))
+            stmt.body.accept(self)
+            if stmt.increment is not None:
+                self._expression(stmt.increment)
+
+        self._block(emit)
+        if stmt.has_scope:
+            self.frames.pop()
+
+    def visit_function_stmt(self, stmt: Function):
+        target = self._declare(stmt.slot, stmt.name.lexeme)
+        if target.isidentifier():
+            self._function(stmt, target)
+            return
+        name = self._temp()
+        self._function(stmt, name)
+        self._emit(f"{target} = {name}")
+
+    def _function(
+        self,
+        stmt: Function,
+        name: str,
+        method: bool = False,
+        initializer: bool = False,
+    ) -> None:
+        """Emit `stmt` as a Python function called `name`"""
+        enclosing, indent = self.code, self.indent
+        enclosing_initializer = self.initializer
+        code = Code()
+        self.code, self.indent = code, 0
+        self.initializer = initializer
+
+        frame = self._open_frame()
+        names = ["this"] if method else []
+        names.extend(param.lexeme for param in stmt.params)
+        params = []
+        for slot, param in enumerate(names):
+            frame.names[slot] = f"l_{param}_{frame.number}_{slot}"
+            params.append(frame.names[slot])
+        if frame.cells:
+            values = [
+                frame.names[slot] if slot < len(names) else "None"
+                for slot in sorted(frame.cells)
+            ]
+            self._emit(f"{frame.cells_name} = [{', '.join(values)}]")
+        self._statements(stmt.body)
+        self.frames.pop()
+
+        self.code, self.indent = enclosing, indent
+        self.initializer = enclosing_initializer
+        for cells_name, outer in code.free.items():
+            if outer.code is not enclosing:
+                enclosing.free[cells_name] = outer
+        if code.free:
+            params.append("*")
+            params.extend(f"{cells}={cells}" for cells in code.free)
+
+        self._emit(f"@function({stmt.name.lexeme!r})")
+        self._emit(f"def {name}({', '.join(params)}):")
+        self.indent += 1
+        if code.globals:
+            self._emit(f"global {', '.join(code.globals)}")
+        for line in code.lines:
+            self._emit(line)
+        if not code.lines:
+            self._emit("pass")
+        self.indent -= 1
+
+    def visit_if_stmt(self, stmt: If):
+        condition = self._condition(stmt.condition)
+        self._emit(f"if {self._truthy(condition)}:")
+        self._block(lambda: stmt.then_branch.accept(self))
+        if stmt.else_branch is not None:
+            self._emit("else:")
+            self._block(lambda: stmt.else_branch.accept(self))
+
+    def visit_return_stmt(self, stmt: Return):
+        if self.initializer:
+            self._emit("return")
+            return
+        value = "None"
+        if stmt.value is not None:
+            value = self._expression(stmt.value)
+        self._emit(f"return {value}")
+
+    def visit_var_stmt(self, stmt: Var):
+        value = "None"
+        if stmt.initializer is not None:
+            value = self._expression(stmt.initializer)
+        self._emit(f"{self._declare(stmt.slot, stmt.name.lexeme)} = {value}")
+
+    def visit_while_stmt(self, stmt: While):
+        self._emit("while True:")
+
+        def emit():
+            condition = self._condition(stmt.condition)
+            self._emit(f"if {self._falsy(condition)}:")
+            self._block(lambda: self._emit("break"))
+            stmt.body.accept(self)
+
+        self._block(emit)
+
+    # Expressions
+
+    def _expression(self, expr: Expr) -> str:
+        return expr.accept(self)
+
+    def _condition(self, expr: Expr) -> str:
+        """An expression whose value is tested with `is`"""
+        return self._named(self._expression(expr))
+
+    def visit_literal_expr(self, expr: Literal):
+        value = expr.value
+        if type(value) is float and not math.isfinite(value):
+            return f"float({str(value)!r})"
+        return repr(value)
+
+    def visit_string_type(self, string: str):
+        value = self._temp()
+        self._emit(f"{value} = StringInstance({string!r})")
+        return value
+
+    def visit_grouping_expr(self, expr: Grouping):
+        return self._expression(expr.expression)
+
+    def visit_inline_expr(self, expr: Inline):
+        # Python functions are cheap enough to call, and globals are
+        # Python globals here, with nothing to check the function against
+        return self._expression(expr.call)
+
+    def visit_unary_expr(self, expr: Unary):
+        right = self._condition(expr.right)
+        value = self._temp()
+        if expr.operator.tok_type == TokenType.MINUS:
+            self._emit(
+                f"{value} = -int({right}) if type({right}) is float "
+                f"else negate({right})"
+            )
+        elif expr.operator.tok_type == TokenType.BANG:
+            self._emit(f"{value} = {self._falsy(right)}")
+        else:
+            self._emit(f"{value} = None")
+        return value
+
+    def visit_binary_expr(self, expr: Binary):
+        operator = expr.operator.tok_type
+        if operator in (TokenType.EQUAL_EQUAL, TokenType.BANG_EQUAL):
+            left = self._condition(expr.left)
+            right = self._condition(expr.right)
+        else:
+            left = self._expression(expr.left)
+            right = self._expression(expr.right)
+        value = self._temp()
+        # A number literal needs no check
+        checks = [
+            f"type({operand}) is float"
+            for operand, node in ((left, expr.left), (right, expr.right))
+            if not (isinstance(node, Literal) and type(node.value) is float)
+        ]
+        floats = " and ".join(checks) or "True"
+
+        if operator in ARITHMETIC or operator == TokenType.MOD:
+            symbol, helper = ARITHMETIC.get(operator, ("%", None))
+            if operator in (TokenType.SLASH, TokenType.MOD):
+                # Dividing by zero is an error the interpreter reports
+                floats += f" and {right} != 0.0"
+            self._emit(f"if {floats}:")
+            self._block(lambda: self._emit(f"{value} = {left} {symbol} {right}"))
+            self._emit("else:")
+            if helper is None:
+                fallback = f"float({left}) % float({right})"
+            else:
+                fallback = f"{helper}({left}, {right})"
+            self._block(lambda: self._emit(f"{value} = {fallback}"))
+        elif operator in COMPARISONS:
+            symbol = COMPARISONS[operator]
+            self._emit(
+                f"{value} = {left} {symbol} {right} if {floats} "
+                f"else compare({symbol!r}, {left}, {right})"
+            )
+        elif operator == TokenType.EQUAL_EQUAL:
+            self._emit(
+                f"{value} = {right} is None if {left} is None else {left} == {right}"
+            )
+        elif operator == TokenType.BANG_EQUAL:
+            self._emit(
+                f"{value} = {right} is not None if {left} is None "
+                f"else not {left} == {right}"
+            )
+        else:
+            self._emit(f"{value} = None")
+        return value
+
+    def visit_logical_expr(self, expr: Logical):
+        left = self._condition(expr.left)
+        value = self._temp()
+        if expr.operator.tok_type == TokenType.OR:
+            self._emit(f"if {self._truthy(left)}:")
+        else:
+            self._emit(f"if {self._falsy(left)}:")
+        self._block(lambda: self._emit(f"{value} = {left}"))
+        self._emit("else:")
+
+        def emit():
+            right = self._expression(expr.right)
+            self._emit(f"{value} = {right}")
+
+        self._block(emit)
+        return value
+
+    def visit_variable_expr(self, expr: Variable):
+        value = self._temp()
+        if expr.depth is None:
+            self._emit(f"{value} = k_{expr.name.lexeme}")
+        else:
+            self._emit(f"{value} = {self._local(expr.depth, expr.slot)}")
+        return value
+
+    def visit_this_expr(self, expr: This):
+        value = self._temp()
+        self._emit(f"{value} = {self._local(expr.depth, expr.slot)}")
+        return value
+
+    def visit_assign_expr(self, expr: Assign):
+        value = self._expression(expr.value)
+        if expr.depth is not None:
+            self._emit(f"{self._local(expr.depth, expr.slot)} = {value}")
+            return value
+        name = expr.name.lexeme
+        self.code.globals[f"k_{name}"] = None
+        self._emit(f'if "k_{name}" not in GLOBALS:')
+        self._block(lambda: self._emit(f"undeclared({name!r})"))
+        self._emit(f"k_{name} = {value}")
+        return value
+
+    def _get(self, obj: str, name: str, value: str) -> None:
+        self._emit("try:")
+        self._block(lambda: self._emit(f"{value} = {obj}.k_{name}"))
+        self._emit("except AttributeError:")
+        self._block(lambda: self._emit(f"{value} = get_property({obj}, {name!r})"))
+
+    def visit_get_expr(self, expr: Get):
+        obj = self._expression(expr.obj)
+        value = self._temp()
+        self._get(obj, expr.name.lexeme, value)
+        return value
+
+    def visit_set_expr(self, expr: SetExpr):
+        obj = self._expression(expr.obj)
+        name = expr.name.lexeme
+        is_instance = self._temp()
+        # Fields go on anything but a number or nil in Python, and the value
+        # is only evaluated once `obj` is known to take them
+        self._emit(f"{is_instance} = isinstance({obj}, Instance)")
+        self._emit(f"if not {is_instance}:")
+        self._block(lambda: self._emit(f"fields({obj})"))
+        value = self._expression(expr.value)
+        self._emit(f"if {is_instance}:")
+        self._block(lambda: self._emit(f"{obj}.k_{name} = {value}"))
+        self._emit("else:")
+        self._block(lambda: self._emit(f"set_property({obj}, {name!r}, {value})"))
+        return value
+
+    def _super(self, expr: Super) -> Tuple[str, str]:
+        """The method `expr` names and the receiver to call it with"""
+        superclass = self._local(expr.depth, expr.slot)
+        this = self._local(expr.depth - 1, 0)
+        method = self._temp()
+        receiver = self._temp()
+        self._emit(f"{receiver} = {this}")
+        self._emit(f"{method} = super_method({superclass}, {expr.method.lexeme!r})")
+        return method, receiver
+
+    def visit_super_expr(self, expr: Super):
+        method, this = self._super(expr)
+        value = self._temp()
+        self._emit(f"{value} = bind({method}, {this})")
+        return value
+
+    def visit_call_expr(self, expr: Call):
+        callee = expr.callee
+        value = self._temp()
+        if isinstance(callee, Super):
+            method, this = self._super(callee)
+            args = self._arguments(expr)
+            self._emit("try:")
+            self._block(
+                lambda: self._emit(f"{value} = {method}({', '.join([this, *args])})")
+            )
+            self._emit("except TypeError as e:")
+            self._block(
+                lambda: self._emit(
+                    f"{value} = call(bind({method}, {this}), [{', '.join(args)}], e)"
+                )
+            )
+            return value
+
+        if isinstance(callee, Get):
+            fn = self._temp()
+            self._get(self._expression(callee.obj), callee.name.lexeme, fn)
+        else:
+            fn = self._expression(callee)
+        args = ", ".join(self._arguments(expr))
+        self._emit("try:")
+        self._block(lambda: self._emit(f"{value} = {fn}({args})"))
+        self._emit("except TypeError as e:")
+        self._block(lambda: self._emit(f"{value} = call({fn}, [{args}], e)"))
+        return value
+
+    def _arguments(self, expr: Call) -> List[str]:
+        return [self._expression(arg) for arg in expr.arguments]
@@ -0,0 +1,56 @@
+import enum
+
+
+class OpCode(enum.IntEnum):
+    """
+    Instructions understood by the VM. Every opcode is followed by the
+    number of operands noted next to it, each stored as a plain int in
+    the chunk's code list.
+    """
+
+    # Constants and literals
+    CONSTANT = enum.auto()  # constant index
+    STRING = enum.auto()  # constant index
+    NIL = enum.auto()
+    TRUE = enum.auto()
+    FALSE = enum.auto()
+    POP = enum.auto()
+    # Variables
+    GET_LOCAL = enum.auto()  # slot
+    SET_LOCAL = enum.auto()  # slot
+    GET_GLOBAL = enum.auto()  # constant index of the GlobalCell
+    DEFINE_GLOBAL = enum.auto()  # constant index of the GlobalCell
+    SET_GLOBAL = enum.auto()  # constant index of the GlobalCell
+    GET_UPVALUE = enum.auto()  # upvalue index
+    SET_UPVALUE = enum.auto()  # upvalue index
+    CLOSE_UPVALUE = enum.auto()
+    # Properties
+    GET_PROPERTY = enum.auto()  # constant index of the name token
+    SET_PROPERTY = enum.auto()  # constant index of the name token
+    GET_SUPER = enum.auto()  # constant index of the name token
+    # Operators
+    EQUAL = enum.auto()
+    NOT_EQUAL = enum.auto()
+    GREATER = enum.auto()
+    GREATER_EQUAL = enum.auto()
+    LESS = enum.auto()
+    LESS_EQUAL = enum.auto()
+    ADD = enum.auto()
+    SUBTRACT = enum.auto()
+    MULTIPLY = enum.auto()
+    DIVIDE = enum.auto()
+    MODULO = enum.auto()
+    NOT = enum.auto()
+    NEGATE = enum.auto()
+    # Control flow, offsets are relative to the instruction after the operand
+    JUMP = enum.auto()  # offset
+    JUMP_IF_FALSE = enum.auto()  # offset, leaves the condition on the stack
+    JUMP_IF_TRUE = enum.auto()  # offset, leaves the condition on the stack
+    POP_JUMP_IF_FALSE = enum.auto()  # offset
+    LOOP = enum.auto()  # backwards offset
+    # Functions and classes
+    CALL = enum.auto()  # argument count
+    INVOKE = enum.auto()  # constant index of the name token, argument count
+    CLOSURE = enum.auto()  # constant index, then (is_local, index) per upvalue
+    RETURN = enum.auto()
+    CLASS = enum.auto()  # constant index of the name, method count, has superclass
@@ -0,0 +1,370 @@
+import copy
+from typing import Dict, List, Optional, Set as SetType
+
+from .program_cache import walk
+from .interpreter import Interpreter
+from .koi_runtime_error import KoiRuntimeError
+from .types import StringType
+from .token_type import TokenType
+from .expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    ExprVisitor,
+    Get,
+    Grouping,
+    Inline,
+    Literal,
+    Logical,
+    Set,
+    Super,
+    This,
+    Unary,
+    Variable,
+)
+from .stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Return,
+    Stmt,
+    StmtVisitor,
+    Var,
+    While,
+)
+
+# How many nodes the value a function returns can have for calls to it to
+# be inlined
+INLINE_SIZE = 10
+
+
+class Optimizer(ExprVisitor, StmtVisitor):
+    """
+    Rewrites a resolved program: constants that are literals are put in
+    where they are read, operators on literals are folded, `if`
+    statements with a literal condition keep only the branch that runs,
+    groupings are unwrapped and expression statements that can't do
+    anything are dropped. Nodes are rewritten in place, so whatever the
+    resolver stored on them stays.
+
+    Calls to small top level functions are inlined: a function whose body
+    is a single `return` of a few nodes, declared once, never assigned to
+    and not recursive, see `_inlinable`. When the arguments are constants,
+    or locals the function can't change, the call becomes an `Inline` of
+    the returned value with the arguments in place of the parameters.
+
+    Every expression visitor returns the expression to use instead of the
+    one visited, every statement visitor returns the statement to use, or
+    None when the statement can be removed.
+    """
+
+    def __init__(self) -> None:
+        # Folding evaluates the operator on the real operands, so a folded
+        # value is exactly what running the program would have produced
+        self.evaluator = Interpreter()
+        # The functions calls can be inlined to, by their names
+        self.inlinable: Dict[str, Function] = {}
+
+    def optimize(self, statements: List[Stmt]) -> List[Stmt]:
+        self.inlinable = self._inlinable(statements)
+        return self._statements(statements)
+
+    def _inlinable(self, statements: List[Stmt]) -> Dict[str, Function]:
+        """The top level functions of the program calls can be inlined to"""
+        nodes = list(walk(statements))
+        # Assignments can hide in bodies that aren't parsed yet
+        if any(isinstance(node, Function) and node.body is None for node in nodes):
+            return {}
+        assigned = {
+            node.name.lexeme
+            for node in nodes
+            if isinstance(node, Assign) and node.depth is None
+        }
+        declared: Dict[str, int] = {}
+        for stmt in statements:
+            if isinstance(stmt, (Class, Function, Var)):
+                name = stmt.name.lexeme
+                declared[name] = declared.get(name, 0) + 1
+
+        functions: Dict[str, Function] = {}
+        for stmt in statements:
+            if (
+                isinstance(stmt, Function)
+                and declared[stmt.name.lexeme] == 1
+                and stmt.name.lexeme not in assigned
+                and self._is_small(stmt)
+            ):
+                functions[stmt.name.lexeme] = stmt
+
+        # Inlining a function that reaches itself would never end
+        def reaches(name: str, target: str, seen: SetType[str]) -> bool:
+            for used in self._globals(functions[name]):
+                if used == target:
+                    return True
+                if used in functions and used not in seen:
+                    seen.add(used)
+                    if reaches(used, target, seen):
+                        return True
+            return False
+
+        return {
+            name: function
+            for name, function in functions.items()
+            if not reaches(name, name, set())
+        }
+
+    @staticmethod
+    def _is_small(function: Function) -> bool:
+        """Whether `function` only returns a value of a few nodes"""
+        body = function.body
+        if len(body) != 1 or not isinstance(body[0], Return):
+            return False
+        if body[0].value is None:
+            return False
+        nodes = list(walk([body[0].value]))
+        if len(nodes) > INLINE_SIZE:
+            return False
+        # Parameters are the only locals, and they can't be assigned to
+        return not any(
+            isinstance(node, Assign) and node.depth is not None for node in nodes
+        )
+
+    @staticmethod
+    def _globals(function: Function) -> SetType[str]:
+        return {
+            node.name.lexeme
+            for node in walk(function.body)
+            if isinstance(node, Variable) and node.depth is None
+        }
+
+    def _statements(self, statements: List[Stmt]) -> List[Stmt]:
+        optimized = (self._statement(stmt) for stmt in statements)
+        return [stmt for stmt in optimized if stmt is not None]
+
+    def _statement(self, stmt: Stmt) -> Optional[Stmt]:
+        return stmt.accept(self)
+
+    def _body(self, stmt: Stmt) -> Stmt:
+        """Optimize a statement that can't be removed, like a loop body"""
+        optimized = self._statement(stmt)
+        if optimized is None:
+            empty = Block([])
+            empty.has_scope = False
+            return empty
+        return optimized
+
+    def _expression(self, expr: Expr) -> Expr:
+        # Strings create a new instance every time they are evaluated, they
+        # are kept as they are
+        if isinstance(expr, StringType):
+            return expr
+        return expr.accept(self)
+
+    def _fold(self, expr: Expr) -> Expr:
+        """Evaluate `expr`, keep it when evaluating fails at runtime anyway"""
+        try:
+            return Literal(expr.accept(self.evaluator))
+        except (KoiRuntimeError, ArithmeticError, TypeError, ValueError):
+            return expr
+
+    # Statements
+
+    def visit_block_stmt(self, stmt: Block):
+        stmt.statements = self._statements(stmt.statements)
+        return stmt
+
+    def visit_class_stmt(self, stmt: Class):
+        for method in stmt.methods:
+            self.visit_function_stmt(method)
+        return stmt
+
+    def visit_expression_stmt(self, stmt: Expression):
+        stmt.expression = self._expression(stmt.expression)
+        if self._is_pure(stmt.expression):
+            return None
+        return stmt
+
+    def _is_pure(self, expr: Expr) -> bool:
+        """
+        Whether evaluating `expr` can't have any effect. Reading a global
+        is not, since it fails when the global isn't defined yet.
+        """
+        if isinstance(expr, (Literal, StringType, This)):
+            return True
+        return isinstance(expr, Variable) and expr.depth is not None
+
+    def visit_for_stmt(self, stmt: For):
+        if stmt.initializer is not None:
+            stmt.initializer = self._statement(stmt.initializer)
+        if stmt.condition is not None:
+            stmt.condition = self._expression(stmt.condition)
+        if stmt.increment is not None:
+            stmt.increment = self._expression(stmt.increment)
+        stmt.body = self._body(stmt.body)
+        return stmt
+
+    def visit_function_stmt(self, stmt: Function):
+        # A body that isn't parsed yet runs as it is written
+        if stmt.body is not None:
+            stmt.body = self._statements(stmt.body)
+        return stmt
+
+    def visit_if_stmt(self, stmt: If):
+        stmt.condition = self._expression(stmt.condition)
+        if isinstance(stmt.condition, Literal):
+            if self.evaluator._is_truthy(stmt.condition.value):
+                return self._statement(stmt.then_branch)
+            if stmt.else_branch is not None:
+                return self._statement(stmt.else_branch)
+            return None
+
+        stmt.then_branch = self._body(stmt.then_branch)
+        if stmt.else_branch is not None:
+            stmt.else_branch = self._statement(stmt.else_branch)
+        return stmt
+
+    def visit_return_stmt(self, stmt: Return):
+        if stmt.value is not None:
+            stmt.value = self._expression(stmt.value)
+        return stmt
+
+    def visit_var_stmt(self, stmt: Var):
+        if stmt.initializer is not None:
+            stmt.initializer = self._expression(stmt.initializer)
+        return stmt
+
+    def visit_while_stmt(self, stmt: While):
+        stmt.condition = self._expression(stmt.condition)
+        stmt.body = self._body(stmt.body)
+        return stmt
+
+    # Expressions
+
+    def visit_assign_expr(self, expr: Assign):
+        expr.value = self._expression(expr.value)
+        return expr
+
+    def visit_binary_expr(self, expr: Binary):
+        expr.left = self._expression(expr.left)
+        expr.right = self._expression(expr.right)
+        if isinstance(expr.left, Literal) and isinstance(expr.right, Literal):
+            return self._fold(expr)
+        return expr
+
+    def visit_call_expr(self, expr: Call):
+        expr.callee = self._expression(expr.callee)
+        expr.arguments = [self._expression(arg) for arg in expr.arguments]
+        callee = expr.callee
+        if isinstance(callee, Variable) and callee.depth is None:
+            function = self.inlinable.get(callee.name.lexeme)
+            if function is not None and self._can_inline(expr, function):
+                return self._inline(expr, function)
+        return expr
+
+    @staticmethod
+    def _can_inline(expr: Call, function: Function) -> bool:
+        """
+        Whether the arguments of `expr` can be put in for the parameters,
+        evaluated as often and in whatever order the body uses them
+        """
+        if len(expr.arguments) != len(function.params):
+            return False
+        # The function can call something that changes a captured local
+        calls = any(isinstance(node, (Call, Inline)) for node in walk(function.body))
+        for arg in expr.arguments:
+            if isinstance(arg, Literal):
+                continue
+            local = isinstance(arg, (Variable, This)) and arg.depth is not None
+            if local and not calls:
+                continue
+            return False
+        return True
+
+    def _inline(self, expr: Call, function: Function) -> Inline:
+        value = function.body[0].value
+        body = self._substitute(value, expr.arguments)
+        # Calls in the body are made where the body is now, only the value
+        # itself is still returned when the call was
+        self._tail(body, expr.tail)
+        return Inline(expr, function, self._expression(body))
+
+    def _substitute(self, expr: Expr, arguments: List[Expr]) -> Expr:
+        """A copy of `expr`, with the arguments for the parameters it reads"""
+        if isinstance(expr, Variable) and expr.depth is not None:
+            return arguments[expr.slot]
+        copied = copy.copy(expr)
+        for name, value in vars(copied).items():
+            if isinstance(value, Expr):
+                setattr(copied, name, self._substitute(value, arguments))
+            elif isinstance(value, list):
+                setattr(
+                    copied,
+                    name,
+                    [self._substitute(item, arguments) for item in value],
+                )
+        if isinstance(copied, Call):
+            copied.tail = False
+        return copied
+
+    def _tail(self, expr: Expr, tail: bool) -> None:
+        if isinstance(expr, Call):
+            expr.tail = tail
+        elif isinstance(expr, Inline):
+            expr.call.tail = tail
+            self._tail(expr.body, tail)
+
+    def visit_get_expr(self, expr: Get):
+        expr.obj = self._expression(expr.obj)
+        return expr
+
+    def visit_grouping_expr(self, expr: Grouping):
+        return self._expression(expr.expression)
+
+    def visit_inline_expr(self, expr: Inline):
+        # The call stays as it was written, for when the guard fails
+        expr.body = self._expression(expr.body)
+        return expr
+
+    def visit_literal_expr(self, expr: Literal):
+        return expr
+
+    def visit_logical_expr(self, expr: Logical):
+        expr.left = self._expression(expr.left)
+        expr.right = self._expression(expr.right)
+        if not isinstance(expr.left, Literal):
+            return expr
+
+        # The left operand is the result when it decides the outcome,
+        # otherwise the result is the right operand, whatever it is
+        truthy = self.evaluator._is_truthy(expr.left.value)
+        if expr.operator.tok_type == TokenType.OR:
+            return expr.left if truthy else expr.right
+        return expr.right if truthy else expr.left
+
+    def visit_set_expr(self, expr: Set):
+        expr.obj = self._expression(expr.obj)
+        expr.value = self._expression(expr.value)
+        return expr
+
+    def visit_super_expr(self, expr: Super):
+        return expr
+
+    def visit_this_expr(self, expr: This):
+        return expr
+
+    def visit_unary_expr(self, expr: Unary):
+        expr.right = self._expression(expr.right)
+        if isinstance(expr.right, Literal):
+            return self._fold(expr)
+        return expr
+
+    def visit_variable_expr(self, expr: Variable):
+        # The declaration came first, its value is folded by now
+        constant = expr.constant
+        if constant is not None and isinstance(constant.initializer, Literal):
+            return Literal(constant.initializer.value)
+        return expr
@@ -1,4 +1,5 @@
-from typing import List
+import enum
+from typing import Iterable, List, Optional, Union
 
 from .expr import (
     Binary,
@@ -21,16 +22,57 @@ from .stmt import (
     Stmt,
     Var,
     Block,
+    For,
     If,
     While,
     Return,
     Class,
 )
+from .lazy_body import LazyBody
 from .token_type import TokenType
+from .token_buffer import TokenBuffer
 from .tokens import Token
 from .types import StringType
 
 
+EOF = TokenType.EOF.value
+SEMICOLON = TokenType.SEMICOLON.value
+LEFT_BRACE = TokenType.LEFT_BRACE.value
+RIGHT_BRACE = TokenType.RIGHT_BRACE.value
+CONST = TokenType.CONST.value
+IDENTIFIER = TokenType.IDENTIFIER.value
+# Declarations a body can't be skipped over, see `_skip_body`
+DECLARATIONS = {TokenType.FUNC.value, TokenType.CLASS.value}
+STATEMENT_STARTS = {
+    token_type.value
+    for token_type in (
+        TokenType.CLASS,
+        TokenType.FUNC,
+        TokenType.VAR,
+        TokenType.CONST,
+        TokenType.FOR,
+        TokenType.IF,
+        TokenType.WHILE,
+        TokenType.RETURN,
+    )
+}
+
+
+class Precedence(enum.IntEnum):
+    """How tightly the operators bind, from loosest to tightest"""
+
+    NONE = enum.auto()
+    ASSIGNMENT = enum.auto()  # =
+    OR = enum.auto()  # or
+    AND = enum.auto()  # and
+    EQUALITY = enum.auto()  # ! !=
+    COMPARISON = enum.auto()  # > >= < <= ==
+    TERM = enum.auto()  # + -
+    FACTOR = enum.auto()  # / * %
+    UNARY = enum.auto()  # ! -
+    CALL = enum.auto()  # . ()
+
+
 class ParseError(Exception):
     def __init__(self, token: Token, message: str):
         self.token = token
@@ -39,31 +81,76 @@ class ParseError(Exception):
 
 
 class Parser:
-    def __init__(self, tokens: List[Token], on_error=None):
+    def __init__(
+        self,
+        tokens: Union[TokenBuffer, Iterable[Token]],
+        on_error=None,
+        lazy: bool = False,
+    ):
+        """
+        `tokens` is a `TokenBuffer`, or any iterable of tokens, like a
+        scanner's token stream, which is put in one. Tokens are read from
+        the buffer as the parser gets to them and only the ones that end up
+        in the tree or in an error are made into `Token` objects.
+
+        With `lazy` the bodies of top level functions and of methods are
+        only brace matched, see `parse_body`.
+        """
+        if not isinstance(tokens, TokenBuffer):
+            tokens = TokenBuffer.from_tokens(tokens)
         self.tokens = tokens
-        self.current = 0
+        self.types = tokens.types
         self.on_error = on_error
+        self.lazy = lazy
+        self.current = 0
+        tokens.pull()
 
     def parse(self) -> List[Stmt]:
         statements: List[Stmt] = []
         while not self.is_at_end():
+            statements.append(self._declaration(top_level=True))
+        return statements
+
+    def declares_constants(self) -> bool:
+        """Whether a `const` was read so far"""
+        return CONST in self.types
+
+    def parse_skipped(self, statements: List[Stmt]) -> None:
+        """Parse every body a lazy parser stepped over in `statements`"""
+        for stmt in statements:
+            functions = stmt.methods if isinstance(stmt, Class) else [stmt]
+            for function in functions:
+                if isinstance(function, Function) and function.lazy is not None:
+                    function.body = self.parse_body(function.lazy)
+                    function.lazy = None
+
+    def parse_body(self, body: LazyBody) -> List[Stmt]:
+        """Parse the statements of a body a lazy parser stepped over"""
+        self.current = body.start
+        statements: List[Stmt] = []
+        while self.current < body.end:
             statements.append(self._declaration())
         return statements
 
-    def _declaration(self) -> Stmt:
+    def _declaration(self, top_level: bool = False) -> Stmt:
+        # Only functions at the top level can be parsed later, nothing they
+        # use can live in a scope around them
+        lazy = self.lazy and top_level
         try:
             if self.match(TokenType.FUNC):
-                return self._function("function")
+                return self._function("function", lazy)
             if self.match(TokenType.CLASS):
-                return self._class_declaration()
+                return self._class_declaration(lazy)
             if self.match(TokenType.VAR):
                 return self._var_declaration()
+            if self.match(TokenType.CONST):
+                return self._const_declaration()
             return self._statement()
         except ParseError:
             self._synchronize()
             return None
 
-    def _class_declaration(self):
+    def _class_declaration(self, lazy: bool = False):
         name: Token = self.consume(
             TokenType.IDENTIFIER, "Expected valid identifier in class declaration"
         )
@@ -78,12 +165,12 @@ class Parser:
 
         methods: List[Function] = []
         while not self.check(TokenType.RIGHT_BRACE) and not self.is_at_end():
-            methods.append(self._function("method"))
+            methods.append(self._function("method", lazy))
 
         self.consume(TokenType.RIGHT_BRACE, "Expect '}' after class body")
         return Class(name, methods, superclass)
 
-    def _function(self, kind: str) -> Function:
+    def _function(self, kind: str, lazy: bool = False) -> Function:
         name = self.consume(TokenType.IDENTIFIER, f"Expected {kind} name")
         name  # Here to avoid flake8 F841
         self.consume(TokenType.LEFT_PAREN, f"Expect '(' after {kind} name")
@@ -103,9 +190,56 @@ class Parser:
                 )
         self.consume(TokenType.RIGHT_PAREN, "Expect ')' after parameters")
         self.consume(TokenType.LEFT_BRACE, "Expect '{' before " + kind + " body")
+        if lazy:
+            skipped = self._skip_body(kind)
+            if skipped is not None:
+                function = Function(name, params, None)
+                function.lazy = skipped
+                return function
         body = self._block()
         return Function(name, params, body)
 
+    def _skip_body(self, kind: str) -> Optional[LazyBody]:
+        """
+        Step over a body up to its closing brace. Nothing is skipped when
+        the braces don't match, when a function or class is declared in
+        the body, or when what follows can't follow a `kind` body, a brace
+        too many or too few inside it can make any of these happen. The
+        body is parsed right away then, which reports the error where an
+        eager parser does.
+        """
+        start = self.current
+        types = self.types
+        depth = 0
+        while not self.is_at_end():
+            token_type = types[self.current]
+            if token_type == RIGHT_BRACE:
+                if depth == 0:
+                    self._step()
+                    if not self._can_follow(kind):
+                        break
+                    return LazyBody(self.tokens, start, self.current - 1)
+                depth -= 1
+            elif token_type == LEFT_BRACE:
+                depth += 1
+            elif token_type in DECLARATIONS and depth == 0:
+                break
+            self._step()
+        self.current = start
+        return None
+
+    def _can_follow(self, kind: str) -> bool:
+        """Whether the current token can come right after a `kind` body"""
+        token_type = self.types[self.current]
+        if kind == "method":
+            return token_type == IDENTIFIER or token_type == RIGHT_BRACE
+        return (
+            token_type == EOF
+            or token_type == LEFT_BRACE
+            or token_type in STATEMENT_STARTS
+            or token_type in PREFIX_RULES
+        )
+
     def _var_declaration(self) -> Stmt:
         name: Token = self.consume(TokenType.IDENTIFIER, "Expected identifier")
         init_val: Expr | None = None
@@ -114,6 +248,15 @@ class Parser:
         self.consume(TokenType.SEMICOLON, "Expected ';' after variable declaration.")
         return Var(name, init_val)
 
+    def _const_declaration(self) -> Stmt:
+        name: Token = self.consume(TokenType.IDENTIFIER, "Expected identifier")
+        self.consume(TokenType.EQUAL, "Expected '=' after constant name.")
+        value = self._expression()
+        self.consume(TokenType.SEMICOLON, "Expected ';' after constant declaration.")
+        stmt = Var(name, value)
+        stmt.const = True
+        return stmt
+
     def _statement(self) -> Stmt:
         if self.match(TokenType.IF):
             return self._if_statement()
@@ -160,15 +303,7 @@ class Parser:
         # Get the body
         body = self._statement()
 
-        # Desugar it; turn it into a while loop
-        if increment is not None:
-            body = Block([body, Expression(increment)])
-        if condition is None:
-            condition = Literal(True)
-        body = While(condition, body)
-        if initializer is not None:
-            body = Block([initializer, body])
-        return body
+        return For(initializer, condition, increment, body)
 
     def _while_statement(self):
         self.consume(TokenType.LEFT_PAREN, "Expected '(' after while keyword")
@@ -204,109 +339,95 @@ class Parser:
         return Expression(expr)
 
     def _expression(self):
-        return self._assignment()
+        return self._parse_precedence(Precedence.ASSIGNMENT)
+
+    def _parse_precedence(self, precedence: "Precedence") -> Expr:
+        """
+        Parse an expression whose operators all bind at least as tightly as
+        `precedence`. The rules for a token are looked up in `PREFIX_RULES`
+        and `INFIX_RULES`.
+        """
+        prefix = PREFIX_RULES.get(self.types[self.current])
+        if prefix is None:
+            raise self._error(self.peek(), "Expected Expression")
+        self._step()
+        expr = prefix(self)
+
+        types = self.types
+        while True:
+            infix = INFIX_RULES.get(types[self.current])
+            if infix is None or infix[0] < precedence:
+                return expr
+            self._step()
+            expr = infix[1](self, expr)
 
-    def _assignment(self):
-        expr = self._or()
+    # Prefix rules, the token is already consumed
 
-        if self.match(TokenType.EQUAL):
-            equals = self.previous()
-            value = self._assignment()
-
-            if isinstance(expr, Variable):
-                name = expr.name
-                return Assign(name, value)
-            elif isinstance(expr, Get):
-                return Set(expr.obj, expr.name, value)
-            self._error(equals, "Invalid assignment target")
-        return expr
-
-    def _or(self) -> Expr:
-        expr: Expr = self._and()
-
-        while self.match(TokenType.OR):
-            op: Token = self.previous()
-            right: Expr = self._and()
-            expr = Logical(expr, op, right)
-
-        return expr
-
-    def _and(self) -> Expr:
-        expr: Expr = self._equality()
-
-        while self.match(TokenType.AND):
-            op: Token = self.previous()
-            right: Expr = self._equality()
-            expr = Logical(expr, op, right)
-
-        return expr
-
-    def _equality(self):
-        expr = self.comparison()
-
-        while self.match(TokenType.BANG, TokenType.BANG_EQUAL):
-            op = self.previous()
-            right = self.comparison()
-            expr = Binary(expr, op, right)
-
-        return expr
-
-    def comparison(self):
-        expr = self.term()
-
-        while self.match(
-            TokenType.GREATER,
-            TokenType.GREATER_EQUAL,
-            TokenType.LESS,
-            TokenType.LESS_EQUAL,
-            TokenType.EQUAL_EQUAL,
-        ):
-            op = self.previous()
-            right = self.term()
-            expr = Binary(expr, op, right)
-        return expr
-
-    def term(self):
-        expr = self.factor()
-
-        while self.match(TokenType.MINUS, TokenType.PLUS):
-            op = self.previous()
-            right = self.factor()
-            expr = Binary(expr, op, right)
-
-        return expr
-
-    def factor(self):
-        expr = self.unary()
-
-        while self.match(TokenType.SLASH, TokenType.STAR, TokenType.MOD):
-            op = self.previous()
-            right = self.unary()
-            expr = Binary(expr, op, right)
-
-        return expr
-
-    def unary(self):
-        if self.match(TokenType.BANG, TokenType.MINUS):
-            op = self.previous()
-            right = self.unary()
-            return Unary(op, right)
-        return self._call()
-
-    def _call(self) -> Expr:
-        expr = self.primary()
-        while True:
-            if self.match(TokenType.LEFT_PAREN):
-                expr = self._finish_call(expr)
-            elif self.match(TokenType.DOT):
-                name = self.consume(
-                    TokenType.IDENTIFIER,
-                    "Expect valid identifier as property name following '.'",
-                )
-                expr = Get(expr, name)
-            else:
-                break
-        return expr
+    def _false(self) -> Expr:
+        return Literal(False)
+
+    def _true(self) -> Expr:
+        return Literal(True)
+
+    def _nil(self) -> Expr:
+        return Literal(None)
+
+    def _variable(self) -> Expr:
+        return Variable(self.previous())
+
+    def _number(self) -> Expr:
+        return Literal(self.previous().literal)
+
+    def _string(self) -> Expr:
+        return StringType(self.previous().literal)
+
+    def _this(self) -> Expr:
+        return This(self.previous())
+
+    def _super(self) -> Expr:
+        keyword = self.previous()
+        self.consume(TokenType.DOT, "Expected '.' after super")
+        method = self.consume(
+            TokenType.IDENTIFIER, "Expected superclass method name after '.'"
+        )
+        return Super(keyword, method)
+
+    def _grouping(self) -> Expr:
+        # Only an equality goes between parentheses, `(a or b)` is an error
+        expr = self._parse_precedence(Precedence.EQUALITY)
+        self.consume(TokenType.RIGHT_PAREN, "Expected ')' after expression")
+        return Grouping(expr)
+
+    def _unary(self) -> Expr:
+        op = self.previous()
+        right = self._parse_precedence(Precedence.UNARY)
+        return Unary(op, right)
+
+    # Infix rules, `left` is what was parsed before the operator
+
+    def _binary(self, left: Expr) -> Expr:
+        op = self.previous()
+        precedence = INFIX_RULES[self.types[self.current - 1]][0]
+        right = self._parse_precedence(precedence + 1)
+        return Binary(left, op, right)
+
+    def _logical(self, left: Expr) -> Expr:
+        op = self.previous()
+        precedence = INFIX_RULES[self.types[self.current - 1]][0]
+        right = self._parse_precedence(precedence + 1)
+        return Logical(left, op, right)
+
+    def _assign(self, target: Expr) -> Expr:
+        equals = self.previous()
+        # Assignment is right associative
+        value = self._parse_precedence(Precedence.ASSIGNMENT)
+
+        if isinstance(target, Variable):
+            name = target.name
+            return Assign(name, value)
+        elif isinstance(target, Get):
+            return Set(target.obj, target.name, value)
+        self._error(equals, "Invalid assignment target")
 
     def _finish_call(self, callee: Expr) -> Expr:
         arguments: List[Expr] = []
@@ -319,34 +440,12 @@ class Parser:
         )
         return Call(callee, paren, arguments)
 
-    def primary(self):
-        if self.match(TokenType.FALSE):
-            return Literal(False)
-        elif self.match(TokenType.TRUE):
-            return Literal(True)
-        elif self.match(TokenType.NIL):
-            return Literal(None)
-        elif self.match(TokenType.IDENTIFIER):
-            return Variable(self.previous())
-        elif self.match(TokenType.NUMBER):
-            return Literal(self.previous().literal)
-        elif self.match(TokenType.STRING):
-            return StringType(self.previous().literal)
-        elif self.match(TokenType.THIS):
-            return This(self.previous())
-        elif self.match(TokenType.SUPER):
-            keyword = self.previous()
-            self.consume(TokenType.DOT, "Expected '.' after super")
-            method = self.consume(
-                TokenType.IDENTIFIER, "Expected superclass method name after '.'"
-            )
-            return Super(keyword, method)
-        elif self.match(TokenType.LEFT_PAREN):
-            expr = self._equality()
-            self.consume(TokenType.RIGHT_PAREN, "Expected ')' after expression")
-            return Grouping(expr)
-
-        raise self._error(self.peek(), "Expected Expression")
+    def _get(self, obj: Expr) -> Expr:
+        name = self.consume(
+            TokenType.IDENTIFIER,
+            "Expect valid identifier as property name following '.'",
+        )
+        return Get(obj, name)
 
     def consume(self, tok_type: TokenType, message: str):
         if self.check(tok_type):
@@ -356,40 +455,87 @@ class Parser:
     def match(self, *token_types: List[TokenType]):
         for token_type in token_types:
             if self.check(token_type):
-                self.advance()
+                self._step()
                 return True
         return False
 
     def check(self, tok_type: TokenType):
         if self.is_at_end():
             return False
-        return self.peek().tok_type == tok_type
+        return self.types[self.current] == tok_type.value
 
     def advance(self) -> Token:
+        self._step()
+        return self.previous()
+
+    def _step(self):
         if not self.is_at_end():
             self.current += 1
-        return self.previous()
+            if self.current == len(self.types):
+                self.tokens.pull()
 
     def is_at_end(self) -> bool:
-        return self.peek().tok_type == TokenType.EOF
+        return self.types[self.current] == EOF
 
     def peek(self) -> Token:
-        return self.tokens[self.current]
+        return self.tokens.token(self.current)
 
     def previous(self) -> Token:
-        return self.tokens[self.current - 1]
+        return self.tokens.token(self.current - 1)
 
     def _error(self, token: Token, message: str):
         self.on_error(token, message)
         raise ParseError(token, message)
 
     def _synchronize(self):
-        self.advance()
+        self._step()
 
         while not self.is_at_end():
-            if self.previous().tok_type == TokenType.SEMICOLON:
+            if self.types[self.current - 1] == SEMICOLON:
+                return
+            if self.types[self.current] in STATEMENT_STARTS:
                 return
-            match self.peek().tok_type:
-                case TokenType.CLASS | TokenType.FUNC | TokenType.VAR | TokenType.FOR | TokenType.IF | TokenType.WHILE | TokenType.RETURN:
-                    return
-            self.advance()
+            self._step()
+
+
+# Rules keyed on the value of the token type, which is what `TokenBuffer`
+# stores
+PREFIX_RULES = {
+    token_type.value: rule
+    for token_type, rule in (
+        (TokenType.FALSE, Parser._false),
+        (TokenType.TRUE, Parser._true),
+        (TokenType.NIL, Parser._nil),
+        (TokenType.IDENTIFIER, Parser._variable),
+        (TokenType.NUMBER, Parser._number),
+        (TokenType.STRING, Parser._string),
+        (TokenType.THIS, Parser._this),
+        (TokenType.SUPER, Parser._super),
+        (TokenType.LEFT_PAREN, Parser._grouping),
+        (TokenType.BANG, Parser._unary),
+        (TokenType.MINUS, Parser._unary),
+    )
+}
+
+INFIX_RULES = {
+    token_type.value: (precedence, rule)
+    for token_type, precedence, rule in (
+        (TokenType.EQUAL, Precedence.ASSIGNMENT, Parser._assign),
+        (TokenType.OR, Precedence.OR, Parser._logical),
+        (TokenType.AND, Precedence.AND, Parser._logical),
+        (TokenType.BANG, Precedence.EQUALITY, Parser._binary),
+        (TokenType.BANG_EQUAL, Precedence.EQUALITY, Parser._binary),
+        (TokenType.GREATER, Precedence.COMPARISON, Parser._binary),
+        (TokenType.GREATER_EQUAL, Precedence.COMPARISON, Parser._binary),
+        (TokenType.LESS, Precedence.COMPARISON, Parser._binary),
+        (TokenType.LESS_EQUAL, Precedence.COMPARISON, Parser._binary),
+        (TokenType.EQUAL_EQUAL, Precedence.COMPARISON, Parser._binary),
+        (TokenType.MINUS, Precedence.TERM, Parser._binary),
+        (TokenType.PLUS, Precedence.TERM, Parser._binary),
+        (TokenType.SLASH, Precedence.FACTOR, Parser._binary),
+        (TokenType.STAR, Precedence.FACTOR, Parser._binary),
+        (TokenType.MOD, Precedence.FACTOR, Parser._binary),
+        (TokenType.LEFT_PAREN, Precedence.CALL, Parser._finish_call),
+        (TokenType.DOT, Precedence.CALL, Parser._get),
+    )
+}
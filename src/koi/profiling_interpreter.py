@@ -0,0 +1,73 @@
+from typing import Any, Dict, Union
+
+from .expr import Binary, Call, Get, Set
+from .interpreter import Interpreter
+from .koi_instance import KoiInstance
+from .stmt import For, Function, If, While
+
+
+class ProfilingInterpreter(Interpreter):
+    """
+    The tree walking interpreter, recording feedback about the nodes it
+    runs for `Feedback` to keep: the operand types of every `Binary`, the
+    class and fields of the receivers at every property access, method
+    call and field store, and which way every `If` and `While` went.
+
+    With a tier threshold functions and loops still move to Python once
+    they are hot, which is recorded as well, and nothing more is recorded
+    about them after that. Operators aren't quickened while profiling.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # The feedback about every node, by the id of the node
+        self.records: Dict[int, Dict[str, Any]] = {}
+
+    def _record(self, node) -> Dict[str, Any]:
+        record = self.records.get(id(node))
+        if record is None:
+            record = self.records[id(node)] = {}
+        return record
+
+    def _count(self, node, kind: str, key: str) -> None:
+        counts = self._record(node).setdefault(kind, {})
+        counts[key] = counts.get(key, 0) + 1
+
+    def _receiver(self, node: Union[Get, Set, Call], obj) -> None:
+        if type(obj) is KoiInstance:
+            fields = ",".join(obj.shape.slots)
+            self._count(node, "receivers", f"{obj.klass.name} {fields}")
+
+    def tier_up(self, unit: Union[Function, While, For]):
+        compiled = super().tier_up(unit)
+        if compiled is not None:
+            self._record(unit)["tiered"] = True
+        return compiled
+
+    def deoptimize(self, unit: Union[Function, While, For]):
+        super().deoptimize(unit)
+        self._record(unit)["deopts"] = unit.deopts
+
+    def visit_binary_expr(self, expr: Binary):
+        left = self._evaluate(expr.left)
+        right = self._evaluate(expr.right)
+        self._count(expr, "types", f"{type(left).__name__} {type(right).__name__}")
+        return self.binary(expr.operator, left, right)
+
+    def _get_property(self, expr: Get, obj):
+        self._receiver(expr, obj)
+        return super()._get_property(expr, obj)
+
+    def _set_field(self, expr: Set, obj: KoiInstance, value):
+        self._receiver(expr, obj)
+        super()._set_field(expr, obj, value)
+
+    def _invoke_method(self, expr: Call, method, this):
+        if type(expr.callee) is Get:
+            self._receiver(expr, this)
+        return super()._invoke_method(expr, method, this)
+
+    def _decide(self, stmt: Union[If, While]) -> bool:
+        taken = super()._decide(stmt)
+        self._count(stmt, "branches", "taken" if taken else "skipped")
+        return taken
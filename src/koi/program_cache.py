@@ -0,0 +1,131 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Type, Union
+
+from .expr import Expr
+from .stmt import Stmt
+from .version import VERSION
+
+CACHE_DIR = "__koicache__"
+
+Node = Union[Expr, Stmt]
+
+
+def walk(statements: List[Stmt]) -> Iterator[Node]:
+    """
+    Every node of a program, parents before their children. The order only
+    depends on the source, so the index of a node is the same every run.
+    Expressions only have expressions as children, the declaration an
+    `Inline` refers to is walked where it is declared.
+    """
+    stack: List[Node] = list(reversed(statements))
+    while stack:
+        node = stack.pop()
+        yield node
+        kinds = Expr if isinstance(node, Expr) else (Expr, Stmt)
+        children: List[Node] = []
+        for value in vars(node).values():
+            if isinstance(value, kinds):
+                children.append(value)
+            elif isinstance(value, list):
+                children.extend(item for item in value if isinstance(item, kinds))
+        stack.extend(reversed(children))
+
+
+def node_layout() -> Dict[Type[Node], Tuple[str, ...]]:
+    """
+    The fields of every kind of node, in the order `__init__` sets them,
+    read off a node built with every argument None
+    """
+    layout = {}
+    for base in (Expr, Stmt):
+        for cls in base.__subclasses__():
+            arguments = [None] * (cls.__init__.__code__.co_argcount - 1)
+            layout[cls] = tuple(vars(cls(*arguments)))
+    return layout
+
+
+# Part of the key, so a tree whose nodes have other fields than the ones an
+# entry was pickled with compiles the program again
+NODE_LAYOUT = node_layout()
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """
+    Write `data` next to `path` and move it over it, so another run never
+    reads half a file. Gives up quietly when the file can't be written.
+    """
+    try:
+        path.parent.mkdir(exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except OSError:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+
+
+def entry_name(script: Path, flags: str) -> str:
+    """The name of the files `script` keeps in the cache, without suffix"""
+    return f"{script.stem}.{flags}" if flags else script.stem
+
+
+class ProgramCache:
+    """
+    Keeps resolved programs in a `__koicache__` directory next to the
+    script, like Python does with `__pycache__`. An entry is keyed by a
+    hash of the source, the Koi version, the fields of the nodes and the
+    flags the program was compiled with, and is stored before the program
+    runs, so none of the caches the backends keep on the tree end up in it.
+    Every set of flags gets an entry of its own, so runs with different
+    flags don't keep replacing each other's.
+
+    Anything that goes wrong reading or writing an entry, or a node that
+    doesn't have the fields its class gives it now, just means the program
+    is compiled again.
+    """
+
+    def __init__(self, script: str, flags: str = "") -> None:
+        path = Path(script)
+        self.path = path.parent / CACHE_DIR / f"{entry_name(path, flags)}.koic"
+        self.flags = flags
+
+    def key(self, source: str) -> bytes:
+        digest = hashlib.sha256()
+        digest.update(f"{VERSION}\0{self.flags}\0".encode())
+        for cls, fields in NODE_LAYOUT.items():
+            digest.update(f"{cls.__name__}({','.join(fields)})\0".encode())
+        digest.update(source.encode())
+        return digest.hexdigest().encode()
+
+    def load(self, source: str) -> Optional[List[Stmt]]:
+        try:
+            with open(self.path, "rb") as f:
+                if f.readline().rstrip(b"\n") != self.key(source):
+                    return None
+                statements = pickle.load(f)
+            # Nodes pickled by a tree with other fields than this one's
+            for node in walk(statements):
+                if tuple(vars(node)) != NODE_LAYOUT[type(node)]:
+                    return None
+            return statements
+        except Exception:
+            # A broken entry, or one from an older tree, is compiled again
+            return None
+
+    def store(self, source: str, statements: List[Stmt]) -> None:
+        try:
+            data = pickle.dumps(statements, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError):
+            return
+        write_atomically(self.path, self.key(source) + b"\n" + data)
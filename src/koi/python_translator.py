@@ -0,0 +1,569 @@
+import math
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from . import runtime
+from .completion import RETURN, TAIL_CALL
+from .environment import UNDEFINED, Environment
+from .koi_function import KoiFunction
+from .koi_instance import KoiInstance
+from .std import StringInstance
+from .token_type import TokenType
+from .types import TypeVisitor
+from .expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    ExprVisitor,
+    Get,
+    Grouping,
+    Inline,
+    Literal,
+    Logical,
+    Set,
+    Super,
+    This,
+    Unary,
+    Variable,
+)
+from .stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Return,
+    Stmt,
+    StmtVisitor,
+    Var,
+    While,
+)
+
+# The Python operator for each operator a translation runs on two floats
+FLOAT_OPERATORS = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.STAR: "*",
+    TokenType.SLASH: "/",
+    TokenType.MOD: "%",
+    TokenType.GREATER: ">",
+    TokenType.GREATER_EQUAL: ">=",
+    TokenType.LESS: "<",
+    TokenType.LESS_EQUAL: "<=",
+    TokenType.EQUAL_EQUAL: "==",
+    TokenType.BANG_EQUAL: "!=",
+}
+
+Unit = Union[Function, While, For]
+
+
+class PythonTranslator(ExprVisitor, StmtVisitor, TypeVisitor):
+    """
+    Translates the body of a hot function, or a hot loop, to Python source
+    and compiles it. Locals stay in the `Environment`s the interpreter uses,
+    so a loop can switch over between two iterations and the translation
+    can be dropped at any point. Classes and `super` used as a value are
+    left to the interpreter.
+
+    Arithmetic and comparisons are translated for two floats first. When an
+    operator the interpreter quickened gets anything else, the unit is
+    deoptimized and goes back to the interpreter.
+
+    Expression visitors emit the statements that compute the value and
+    return a name or a constant that holds it, statement visitors only emit.
+    """
+
+    def __init__(self, interpreter) -> None:
+        self.interpreter = interpreter
+
+    def translate(self, unit: Unit) -> Callable:
+        """
+        A function compiled from `unit`. For a function it takes the
+        environment of the call and returns what the call does. For a loop
+        it takes the environment the loop runs in and whether it resumes
+        after the body, and returns RETURN when a `return` ended it.
+        """
+        self._start(unit)
+        if isinstance(unit, Function):
+            name = f"koi_{unit.name.lexeme}"
+            self._statements(unit.body)
+        elif isinstance(unit, While):
+            name = "koi_while"
+            self._while(unit)
+        else:
+            name = "koi_for"
+            self._loop(unit, resumable=True)
+        self._emit("return None")
+        return self._finish(name)
+
+    def _start(self, unit: Unit) -> None:
+        self.unit = unit
+        self.lines: List[str] = []
+        self.indent = 1
+        self.temps = 0
+        self.namespace: Dict[str, Any] = {
+            "interpreter": self.interpreter,
+            "unit": unit,
+            "binary": self.interpreter.binary,
+            "get_property": self.interpreter._get_property,
+            "Environment": Environment,
+            "KoiFunction": KoiFunction,
+            "KoiInstance": KoiInstance,
+            "StringInstance": StringInstance,
+            "UNDEFINED": UNDEFINED,
+            "RETURN": RETURN,
+            "TAIL_CALL": TAIL_CALL,
+            "runtime": runtime,
+        }
+        self.constants: Dict[int, str] = {}
+        # The environments opened by the translated code, innermost last,
+        # as the names of the environment and of its values
+        self.envs: List[Tuple[str, str]] = [("env", "v0")]
+        # Whether the unit's own environment is used, and how many around it
+        self.root_used = False
+        self.outer = 0
+        # Operators only reached with two floats, besides the quickened ones
+        self.floats: Dict[int, Binary] = {}
+
+    def _finish(self, name: str) -> Callable:
+        # A loop at the top level runs in the globals, which have no values
+        header = ["    v0 = env.values"] if self.root_used else []
+        parent = "env"
+        for depth in range(1, self.outer + 1):
+            header.append(f"    p{depth} = {parent}.parent")
+            header.append(f"    o{depth} = p{depth}.values")
+            parent = f"p{depth}"
+        parameters = "env, resume" if isinstance(self.unit, (While, For)) else "env"
+        source = "\n".join([f"def {name}({parameters}):", *header, *self.lines])
+        exec(compile(source, f"<koi {name}>", "exec"), self.namespace)
+        return self.namespace[name]
+
+    # Emitting code
+
+    def _emit(self, line: str) -> None:
+        self.lines.append("    " * self.indent + line)
+
+    def _temp(self) -> str:
+        self.temps += 1
+        return f"t{self.temps}"
+
+    def _constant(self, value, prefix: str = "k") -> str:
+        name = self.constants.get(id(value))
+        if name is None:
+            name = f"{prefix}{len(self.constants)}"
+            self.constants[id(value)] = name
+            self.namespace[name] = value
+        return name
+
+    def _block(self, emit: Callable[[], None]) -> None:
+        """Emit an indented block, `pass` when nothing was emitted"""
+        self.indent += 1
+        start = len(self.lines)
+        emit()
+        if len(self.lines) == start:
+            self._emit("pass")
+        self.indent -= 1
+
+    def _values(self, depth: int) -> str:
+        """The values of the environment `depth` environments out"""
+        index = len(self.envs) - 1 - depth
+        if index == 0:
+            self.root_used = True
+        if index >= 0:
+            return self.envs[index][1]
+        outer = -index
+        self.outer = max(self.outer, outer)
+        return f"o{outer}"
+
+    def _open_env(self, size: int) -> None:
+        env = f"e{len(self.envs)}"
+        values = f"v{len(self.envs)}"
+        self._emit(f"{env} = Environment({self.envs[-1][0]}, {size})")
+        self._emit(f"{values} = {env}.values")
+        self.envs.append((env, values))
+
+    def _interpret(self, node: Union[Stmt, Expr], target: Optional[str] = None):
+        """Leave `node` to the interpreter, in the current environment"""
+        saved = self._temp()
+        self._emit(f"{saved} = interpreter.env")
+        self._emit(f"interpreter.env = {self.envs[-1][0]}")
+        self._emit("try:")
+        assign = f"{target} = " if target is not None else ""
+        node_name = self._constant(node, "n")
+        self._block(lambda: self._emit(f"{assign}{node_name}.accept(interpreter)"))
+        self._emit("finally:")
+        self._block(lambda: self._emit(f"interpreter.env = {saved}"))
+
+    @staticmethod
+    def _truthy(value: str) -> str:
+        return f"{value} is not None and {value} is not False"
+
+    @staticmethod
+    def _falsy(value: str) -> str:
+        return f"{value} is None or {value} is False"
+
+    def _store(self, slot: Optional[int], name: str, value: str) -> None:
+        """Define a variable, or a global when `slot` is None"""
+        if slot is None:
+            cell = self._constant(self.interpreter.globals.cell(name), "c")
+            self._emit(f"{cell}.value = {value}")
+        else:
+            self._emit(f"{self._values(0)}[{slot}] = {value}")
+
+    # Statements
+
+    def _statements(self, statements: List[Stmt]) -> None:
+        for stmt in statements:
+            stmt.accept(self)
+
+    def visit_block_stmt(self, stmt: Block):
+        if not stmt.has_scope:
+            self._statements(stmt.statements)
+            return
+        self._open_env(stmt.size)
+        self._statements(stmt.statements)
+        self.envs.pop()
+
+    def visit_class_stmt(self, stmt: Class):
+        self._interpret(stmt)
+
+    def visit_expression_stmt(self, stmt: Expression):
+        self._expression(stmt.expression)
+
+    def visit_for_stmt(self, stmt: For):
+        if stmt.has_scope:
+            self._open_env(stmt.size)
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        self._loop(stmt, resumable=False)
+        if stmt.has_scope:
+            self.envs.pop()
+
+    def _loop(self, stmt: For, resumable: bool) -> None:
+        """
+        The loop after its initializer. A resumable loop starts after the
+        body when `resume` is true, the interpreter switches to it there.
+        """
+        if stmt.counted:
+            # The interpreter checked the counter is a float and the
+            # increment and test are plain arithmetic on it
+            self.floats[id(stmt.condition)] = stmt.condition
+            self.floats[id(stmt.increment.value)] = stmt.increment.value
+        self._emit("while True:")
+
+        def emit():
+            if resumable and stmt.increment is not None:
+                self._emit("if resume:")
+                self._block(lambda: self._expression(stmt.increment))
+                self._emit("resume = True")
+            if stmt.condition is not None:
+                condition = self._expression(stmt.condition)
+                self._emit(f"if {self._falsy(condition)}:")
+                self._block(lambda: self._emit("break"))
+            stmt.body.accept(self)
+            if not resumable and stmt.increment is not None:
+                self._expression(stmt.increment)
+
+        self._block(emit)
+
+    def visit_function_stmt(self, stmt: Function):
+        function = self._constant(stmt, "n")
+        value = self._temp()
+        self._emit(f"{value} = KoiFunction({function}, {self.envs[-1][0]}, False)")
+        self._store(stmt.slot, stmt.name.lexeme, value)
+
+    def _branch(self, stmt: Stmt, cold: bool) -> None:
+        """
+        Translate a branch, or leave it to the interpreter when the profile
+        never took it, passing on a `return` it runs
+        """
+        if not cold:
+            stmt.accept(self)
+            return
+        completion = self._temp()
+        self._interpret(stmt, completion)
+        self._emit(f"if {completion} is RETURN:")
+        if isinstance(self.unit, Function):
+            self._block(lambda: self._emit("return interpreter.return_value"))
+        else:
+            self._block(lambda: self._emit("return RETURN"))
+
+    def visit_if_stmt(self, stmt: If):
+        condition = self._expression(stmt.condition)
+        self._emit(f"if {self._truthy(condition)}:")
+        self._block(lambda: self._branch(stmt.then_branch, stmt.then_cold))
+        if stmt.else_branch is not None:
+            self._emit("else:")
+            self._block(lambda: self._branch(stmt.else_branch, stmt.else_cold))
+
+    def visit_return_stmt(self, stmt: Return):
+        value = "None"
+        if stmt.value is not None:
+            value = self._expression(stmt.value)
+        if isinstance(self.unit, Function):
+            self._emit(f"return {value}")
+        else:
+            self._emit(f"interpreter.return_value = {value}")
+            self._emit("return RETURN")
+
+    def visit_var_stmt(self, stmt: Var):
+        value = "None"
+        if stmt.initializer is not None:
+            value = self._expression(stmt.initializer)
+        self._store(stmt.slot, stmt.name.lexeme, value)
+
+    def visit_while_stmt(self, stmt: While):
+        self._while(stmt)
+
+    def _while(self, stmt: While) -> None:
+        self._emit("while True:")
+
+        def emit():
+            condition = self._expression(stmt.condition)
+            self._emit(f"if {self._falsy(condition)}:")
+            self._block(lambda: self._emit("break"))
+            self._branch(stmt.body, stmt.body_cold)
+
+        self._block(emit)
+
+    # Expressions
+
+    def _expression(self, expr: Expr) -> str:
+        return expr.accept(self)
+
+    def visit_inline_expr(self, expr: Inline):
+        fn = self._expression(expr.call.callee)
+        function = self._constant(expr.function, "n")
+        value = self._temp()
+        self._emit(f"if type({fn}) is KoiFunction and {fn}.decl is {function}:")
+        self._block(lambda: self._emit(f"{value} = {self._expression(expr.body)}"))
+        self._emit("else:")
+        self._block(lambda: self._emit(f"{value} = {self._expression(expr.call)}"))
+        return value
+
+    def visit_literal_expr(self, expr: Literal):
+        value = expr.value
+        if value is None or type(value) is bool or type(value) is str:
+            return repr(value)
+        if type(value) is float and math.isfinite(value):
+            return repr(value)
+        return self._constant(value)
+
+    def visit_string_type(self, string: str):
+        value = self._temp()
+        self._emit(f"{value} = StringInstance({string!r})")
+        return value
+
+    def visit_grouping_expr(self, expr: Grouping):
+        return self._expression(expr.expression)
+
+    def visit_unary_expr(self, expr: Unary):
+        right = self._expression(expr.right)
+        value = self._temp()
+        if expr.operator.tok_type == TokenType.MINUS:
+            node = self._constant(expr, "n")
+            self._emit(
+                f"{value} = -int({right}) if type({right}) is float "
+                f"else runtime.negate({node}, {right})"
+            )
+        elif expr.operator.tok_type == TokenType.BANG:
+            self._emit(f"{value} = {self._falsy(right)}")
+        else:
+            self._emit(f"{value} = None")
+        return value
+
+    def visit_binary_expr(self, expr: Binary):
+        left = self._expression(expr.left)
+        right = self._expression(expr.right)
+        value = self._temp()
+        node = self._constant(expr, "n")
+        operator = FLOAT_OPERATORS.get(expr.operator.tok_type)
+        if operator is None:
+            self._emit(f"{value} = binary({node}.operator, {left}, {right})")
+            return value
+
+        guard = f"type({left}) is type({right}) is float"
+        if expr.operator.tok_type in (TokenType.SLASH, TokenType.MOD):
+            # Dividing by zero is an error the interpreter reports
+            guard += f" and {right}"
+        self._emit(f"if {guard}:")
+        self._block(lambda: self._emit(f"{value} = {left} {operator} {right}"))
+        self._emit("else:")
+        if expr.float_op is not None or id(expr) in self.floats:
+            fallback = (
+                f"runtime.speculation_failed("
+                f"interpreter, unit, {node}, {left}, {right})"
+            )
+        else:
+            fallback = f"binary({node}.operator, {left}, {right})"
+        self._block(lambda: self._emit(f"{value} = {fallback}"))
+        return value
+
+    def visit_logical_expr(self, expr: Logical):
+        left = self._expression(expr.left)
+        value = self._temp()
+        if expr.operator.tok_type == TokenType.OR:
+            self._emit(f"if {self._truthy(left)}:")
+        else:
+            self._emit(f"if {self._falsy(left)}:")
+        self._block(lambda: self._emit(f"{value} = {left}"))
+        self._emit("else:")
+
+        def emit():
+            right = self._expression(expr.right)
+            self._emit(f"{value} = {right}")
+
+        self._block(emit)
+        return value
+
+    def _lookup(self, expr: Union[Variable, This], name: str) -> str:
+        value = self._temp()
+        if expr.depth is not None:
+            self._emit(f"{value} = {self._values(expr.depth)}[{expr.slot}]")
+            return value
+        cell = self._constant(self.interpreter.globals.cell(name), "c")
+        self._emit(f"{value} = {cell}.value")
+        self._emit(f"if {value} is UNDEFINED:")
+        node = self._constant(expr, "n")
+        self._block(lambda: self._emit(f"runtime.undefined({node})"))
+        return value
+
+    def visit_variable_expr(self, expr: Variable):
+        return self._lookup(expr, expr.name.lexeme)
+
+    def visit_this_expr(self, expr: This):
+        return self._lookup(expr, expr.keyword.lexeme)
+
+    def visit_assign_expr(self, expr: Assign):
+        value = self._expression(expr.value)
+        if expr.depth is not None:
+            self._emit(f"{self._values(expr.depth)}[{expr.slot}] = {value}")
+            return value
+        cell = self._constant(self.interpreter.globals.cell(expr.name.lexeme), "c")
+        self._emit(f"if {cell}.value is UNDEFINED:")
+        node = self._constant(expr, "n")
+        self._block(lambda: self._emit(f"runtime.undeclared({node})"))
+        self._emit(f"{cell}.value = {value}")
+        return value
+
+    def visit_get_expr(self, expr: Get):
+        obj = self._expression(expr.obj)
+        node = self._constant(expr, "n")
+        value = self._temp()
+        self._emit(
+            f"if type({obj}) is KoiInstance and {obj}.shape is {node}.cached_shape "
+            f"and {node}.cached_index is not None:"
+        )
+        self._block(lambda: self._emit(f"{value} = {obj}.values[{node}.cached_index]"))
+        self._emit("else:")
+        self._block(lambda: self._emit(f"{value} = get_property({node}, {obj})"))
+        return value
+
+    def visit_set_expr(self, expr: Set):
+        obj = self._expression(expr.obj)
+        node = self._constant(expr, "n")
+        self._emit(f"if not isinstance({obj}, KoiInstance):")
+        self._block(lambda: self._emit(f"runtime.not_an_instance({node})"))
+        value = self._expression(expr.value)
+        self._emit(
+            f"if type({obj}) is KoiInstance and {obj}.shape is {node}.cached_shape "
+            f"and {node}.cached_index is not None:"
+        )
+        self._block(lambda: self._emit(f"{obj}.values[{node}.cached_index] = {value}"))
+        self._emit("else:")
+        self._block(
+            lambda: self._emit(
+                f"runtime.set_property(interpreter, {node}, {obj}, {value})"
+            )
+        )
+        return value
+
+    def visit_super_expr(self, expr: Super):
+        value = self._temp()
+        self._interpret(expr, value)
+        return value
+
+    def visit_call_expr(self, expr: Call):
+        node = self._constant(expr, "n")
+        value = self._temp()
+        callee = expr.callee
+        if isinstance(callee, (Get, Super)):
+            method = self._temp()
+            this = self._temp()
+            if isinstance(callee, Get):
+                obj = self._expression(callee.obj)
+                self._emit(
+                    f"if type({obj}) is KoiInstance "
+                    f"and {obj}.shape is {node}.cached_shape:"
+                )
+                self._block(
+                    lambda: self._emit(
+                        f"{method}, {this} = {node}.cached_method, {obj}"
+                    )
+                )
+                self._emit("else:")
+                self._block(
+                    lambda: self._emit(
+                        f"{method}, {this} = "
+                        f"runtime.find_method(interpreter, {node}, {obj})"
+                    )
+                )
+            else:
+                superclass = f"{self._values(callee.depth)}[{callee.slot}]"
+                self._emit(f"{this} = {self._values(callee.depth - 1)}[0]")
+                self._emit(
+                    f"{method} = runtime.super_method({node}.callee, {superclass})"
+                )
+            args = self._arguments(expr)
+            if expr.tail:
+                self._emit(
+                    f"{value} = runtime.tail_invoke("
+                    f"interpreter, {node}, {method}, {this}, {args})"
+                )
+                return value
+            self._emit(
+                f"if {this} is not None and "
+                f"len({method}.decl.params) == {len(expr.arguments)}:"
+            )
+            self._block(
+                lambda: self._emit(
+                    f"{value} = {method}.invoke(interpreter, {this}, {args})"
+                )
+            )
+            self._emit("else:")
+            self._block(
+                lambda: self._emit(
+                    f"{value} = runtime.invoke("
+                    f"interpreter, {node}, {method}, {this}, {args})"
+                )
+            )
+            return value
+
+        fn = self._expression(callee)
+        args = self._arguments(expr)
+        if expr.tail:
+            self._emit(
+                f"{value} = runtime.tail_call(interpreter, {node}, {fn}, {args})"
+            )
+            return value
+        self._emit(
+            f"if type({fn}) is KoiFunction "
+            f"and len({fn}.decl.params) == {len(expr.arguments)}:"
+        )
+        self._block(
+            lambda: self._emit(f"{value} = {fn}.invoke(interpreter, {fn}.this, {args})")
+        )
+        self._emit("else:")
+        self._block(
+            lambda: self._emit(
+                f"{value} = runtime.call(interpreter, {node}, {fn}, {args})"
+            )
+        )
+        return value
+
+    def _arguments(self, expr: Call) -> str:
+        args = [self._expression(arg) for arg in expr.arguments]
+        value = self._temp()
+        self._emit(f"{value} = [{', '.join(args)}]")
+        return value
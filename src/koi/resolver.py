@@ -1,9 +1,9 @@
 from collections import deque
-from typing import Deque, Dict
+from typing import Deque, Dict, List, Optional, Set as SetType, Tuple
 
-from .types import StringType
+from typing_extensions import Self
 
-from .interpreter import Interpreter
+from .types import StringType
 
 from .tokens import Token
 from .expr import (
@@ -14,6 +14,7 @@ from .expr import (
     ExprVisitor,
     Get,
     Grouping,
+    Inline,
     Literal,
     Logical,
     Set,
@@ -25,6 +26,7 @@ from .expr import (
 from .stmt import (
     Block,
     Class,
+    For,
     Function,
     If,
     Return,
@@ -34,26 +36,149 @@ from .stmt import (
     Var,
     While,
 )
+from .token_type import TokenType
 from .function_type import FunctionType
 from .class_type import ClassType
 
+# The comparisons a counted `for` loop can test its counter with
+COUNTED_COMPARISONS = (
+    TokenType.LESS,
+    TokenType.LESS_EQUAL,
+    TokenType.GREATER,
+    TokenType.GREATER_EQUAL,
+)
+
+
+class Scope:
+    """
+    The names declared in a local scope. A scope that needs an Environment
+    of its own at runtime is a frame. Blocks whose names are never captured
+    by a closure don't, their names get slots in the frame around them.
+    """
+
+    def __init__(self, parent: Optional[Self], is_block: bool) -> None:
+        self.parent = parent
+        self.is_block = is_block
+        self.defined: Dict[str, bool] = {}
+        # The index of every name among the names of this scope
+        self.names: Dict[str, int] = {}
+        # The declarations of the names that are constants
+        self.constants: Dict[str, Var] = {}
+        self.captured = False
+        # Worked out once the program is resolved: the frame scope the names
+        # live in, where they start in it, and the size of a frame
+        self.frame: Optional[Self] = None
+        self.offset = 0
+        self.size = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def declare(self, name: str) -> None:
+        self.defined[name] = False
+        if name not in self.names:
+            self.names[name] = len(self.names)
+
+    def define(self, name: str) -> None:
+        self.defined[name] = True
+
+    def slot(self, name: str) -> int:
+        return self.offset + self.names[name]
+
+    def allocate(self) -> None:
+        """Pick the frame this scope lives in and give its names slots"""
+        parent_frame = self.parent.frame if self.parent is not None else None
+        # A block at the top level has no frame around it to live in
+        hosted = self.is_block and not self.captured
+        if hosted and (parent_frame is not None or not self.names):
+            self.frame = parent_frame
+        else:
+            self.frame = self
+        if self.frame is not None:
+            self.offset = self.frame.size
+            self.frame.size += len(self.names)
+
+    @property
+    def has_frame(self) -> bool:
+        return self.frame is self
+
 
 class Resolver(ExprVisitor, StmtVisitor):
-    def __init__(self, interpreter: Interpreter, on_error=None) -> None:
-        self.interpreter = interpreter
-        self.scopes: Deque[Dict] = deque()
+    """
+    Works out where every local lives: `depth` is the number of frames
+    between the use and the declaration, and `slot` is the index of the
+    variable within that frame. Both are stored on the node itself.
+
+    Slots are only handed out once a whole program has been seen, since a
+    block can only share the frame around it when none of its names are
+    captured by a closure, and the closure can come after the declaration.
+
+    Constants can't be assigned to or declared again. A global one can be
+    assigned to before its declaration, so assignments to globals are
+    checked once the whole program has been seen. `constants` are the
+    names of the global constants, kept between the programs of a repl.
+    """
+
+    def __init__(self, on_error=None, constants: Optional[SetType[str]] = None) -> None:
+        self.scopes: Deque[Scope] = deque()
         self.on_error = on_error
         self.current_function = FunctionType.NONE
         self.current_class = ClassType.NONE
+        # Every scope in the order it was opened, and the nodes waiting for
+        # the slots of their scope
+        self._opened: List[Scope] = []
+        self._declarations: List[Tuple[Stmt, Scope, str]] = []
+        self._references: List[Tuple[Expr, Scope, Scope, str]] = []
+        self._blocks: List[Tuple[Block, Scope]] = []
+        self._functions: List[Tuple[Function, Scope]] = []
+        self.constants: SetType[str] = set() if constants is None else constants
+        # The global constants declared so far in this program, and the
+        # globals assigned to
+        self._global_constants: Dict[str, Var] = {}
+        self._assigned: List[Token] = []
 
     def visit_block_stmt(self, stmt: Block):
-        self._begin_scope()
-        self.resolve(stmt.statements)
-        self._end_scope()
+        self._begin_scope(is_block=True)
+        self._resolve_stmts(stmt.statements)
+        self._blocks.append((stmt, self._end_scope()))
         return None
 
     def resolve(self, stmts):
         self._resolve_stmts(stmts)
+        self._check_assignments()
+        self._allocate()
+
+    def _check_assignments(self):
+        for name in self._assigned:
+            if name.lexeme in self.constants:
+                self.on_error(name, f"Cannot assign to constant {name.lexeme!r}")
+        self._assigned.clear()
+
+    def _allocate(self):
+        """Give every local its slot now that all the captures are known"""
+        for scope in self._opened:
+            scope.allocate()
+        for stmt, scope, name in self._declarations:
+            stmt.slot = scope.slot(name)
+        for expr, used_in, scope, name in self._references:
+            frame = used_in.frame
+            depth = 0
+            while frame is not scope.frame:
+                frame = frame.parent.frame
+                depth += 1
+            expr.depth = depth
+            expr.slot = scope.slot(name)
+        for block, scope in self._blocks:
+            block.has_scope = scope.has_frame
+            block.size = scope.size
+        for function, scope in self._functions:
+            function.size = scope.size
+
+        self._opened.clear()
+        self._declarations.clear()
+        self._references.clear()
+        self._blocks.clear()
+        self._functions.clear()
 
     def _resolve_stmts(self, stmts):
         if not isinstance(stmts, list):
@@ -67,65 +192,128 @@ class Resolver(ExprVisitor, StmtVisitor):
     def _resolve_expression(self, expr: Expression):
         return expr.accept(self)
 
-    def _resolve_local(self, expr: Expr, name: Token):
-        for idx, scope in enumerate(reversed(self.scopes)):
+    def _resolve_local(self, expr: Expr, name: Token) -> Optional[Scope]:
+        """The scope `name` is declared in, None for a global"""
+        crossed_function = False
+        for scope in reversed(self.scopes):
             if name.lexeme in scope:
-                self.interpreter.resolve(expr, idx)
-                return
+                # Used from inside a function nested in the scope
+                if crossed_function:
+                    scope.captured = True
+                self._references.append((expr, self.scopes[-1], scope, name.lexeme))
+                return scope
+            if not scope.is_block:
+                crossed_function = True
         # Not found, assume it's global
+        return None
 
-    def _begin_scope(self):
-        self.scopes.append({})
+    def _begin_scope(self, is_block: bool = False):
+        parent = self.scopes[-1] if self.scopes else None
+        scope = Scope(parent, is_block)
+        self.scopes.append(scope)
+        self._opened.append(scope)
 
-    def _end_scope(self):
-        self.scopes.pop()
+    def _end_scope(self) -> Scope:
+        return self.scopes.pop()
 
     def visit_var_stmt(self, stmt: Var):
-        self._declare(stmt.name)
+        self._declare(stmt.name, stmt)
         if stmt.initializer is not None:
             self._resolve_expression(stmt.initializer)
         self._define(stmt.name)
+        if stmt.const:
+            # Only reads after the declaration know the constant, a global
+            # is always defined by then
+            if len(self.scopes) == 0:
+                self.constants.add(stmt.name.lexeme)
+                self._global_constants[stmt.name.lexeme] = stmt
+            else:
+                self.scopes[-1].constants[stmt.name.lexeme] = stmt
         return None
 
-    def _declare(self, name: Token):
+    def _declare(self, name: Token, stmt: Optional[Stmt] = None):
+        """Declare `name`, `stmt` gets its slot, or None for a global"""
         if len(self.scopes) == 0:
+            if name.lexeme in self.constants:
+                self.on_error(name, f"Cannot redeclare constant {name.lexeme!r}")
+            if stmt is not None:
+                stmt.slot = None
             return
         scope = self.scopes[-1]
         if name.lexeme in scope:
             self.on_error(
                 name, f"Variabled with name {name} already exists in this scope"
             )
-        scope[name.lexeme] = False
+        scope.declare(name.lexeme)
+        if stmt is not None:
+            self._declarations.append((stmt, scope, name.lexeme))
 
     def _define(self, name: Token):
         if len(self.scopes) == 0:
             return
-        scope = self.scopes[-1]
-        scope[name.lexeme] = True
+        self.scopes[-1].define(name.lexeme)
+
+    def resolve_body(self, function: Function):
+        """
+        Resolve a function whose body was parsed after the rest of the
+        program, in the class it was declared in
+        """
+        lazy = function.lazy
+        self.current_class = lazy.class_type
+        self.constants = lazy.constants
+        if lazy.class_type == ClassType.SUBCLASS:
+            self._begin_scope()
+            self.scopes[-1].declare("super")
+            self.scopes[-1].define("super")
+        self._resolve_function(function, lazy.function_type)
+        if lazy.class_type == ClassType.SUBCLASS:
+            self._end_scope()
+        self._check_assignments()
+        self._allocate()
 
     def _resolve_function(self, function: Function, type: FunctionType):
+        if function.body is None:
+            # Not parsed yet, `resolve_body` does it once it is
+            function.lazy.function_type = type
+            function.lazy.class_type = self.current_class
+            function.lazy.constants = self.constants
+            return
         enclosing: FunctionType = self.current_function
         self.current_function = type
 
         self._begin_scope()
+        if type in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            # Methods get the receiver in their first slot
+            self.scopes[-1].declare("this")
+            self.scopes[-1].define("this")
         for param in function.params:
             self._declare(param)
             self._define(param)
         self._resolve_stmts(function.body)
-        self._end_scope()
+        self._functions.append((function, self._end_scope()))
         self.current_function = enclosing
 
     def visit_variable_expr(self, expr: Variable):
-        if (len(self.scopes) != 0) and self.scopes[-1].get(expr.name.lexeme) is False:
+        if (len(self.scopes) != 0) and self.scopes[-1].defined.get(
+            expr.name.lexeme
+        ) is False:
             self.on_error(expr.name, "Cannot read variable in it's own initializer")
-        self._resolve_local(expr, expr.name)
+        scope = self._resolve_local(expr, expr.name)
+        if scope is None:
+            expr.constant = self._global_constants.get(expr.name.lexeme)
+        else:
+            expr.constant = scope.constants.get(expr.name.lexeme)
 
     def visit_assign_expr(self, expr: Assign):
         self._resolve_expression(expr.value)
-        self._resolve_local(expr, expr.name)
+        scope = self._resolve_local(expr, expr.name)
+        if scope is None:
+            self._assigned.append(expr.name)
+        elif expr.name.lexeme in scope.constants:
+            self.on_error(expr.name, f"Cannot assign to constant {expr.name.lexeme!r}")
 
     def visit_function_stmt(self, stmt: Function):
-        self._declare(stmt.name)
+        self._declare(stmt.name, stmt)
         self._define(stmt.name)
 
         self._resolve_function(stmt, FunctionType.FUNCTION)
@@ -137,7 +325,7 @@ class Resolver(ExprVisitor, StmtVisitor):
         self._resolve_expression(stmt.condition)
         self._resolve_stmt(stmt.then_branch)
         if stmt.else_branch:
-            self.resolve(stmt.else_branch)
+            self._resolve_stmt(stmt.else_branch)
 
     def visit_return_stmt(self, stmt: Return):
         if self.current_function == FunctionType.NONE:
@@ -146,6 +334,77 @@ class Resolver(ExprVisitor, StmtVisitor):
             if self.current_function == FunctionType.INITIALIZER:
                 self.on_error(stmt.keyword, "Cannot return a value from an initializer")
             self._resolve_expression(stmt.value)
+            if isinstance(stmt.value, Call):
+                stmt.value.tail = True
+
+    def visit_for_stmt(self, stmt: For):
+        self._begin_scope(is_block=True)
+        if stmt.initializer is not None:
+            self._resolve_stmt(stmt.initializer)
+        if stmt.condition is not None:
+            self._resolve_expression(stmt.condition)
+        if stmt.increment is not None:
+            self._resolve_expression(stmt.increment)
+        body_start = len(self._references)
+        self._resolve_stmt(stmt.body)
+        scope = self._end_scope()
+
+        counter = self._counter(stmt)
+        if counter is not None:
+            stmt.counted = True
+            stmt.observed = False
+            for expr, _, declared_in, name in self._references[body_start:]:
+                if declared_in is scope and name == counter:
+                    if isinstance(expr, Assign):
+                        stmt.counted = False
+                    stmt.observed = True
+        self._blocks.append((stmt, scope))
+
+    @staticmethod
+    def _counter(stmt: For) -> Optional[str]:
+        """
+        The name of the counter when `stmt` looks like
+        `for (var i = start; i < limit; i = i + step)`, where the limit is
+        a number or a variable and the step a number. Any comparison works
+        and the step can be subtracted instead.
+        """
+        initializer = stmt.initializer
+        if not isinstance(initializer, Var) or initializer.initializer is None:
+            return None
+        name = initializer.name.lexeme
+
+        def is_counter(expr: Expr) -> bool:
+            return isinstance(expr, Variable) and expr.name.lexeme == name
+
+        def is_number(expr: Expr) -> bool:
+            return isinstance(expr, Literal) and type(expr.value) is float
+
+        condition = stmt.condition
+        if not (
+            isinstance(condition, Binary)
+            and condition.operator.tok_type in COUNTED_COMPARISONS
+            and is_counter(condition.left)
+            and (
+                is_number(condition.right)
+                or (
+                    isinstance(condition.right, Variable)
+                    and not is_counter(condition.right)
+                )
+            )
+        ):
+            return None
+
+        increment = stmt.increment
+        if not (
+            isinstance(increment, Assign)
+            and increment.name.lexeme == name
+            and isinstance(increment.value, Binary)
+            and increment.value.operator.tok_type in (TokenType.PLUS, TokenType.MINUS)
+            and is_counter(increment.value.left)
+            and is_number(increment.value.right)
+        ):
+            return None
+        return name
 
     def visit_while_stmt(self, stmt: While):
         self._resolve_expression(stmt.condition)
@@ -163,6 +422,10 @@ class Resolver(ExprVisitor, StmtVisitor):
     def visit_grouping_expr(self, expr: Grouping):
         self._resolve_expression(expr.expression)
 
+    def visit_inline_expr(self, expr: Inline):
+        # Only made by the optimizer, from calls that are resolved already
+        self._resolve_expression(expr.call)
+
     def visit_literal_expr(self, expr: Literal):
         return None
 
@@ -200,7 +463,7 @@ class Resolver(ExprVisitor, StmtVisitor):
         enclosing_class = self.current_class
         self.current_class = ClassType.CLASS
 
-        self._declare(stmt.name)
+        self._declare(stmt.name, stmt)
         self._define(stmt.name)
 
         if stmt.superclass is not None:
@@ -211,10 +474,8 @@ class Resolver(ExprVisitor, StmtVisitor):
 
         if stmt.superclass is not None:
             self._begin_scope()
-            self.scopes[-1]["super"] = True
-
-        self._begin_scope()
-        self.scopes[-1]["this"] = True
+            self.scopes[-1].declare("super")
+            self.scopes[-1].define("super")
 
         for method in stmt.methods:
             decl = FunctionType.METHOD
@@ -222,7 +483,6 @@ class Resolver(ExprVisitor, StmtVisitor):
                 decl = FunctionType.INITIALIZER
             self._resolve_function(method, decl)
 
-        self._end_scope()
         if stmt.superclass is not None:
             self._end_scope()
 
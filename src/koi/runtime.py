@@ -0,0 +1,123 @@
+"""
+What Python code translated from Koi calls when a value isn't the one the
+translation expected. Every helper does exactly what the `Interpreter` does
+for the same node, errors included.
+"""
+
+from typing import List
+
+from .completion import TAIL_CALL
+from .koi_callable import KoiCallable
+from .koi_function import KoiFunction
+from .koi_instance import KoiInstance
+from .koi_runtime_error import KoiRuntimeError
+from .expr import Assign, Binary, Call, Set, Super, Unary, Variable
+
+
+def negate(expr: Unary, value):
+    if isinstance(value, (int, float)):
+        return -int(value)
+    raise KoiRuntimeError(expr.operator, f"Operand {value} must be a number")
+
+
+def undefined(expr: Variable):
+    raise KoiRuntimeError(expr.name, f"Undefined name {expr.name.lexeme!r}")
+
+
+def undeclared(expr: Assign):
+    raise KoiRuntimeError(
+        expr.name,
+        f"Cannot assign to variable {expr.name.lexeme!r} before it was declared.",
+    )
+
+
+def not_an_instance(expr: Set):
+    raise KoiRuntimeError(expr.name, "Must be an instance to have fields")
+
+
+def set_property(interpreter, expr: Set, obj, value):
+    if type(obj) is KoiInstance:
+        interpreter._set_field(expr, obj, value)
+    else:
+        obj.set(expr.name, value)
+
+
+def find_method(interpreter, expr: Call, obj):
+    """
+    What `obj.name(...)` calls: a method and the receiver to call it with,
+    or a value to call on its own and None
+    """
+    if type(obj) is KoiInstance:
+        if expr.cached_shape is obj.shape:
+            return expr.cached_method, obj
+        name = expr.callee.name
+        if name.lexeme not in obj.shape.slots:
+            method = obj.klass.find_method(name.lexeme)
+            if method is None:
+                raise KoiRuntimeError(name, f"Undefined property {name.lexeme!r}")
+            expr.cached_shape = obj.shape
+            expr.cached_method = method
+            return method, obj
+    return interpreter._get_property(expr.callee, obj), None
+
+
+def super_method(expr: Super, superclass):
+    method = superclass.find_method(expr.method.lexeme)
+    if method is None:
+        raise KoiRuntimeError(expr.method, f"Undefined property {expr.method.lexeme!r}")
+    return method
+
+
+def call(interpreter, expr: Call, fn, args: List):
+    if not isinstance(fn, KoiCallable):
+        raise KoiRuntimeError(expr.paren, "Can only call functions and classes")
+    if len(args) != fn.arity():
+        raise KoiRuntimeError(
+            expr.paren, f"Expected {fn.arity()} arguments but got {len(args)}"
+        )
+    return fn.call(interpreter, args)
+
+
+def tail_call(interpreter, expr: Call, fn, args: List):
+    """Like `call`, but a Koi function is left to the caller to call"""
+    if type(fn) is not KoiFunction:
+        return call(interpreter, expr, fn, args)
+    if len(args) != fn.arity():
+        raise KoiRuntimeError(
+            expr.paren, f"Expected {fn.arity()} arguments but got {len(args)}"
+        )
+    interpreter.tail_call = (fn, fn.this, args)
+    return TAIL_CALL
+
+
+def invoke(interpreter, expr: Call, method, this, args: List):
+    """Call what `find_method` found"""
+    if this is None:
+        return call(interpreter, expr, method, args)
+    if len(args) != method.arity():
+        raise KoiRuntimeError(
+            expr.paren, f"Expected {method.arity()} arguments but got {len(args)}"
+        )
+    return method.invoke(interpreter, this, args)
+
+
+def tail_invoke(interpreter, expr: Call, method, this, args: List):
+    if this is None:
+        return tail_call(interpreter, expr, method, args)
+    if len(args) != method.arity():
+        raise KoiRuntimeError(
+            expr.paren, f"Expected {method.arity()} arguments but got {len(args)}"
+        )
+    if type(method) is not KoiFunction:
+        return method.invoke(interpreter, this, args)
+    interpreter.tail_call = (method, this, args)
+    return TAIL_CALL
+
+
+def speculation_failed(interpreter, unit, expr: Binary, left, right):
+    """
+    An operator translated for two floats got something else. The unit goes
+    back to the interpreter from its next run on, this run goes on here.
+    """
+    interpreter.deoptimize(unit)
+    return interpreter.binary(expr.operator, left, right)
@@ -26,6 +26,7 @@ class Scanner:
         "super": TokenType.SUPER,
         "this": TokenType.THIS,
         "var": TokenType.VAR,
+        "const": TokenType.CONST,
     }
 
     def __init__(self, source: str, on_error=None) -> None:
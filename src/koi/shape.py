@@ -0,0 +1,29 @@
+from typing import Dict, Optional
+
+from typing_extensions import Self
+
+
+class Shape:
+    """
+    The field layout shared by instances that added the same fields in the
+    same order. `slots` maps every field name to its index in the instance's
+    `values` list. Adding a field moves the instance to the next shape, and
+    that transition is cached so every instance takes the same path.
+    """
+
+    __slots__ = ("slots", "transitions")
+
+    def __init__(self, slots: Optional[Dict[str, int]] = None) -> None:
+        self.slots: Dict[str, int] = {} if slots is None else slots
+        self.transitions: Dict[str, Self] = {}
+
+    def add_field(self, name: str) -> Self:
+        shape = self.transitions.get(name)
+        if shape is None:
+            slots = dict(self.slots)
+            slots[name] = len(slots)
+            shape = self.transitions[name] = Shape(slots)
+        return shape
+
+    def __repr__(self) -> str:
+        return f"<shape {list(self.slots)!r}>"
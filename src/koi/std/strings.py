@@ -7,9 +7,12 @@ from ..tokens import Token
 from .numerable import is_numerable
 
 
+STRING_CLASS = KoiClass("String", None, {})
+
+
 class StringInstance(KoiInstance):
     def __init__(self, elements: str) -> None:
-        super().__init__(KoiClass("String", None, {}))
+        super().__init__(STRING_CLASS)
         self.elements = list(str(elements))
         self.value = elements
 
@@ -4,7 +4,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from .expr import Expr, Variable
 from .tokens import Token
@@ -25,6 +25,10 @@ class StmtVisitor(ABC):
     def visit_expression_stmt(self, stmt: Expression):
         raise NotImplementedError
 
+    @abstractmethod
+    def visit_for_stmt(self, stmt: For):
+        raise NotImplementedError
+
     @abstractmethod
     def visit_function_stmt(self, stmt: Function):
         raise NotImplementedError
@@ -55,6 +59,10 @@ class Stmt(ABC):
 class Block(Stmt):
     def __init__(self, statements: List[Stmt]):
         self.statements = statements
+        # Set by the resolver, `has_scope` is False when the block runs in
+        # the scope around it and `size` is the number of locals otherwise
+        self.has_scope = True
+        self.size = 0
 
     def accept(self, visitor: StmtVisitor):
         """Create an accept method that calls the visitor"""
@@ -71,6 +79,11 @@ class Class(Stmt):
         self.name = name
         self.superclass = superclass
         self.methods = methods
+        # Set by the resolver, None when the class is a global
+        self.slot: Optional[int] = None
+        # From profile feedback, the sites that saw instances of the class
+        # and the fields they had, their caches are filled once it exists
+        self.receivers: List[Tuple[Expr, Tuple[str, ...]]] = []
 
     def accept(self, visitor: StmtVisitor):
         """Create an accept method that calls the visitor"""
@@ -86,11 +99,53 @@ class Expression(Stmt):
         return visitor.visit_expression_stmt(self)
 
 
+class For(Stmt):
+    def __init__(
+        self,
+        initializer: Optional[Stmt],
+        condition: Optional[Expr],
+        increment: Optional[Expr],
+        body: Stmt,
+    ):
+        self.initializer = initializer
+        self.condition = condition
+        self.increment = increment
+        self.body = body
+        # Set by the resolver, the initializer has a scope of its own like
+        # a block. `counted` is True for `for (var i = a; i < b; i = i + c)`
+        # loops, `observed` when the body uses the counter.
+        self.has_scope = True
+        self.size = 0
+        self.counted = False
+        self.observed = True
+        # Kept by the interpreter: iterations run so far, the loop compiled
+        # to Python once it is hot, and how many times that was given up
+        self.back_edges = 0
+        self.compiled = None
+        self.deopts = 0
+
+    def accept(self, visitor: StmtVisitor):
+        """Create an accept method that calls the visitor"""
+        return visitor.visit_for_stmt(self)
+
+
 class Function(Stmt):
     def __init__(self, name: Token, params: List[Token], body: List[Stmt]):
         self.name = name
         self.params = params
         self.body = body
+        # Set by the resolver, `slot` is None when the function is a global
+        # and `size` is the number of locals, parameters included
+        self.slot: Optional[int] = None
+        self.size = 0
+        # Set by a lazy parser, which leaves `body` None until the function
+        # is first called
+        self.lazy = None
+        # Kept by the interpreter: calls made so far, the body compiled to
+        # Python once it is hot, and how many times that was given up
+        self.calls = 0
+        self.compiled = None
+        self.deopts = 0
 
     def accept(self, visitor: StmtVisitor):
         """Create an accept method that calls the visitor"""
@@ -102,6 +157,10 @@ class If(Stmt):
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
+        # From profile feedback, a branch that was never taken stays in the
+        # interpreter when the code around it is compiled to Python
+        self.then_cold = False
+        self.else_cold = False
 
     def accept(self, visitor: StmtVisitor):
         """Create an accept method that calls the visitor"""
@@ -122,6 +181,10 @@ class Var(Stmt):
     def __init__(self, name: Token, initializer: Optional[Expr]):
         self.name = name
         self.initializer = initializer
+        # Set by the resolver, None when the variable is a global
+        self.slot: Optional[int] = None
+        # Declared with `const`, the resolver rejects assigning to it
+        self.const = False
 
     def accept(self, visitor: StmtVisitor):
         """Create an accept method that calls the visitor"""
@@ -132,6 +195,12 @@ class While(Stmt):
     def __init__(self, condition: Expr, body: Stmt):
         self.condition = condition
         self.body = body
+        # Kept by the interpreter, like on `For`
+        self.back_edges = 0
+        self.compiled = None
+        self.deopts = 0
+        # From profile feedback, like on `If`
+        self.body_cold = False
 
     def accept(self, visitor: StmtVisitor):
         """Create an accept method that calls the visitor"""
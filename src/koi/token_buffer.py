@@ -0,0 +1,89 @@
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .tokens import Token
+from .token_type import TokenType
+
+TOKEN_TYPES = {token_type.value: token_type for token_type in TokenType}
+
+
+class TokenBuffer:
+    """
+    Tokens stored as parallel arrays: the type, the lexeme and the line of
+    every token. Lexemes are kept once in `lexemes` and the array holds
+    their index, identifiers are interned on the way in. `Token` objects
+    are only made by `token`, when something needs one.
+
+    The buffer fills itself from `source`, an iterator of
+    `(TokenType, lexeme, line)`, one token at a time with `pull`.
+    """
+
+    def __init__(self, source: Iterable[Tuple[TokenType, str, int]]) -> None:
+        self.source = iter(source)
+        self.types = array("H")
+        self.lexeme_ids = array("I")
+        self.lines = array("I")
+        self.lexemes: List[str] = []
+        self._lexeme_ids: Dict[str, int] = {}
+        # `Parser.previous` asks for the same token more than once
+        self._last: Optional[Token] = None
+        self._last_index = -1
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[Token]) -> "TokenBuffer":
+        return cls((token.tok_type, token.lexeme, token.line) for token in tokens)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __iter__(self) -> Iterator[Token]:
+        index = 0
+        while index < len(self.types) or self.pull():
+            yield self.token(index)
+            index += 1
+
+    def __getstate__(self):
+        # Only a buffer the parser is done with gets pickled, the generator
+        # it was filled from is used up by then
+        state = self.__dict__.copy()
+        state["source"] = iter(())
+        state["_last"] = None
+        state["_last_index"] = -1
+        return state
+
+    def pull(self) -> bool:
+        """Add the next token from the source, False when there is none"""
+        try:
+            token_type, lexeme, line = next(self.source)
+        except StopIteration:
+            return False
+        self.append(token_type, lexeme, line)
+        return True
+
+    def append(self, token_type: TokenType, lexeme: str, line: int) -> None:
+        index = self._lexeme_ids.get(lexeme)
+        if index is None:
+            index = len(self.lexemes)
+            if token_type != TokenType.STRING:
+                lexeme = sys.intern(lexeme)
+            self.lexemes.append(lexeme)
+            self._lexeme_ids[lexeme] = index
+        self.types.append(token_type.value)
+        self.lexeme_ids.append(index)
+        self.lines.append(line)
+
+    def token(self, index: int) -> Token:
+        if index == self._last_index:
+            return self._last  # type: ignore
+        token_type = TOKEN_TYPES[self.types[index]]
+        lexeme = self.lexemes[self.lexeme_ids[index]]
+        literal = None
+        if token_type == TokenType.NUMBER:
+            literal = float(lexeme)
+        elif token_type == TokenType.STRING:
+            literal = lexeme[1:-1]
+        token = Token(token_type, lexeme, literal, self.lines[index])
+        self._last = token
+        self._last_index = index
+        return token
@@ -50,5 +50,6 @@ class TokenType(enum.Enum):
     SUPER = enum.auto()
     THIS = enum.auto()
     VAR = enum.auto()
+    CONST = enum.auto()
 
     EOF = enum.auto()
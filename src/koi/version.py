@@ -0,0 +1 @@
+VERSION = "2.0.0"
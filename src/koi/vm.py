@@ -0,0 +1,552 @@
+from typing import Any, Dict, List
+
+from .chunk import CompiledFunction
+from .compiler import Compiler
+from .environment import UNDEFINED, GlobalEnvironment
+from .koi_callable import KoiCallable
+from .koi_class import KoiClass
+from .koi_instance import KoiInstance
+from .koi_runtime_error import KoiRuntimeError
+from .opcode import OpCode
+from .stmt import Stmt
+from .std import (
+    Clock,
+    Input,
+    ReadFile,
+    WriteFile,
+    StringDataType,
+    StringInstance,
+    Println,
+    Print,
+    ToInt,
+)
+
+
+class Upvalue:
+    """
+    A variable captured by a closure. While the variable is still on the
+    stack `cells` is the VM stack itself, once closed it is a list of one.
+    """
+
+    __slots__ = ("cells", "index")
+
+    def __init__(self, cells: List, index: int) -> None:
+        self.cells = cells
+        self.index = index
+
+    def close(self) -> None:
+        self.cells = [self.cells[self.index]]
+        self.index = 0
+
+
+class Closure(KoiCallable):
+    def __init__(self, function: CompiledFunction, upvalues: List[Upvalue]) -> None:
+        self.function = function
+        self.upvalues = upvalues
+
+    def arity(self) -> int:
+        return self.function.arity
+
+    def call(self, interpreter, args: List):
+        return interpreter.call_value(self, args)
+
+    def invoke(self, interpreter, this, args: List):
+        return interpreter.call_value(BoundMethod(this, self), args)
+
+    def bind(self, instance):
+        return BoundMethod(instance, self)
+
+    def __repr__(self) -> str:
+        return repr(self.function)
+
+
+class BoundMethod(KoiCallable):
+    def __init__(self, receiver, method: Closure) -> None:
+        self.receiver = receiver
+        self.method = method
+
+    def arity(self) -> int:
+        return self.method.arity()
+
+    def call(self, interpreter, args: List):
+        return interpreter.call_value(self, args)
+
+    def __repr__(self) -> str:
+        return repr(self.method)
+
+
+class CallFrame:
+    __slots__ = ("closure", "ip", "base")
+
+    def __init__(self, closure: Closure, base: int) -> None:
+        self.closure = closure
+        self.ip = 0
+        self.base = base
+
+
+# How deep Koi calls can nest on the VM unless told otherwise
+DEFAULT_MAX_DEPTH = 100_000
+
+
+class VM:
+    """
+    A stack based virtual machine that runs the bytecode produced by the
+    `Compiler`. Koi calls push a `CallFrame` instead of recursing in Python,
+    so recursion is only limited by `max_depth`, not by the Python stack.
+    """
+
+    def __init__(self, max_depth: int = DEFAULT_MAX_DEPTH) -> None:
+        self.max_depth = max_depth
+        self.stack: List[Any] = []
+        self.frames: List[CallFrame] = []
+        self.open_upvalues: Dict[int, Upvalue] = {}
+        self.globals = GlobalEnvironment()
+
+        self.globals.define("clock", Clock())
+        self.globals.define("input", Input())
+        self.globals.define("read_file", ReadFile())
+        self.globals.define("write_file", WriteFile())
+        self.globals.define("string", StringDataType())
+        self.globals.define("print", Print())
+        self.globals.define("println", Println())
+        self.globals.define("toInt", ToInt())
+
+    def interpret(self, statements: List[Stmt]):
+        function = Compiler(self.globals).compile(statements)
+        try:
+            self.call_value(Closure(function, []), [])
+        except KoiRuntimeError as error:
+            print(error)
+            self.stack.clear()
+            self.frames.clear()
+            self.open_upvalues.clear()
+            raise SystemExit
+
+    @property
+    def depth(self) -> int:
+        """The number of Koi calls currently running"""
+        return len(self.frames)
+
+    def call_value(self, callee, args: List):
+        """Call `callee` from Python and run it until it returns"""
+        depth = len(self.frames)
+        self.stack.append(callee)
+        self.stack.extend(args)
+        if self._call(callee, len(args)):
+            self._run(depth)
+        return self.stack.pop()
+
+    def _call(self, callee, argc: int) -> bool:
+        """
+        Set up a call to `callee`, whose arguments are on top of the stack.
+        Returns True when a new frame was pushed, otherwise the result has
+        already replaced the callee and its arguments.
+        """
+        stack = self.stack
+        base = len(stack) - argc - 1
+        if isinstance(callee, Closure):
+            self._push_frame(callee, base, argc)
+            return True
+        elif isinstance(callee, BoundMethod):
+            stack[base] = callee.receiver
+            self._push_frame(callee.method, base, argc)
+            return True
+        elif isinstance(callee, KoiClass):
+            stack[base] = KoiInstance(callee)
+            initializer = callee.find_method("init")
+            if isinstance(initializer, Closure):
+                self._push_frame(initializer, base, argc)
+                return True
+            if argc != callee.arity():
+                raise KoiRuntimeError(
+                    None, f"Expected {callee.arity()} arguments but got {argc}"
+                )
+            return False
+        elif isinstance(callee, KoiCallable):
+            if argc != callee.arity():
+                raise KoiRuntimeError(
+                    None, f"Expected {callee.arity()} arguments but got {argc}"
+                )
+            args = stack[base + 1 :]
+            del stack[base:]
+            stack.append(callee.call(self, args))
+            return False
+        raise KoiRuntimeError(None, "Can only call functions and classes")
+
+    def _push_frame(self, closure: Closure, base: int, argc: int) -> None:
+        if argc != closure.function.arity:
+            raise KoiRuntimeError(
+                None, f"Expected {closure.function.arity} arguments but got {argc}"
+            )
+        if len(self.frames) >= self.max_depth:
+            raise KoiRuntimeError(
+                None, f"Stack overflow, more than {self.max_depth} nested calls"
+            )
+        self.frames.append(CallFrame(closure, base))
+
+    def _capture_upvalue(self, index: int) -> Upvalue:
+        upvalue = self.open_upvalues.get(index)
+        if upvalue is None:
+            upvalue = self.open_upvalues[index] = Upvalue(self.stack, index)
+        return upvalue
+
+    def _close_upvalues(self, last: int) -> None:
+        for index in [index for index in self.open_upvalues if index >= last]:
+            self.open_upvalues.pop(index).close()
+
+    def _invoke(self, name, argc: int) -> bool:
+        receiver = self.stack[-argc - 1]
+        if not isinstance(receiver, KoiInstance):
+            raise KoiRuntimeError(
+                name, "Can only access properties from class instances"
+            )
+        if type(receiver) is KoiInstance and name.lexeme not in receiver.shape.slots:
+            method = receiver.klass.find_method(name.lexeme)
+            if isinstance(method, Closure):
+                self._push_frame(method, len(self.stack) - argc - 1, argc)
+                return True
+        callee = receiver.get(name)
+        self.stack[-argc - 1] = callee
+        return self._call(callee, argc)
+
+    def _run(self, exit_depth: int) -> None:
+        stack = self.stack
+        frames = self.frames
+        push = stack.append
+        pop = stack.pop
+        is_truthy = self._is_truthy
+        is_equal = self._is_equal
+
+        CONSTANT = int(OpCode.CONSTANT)
+        STRING = int(OpCode.STRING)
+        NIL = int(OpCode.NIL)
+        TRUE = int(OpCode.TRUE)
+        FALSE = int(OpCode.FALSE)
+        POP = int(OpCode.POP)
+        GET_LOCAL = int(OpCode.GET_LOCAL)
+        SET_LOCAL = int(OpCode.SET_LOCAL)
+        GET_GLOBAL = int(OpCode.GET_GLOBAL)
+        DEFINE_GLOBAL = int(OpCode.DEFINE_GLOBAL)
+        SET_GLOBAL = int(OpCode.SET_GLOBAL)
+        GET_UPVALUE = int(OpCode.GET_UPVALUE)
+        SET_UPVALUE = int(OpCode.SET_UPVALUE)
+        CLOSE_UPVALUE = int(OpCode.CLOSE_UPVALUE)
+        GET_PROPERTY = int(OpCode.GET_PROPERTY)
+        SET_PROPERTY = int(OpCode.SET_PROPERTY)
+        GET_SUPER = int(OpCode.GET_SUPER)
+        EQUAL = int(OpCode.EQUAL)
+        NOT_EQUAL = int(OpCode.NOT_EQUAL)
+        GREATER = int(OpCode.GREATER)
+        GREATER_EQUAL = int(OpCode.GREATER_EQUAL)
+        LESS = int(OpCode.LESS)
+        LESS_EQUAL = int(OpCode.LESS_EQUAL)
+        ADD = int(OpCode.ADD)
+        SUBTRACT = int(OpCode.SUBTRACT)
+        MULTIPLY = int(OpCode.MULTIPLY)
+        DIVIDE = int(OpCode.DIVIDE)
+        MODULO = int(OpCode.MODULO)
+        NOT = int(OpCode.NOT)
+        NEGATE = int(OpCode.NEGATE)
+        JUMP = int(OpCode.JUMP)
+        JUMP_IF_FALSE = int(OpCode.JUMP_IF_FALSE)
+        JUMP_IF_TRUE = int(OpCode.JUMP_IF_TRUE)
+        POP_JUMP_IF_FALSE = int(OpCode.POP_JUMP_IF_FALSE)
+        LOOP = int(OpCode.LOOP)
+        CALL = int(OpCode.CALL)
+        INVOKE = int(OpCode.INVOKE)
+        CLOSURE = int(OpCode.CLOSURE)
+        RETURN = int(OpCode.RETURN)
+        CLASS = int(OpCode.CLASS)
+
+        frame = frames[-1]
+        code = frame.closure.function.chunk.code
+        constants = frame.closure.function.chunk.constants
+        upvalues = frame.closure.upvalues
+        base = frame.base
+        ip = frame.ip
+
+        try:
+            while True:
+                op = code[ip]
+                ip += 1
+
+                if op == GET_LOCAL:
+                    push(stack[base + code[ip]])
+                    ip += 1
+                elif op == CONSTANT:
+                    push(constants[code[ip]])
+                    ip += 1
+                elif op == SET_LOCAL:
+                    stack[base + code[ip]] = stack[-1]
+                    ip += 1
+                elif op == GET_GLOBAL:
+                    value = constants[code[ip]].value
+                    if value is UNDEFINED:
+                        name = constants[code[ip]].name
+                        raise KoiRuntimeError(None, f"Undefined name {name!r}")
+                    push(value)
+                    ip += 1
+                elif op == POP_JUMP_IF_FALSE:
+                    value = pop()
+                    if value is None or value is False:
+                        ip += code[ip] + 1
+                    else:
+                        ip += 1
+                elif op == POP:
+                    pop()
+                elif op == ADD:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is float and type(right) is float:
+                        stack[-1] = left + right
+                    else:
+                        stack[-1] = self._add(left, right)
+                elif op == LESS:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is float and type(right) is float:
+                        stack[-1] = left < right
+                    else:
+                        self._check_number_operands(left, right)
+                        stack[-1] = float(left) < float(right)
+                elif op == SUBTRACT:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) is float and type(right) is float:
+                        stack[-1] = left - right
+                    else:
+                        self._check_number_operands(left, right)
+                        stack[-1] = float(left) - float(right)
+                elif op == LOOP:
+                    ip -= code[ip] - 1
+                elif op == CALL:
+                    argc = code[ip]
+                    ip += 1
+                    frame.ip = ip
+                    if self._call(stack[-argc - 1], argc):
+                        frame = frames[-1]
+                        code = frame.closure.function.chunk.code
+                        constants = frame.closure.function.chunk.constants
+                        upvalues = frame.closure.upvalues
+                        base = frame.base
+                        ip = 0
+                elif op == INVOKE:
+                    name = constants[code[ip]]
+                    argc = code[ip + 1]
+                    ip += 2
+                    frame.ip = ip
+                    if self._invoke(name, argc):
+                        frame = frames[-1]
+                        code = frame.closure.function.chunk.code
+                        constants = frame.closure.function.chunk.constants
+                        upvalues = frame.closure.upvalues
+                        base = frame.base
+                        ip = 0
+                elif op == RETURN:
+                    result = pop()
+                    if self.open_upvalues:
+                        self._close_upvalues(base)
+                    frames.pop()
+                    del stack[base:]
+                    push(result)
+                    if len(frames) == exit_depth:
+                        return
+                    frame = frames[-1]
+                    code = frame.closure.function.chunk.code
+                    constants = frame.closure.function.chunk.constants
+                    upvalues = frame.closure.upvalues
+                    base = frame.base
+                    ip = frame.ip
+                elif op == GET_PROPERTY:
+                    obj = stack[-1]
+                    name = constants[code[ip]]
+                    ip += 1
+                    if not isinstance(obj, KoiInstance):
+                        raise KoiRuntimeError(
+                            name, "Can only access properties from class instances"
+                        )
+                    index = None
+                    if type(obj) is KoiInstance:
+                        index = obj.shape.slots.get(name.lexeme)
+                    if index is not None:
+                        stack[-1] = obj.values[index]
+                    else:
+                        stack[-1] = obj.get(name)
+                elif op == SET_PROPERTY:
+                    value = pop()
+                    obj = stack[-1]
+                    name = constants[code[ip]]
+                    ip += 1
+                    if not isinstance(obj, KoiInstance):
+                        raise KoiRuntimeError(
+                            name, "Must be an instance to have fields"
+                        )
+                    obj.set(name, value)
+                    stack[-1] = value
+                elif op == GET_UPVALUE:
+                    upvalue = upvalues[code[ip]]
+                    ip += 1
+                    push(upvalue.cells[upvalue.index])
+                elif op == SET_UPVALUE:
+                    upvalue = upvalues[code[ip]]
+                    ip += 1
+                    upvalue.cells[upvalue.index] = stack[-1]
+                elif op == STRING:
+                    push(StringInstance(constants[code[ip]]))
+                    ip += 1
+                elif op == NIL:
+                    push(None)
+                elif op == TRUE:
+                    push(True)
+                elif op == FALSE:
+                    push(False)
+                elif op == SET_GLOBAL:
+                    cell = constants[code[ip]]
+                    ip += 1
+                    if cell.value is UNDEFINED:
+                        raise KoiRuntimeError(
+                            None,
+                            f"Cannot assign to variable {cell.name!r} before it was declared.",
+                        )
+                    cell.value = stack[-1]
+                elif op == DEFINE_GLOBAL:
+                    constants[code[ip]].value = pop()
+                    ip += 1
+                elif op == JUMP:
+                    ip += code[ip] + 1
+                elif op == JUMP_IF_FALSE:
+                    if is_truthy(stack[-1]):
+                        ip += 1
+                    else:
+                        ip += code[ip] + 1
+                elif op == JUMP_IF_TRUE:
+                    if is_truthy(stack[-1]):
+                        ip += code[ip] + 1
+                    else:
+                        ip += 1
+                elif op == EQUAL:
+                    right = pop()
+                    stack[-1] = is_equal(stack[-1], right)
+                elif op == NOT_EQUAL:
+                    right = pop()
+                    stack[-1] = not is_equal(stack[-1], right)
+                elif op == GREATER:
+                    right = pop()
+                    left = stack[-1]
+                    self._check_number_operands(left, right)
+                    stack[-1] = float(left) > float(right)
+                elif op == GREATER_EQUAL:
+                    right = pop()
+                    left = stack[-1]
+                    self._check_number_operands(left, right)
+                    stack[-1] = float(left) >= float(right)
+                elif op == LESS_EQUAL:
+                    right = pop()
+                    left = stack[-1]
+                    self._check_number_operands(left, right)
+                    stack[-1] = float(left) <= float(right)
+                elif op == MULTIPLY:
+                    right = pop()
+                    left = stack[-1]
+                    self._check_number_operands(left, right)
+                    stack[-1] = float(left) * float(right)
+                elif op == DIVIDE:
+                    right = pop()
+                    left = stack[-1]
+                    if right == 0:
+                        raise KoiRuntimeError(right, f"Cannot divide {left} by zero")
+                    self._check_number_operands(left, right)
+                    stack[-1] = float(left) / float(right)
+                elif op == MODULO:
+                    right = pop()
+                    stack[-1] = float(stack[-1]) % float(right)
+                elif op == NOT:
+                    stack[-1] = not is_truthy(stack[-1])
+                elif op == NEGATE:
+                    operand = stack[-1]
+                    if not isinstance(operand, (int, float)):
+                        raise KoiRuntimeError(
+                            None, f"Operand {operand} must be a number"
+                        )
+                    stack[-1] = -int(operand)
+                elif op == CLOSURE:
+                    function = constants[code[ip]]
+                    ip += 1
+                    captured = []
+                    for _ in range(function.upvalue_count):
+                        is_local = code[ip]
+                        index = code[ip + 1]
+                        ip += 2
+                        if is_local:
+                            captured.append(self._capture_upvalue(base + index))
+                        else:
+                            captured.append(upvalues[index])
+                    push(Closure(function, captured))
+                elif op == CLOSE_UPVALUE:
+                    self._close_upvalues(len(stack) - 1)
+                    pop()
+                elif op == GET_SUPER:
+                    name = constants[code[ip]]
+                    ip += 1
+                    superclass = pop()
+                    method = superclass.find_method(name.lexeme)
+                    if method is None:
+                        raise KoiRuntimeError(
+                            name, f"Undefined property {name.lexeme!r}"
+                        )
+                    stack[-1] = method.bind(stack[-1])
+                elif op == CLASS:
+                    name = constants[code[ip]]
+                    count = code[ip + 1]
+                    has_superclass = code[ip + 2]
+                    ip += 3
+                    methods = {}
+                    if count:
+                        for closure in stack[-count:]:
+                            methods[closure.function.name] = closure
+                        del stack[-count:]
+                    superclass = None
+                    if has_superclass:
+                        superclass = stack[-1]
+                        if not isinstance(superclass, KoiClass):
+                            raise KoiRuntimeError(None, "Superclass must a class")
+                    push(KoiClass(name, superclass, methods))
+                else:
+                    raise KoiRuntimeError(None, f"Unknown opcode {op}")
+        except KoiRuntimeError as error:
+            # Errors are raised without a token, they get the one of the
+            # instruction that was running
+            if error.token is None:
+                error.token = frame.closure.function.chunk.tokens[ip - 1]
+            raise
+
+    @staticmethod
+    def _is_truthy(obj) -> bool:
+        if obj is None:
+            return False
+        elif isinstance(obj, bool):
+            return bool(obj)
+        return True
+
+    @staticmethod
+    def _is_equal(left, right) -> bool:
+        if left is None and right is None:
+            return True
+        elif left is None:
+            return False
+
+        return left == right
+
+    @staticmethod
+    def _check_number_operands(left, right):
+        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+            return
+        raise KoiRuntimeError(None, "Operands must be numbers")
+
+    @staticmethod
+    def _add(left, right):
+        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+            return float(left) + float(right)
+        elif isinstance(left, str) or isinstance(left, StringInstance):
+            return str(left) + str(right)
+        raise KoiRuntimeError(None, "Both operands must be either numbers or string")